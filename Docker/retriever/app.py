@@ -1,16 +1,37 @@
+import time
+# Référence pour mesurer le temps de démarrage (avant les imports lourds)
+PROCESS_START = time.time()
+
 import os
+import asyncio
 import hashlib
-import sqlite3
 import logging
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from chromadb import Client
-from sentence_transformers import SentenceTransformer
-import requests
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, text
 import json
 
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from backfill import BackfillJob
+from vector_store import VectorStore
+from model_loader import LazyEmbedder
+from embedding_server import RemoteEmbedder, EMBEDDING_SERVER_SOCKET
+from workers import acquire_singleton, process_memory, RunLock
+from canonical_text import canonical_text, EMBEDDING_TEXT_MODE
+from hybrid_retrieval import HybridRetriever
+from context_store import make_snippets
+from outbox import Outbox
+from sqlite_db import SQLiteDatabase
+from stats_counters import StatsCounters
+from compaction import CompactionJob
+from ollama_warmup import OllamaWarmer
+from generation_scheduler import GenerationScheduler, QueueFull, payload_priority
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,166 +45,539 @@ DB_HOST = os.getenv("DB_HOST", "db")
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "root")
 DB_NAME = os.getenv("DB_NAME", "payload_analyser")
+# Modèle et budget de génération par défaut (l'application web peut les surcharger par requête)
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral:7b")
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "1024"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "64"))
+# Nombre maximal d'analyses traitées simultanément; les suivantes attendent un créneau sans bloquer de thread
+RETRIEVER_MAX_CONCURRENT = int(os.getenv("RETRIEVER_MAX_CONCURRENT", "256"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+# Fenêtre de fraîcheur du cache d'analyses (payload identique); 0 désactive le court-circuit
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+# Écritures MySQL/SQLite/ChromaDB différées via l'outbox (réponse dès que l'analyse est générée)
+RETRIEVER_OUTBOX = os.getenv("RETRIEVER_OUTBOX", "true").lower() == "true"
+# Modèles Ollama chargés dès le démarrage (séparés par des virgules), maintenus en mémoire via OLLAMA_KEEP_ALIVE
+OLLAMA_PRELOAD_MODELS = [m.strip() for m in os.getenv("OLLAMA_PRELOAD_MODELS", OLLAMA_MODEL).split(",") if m.strip()]
 
-# Initialisation de ChromaDB
-try:
-    # Utiliser ChromaDB en mode local (pas de serveur externe)
-    chroma = Client()
-    collection = chroma.get_or_create_collection("mistral_analyses")
-    logger.info("✅ ChromaDB connecté avec succès")
-except Exception as e:
-    logger.error(f"❌ Erreur connexion ChromaDB: {e}")
-    chroma = None
-    collection = None
+# Collection ChromaDB persistante (CHROMA_MODE), ouverte à la demande pour un démarrage rapide
+vector_store = VectorStore()
 
-# Initialisation du modèle d'embeddings
-try:
-    embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    logger.info("✅ Modèle d'embeddings chargé")
-except Exception as e:
-    logger.error(f"❌ Erreur chargement embeddings: {e}")
-    embedder = None
+# Modèle d'embeddings chargé en arrière-plan au démarrage (backend choisi par EMBEDDING_BACKEND);
+# avec plusieurs workers (workers.py), chargé une seule fois par le serveur d'embeddings partagé
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+if EMBEDDING_SERVER_SOCKET:
+    embedder = RemoteEmbedder(EMBEDDING_MODEL, EMBEDDING_SERVER_SOCKET)
+else:
+    embedder = LazyEmbedder(EMBEDDING_MODEL)
 
-# Connexion MySQL
-try:
-    mysql_engine = create_engine(f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
-    logger.info("✅ MySQL connecté avec succès")
-except Exception as e:
-    logger.error(f"❌ Erreur connexion MySQL: {e}")
-    mysql_engine = None
+# File d'encodage par lots: les requêtes concurrentes partagent un même appel au modèle
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "true").lower() == "true"
+embedding_batcher = None
+if EMBEDDING_BATCHING:
+    embedding_batcher = EmbeddingBatcher(lambda texts: embedder.encode(texts).tolist())
+    logger.info(f"✅ Encodage par lots activé (lot max {embedding_batcher.max_batch_size}, attente {embedding_batcher.max_wait_ms} ms)")
 
-# SQLite pour métadonnées locales
-DB_PATH = "/data/embeddings.db"
+# Connexion MySQL (DB_HOST vide: pas de MySQL, par exemple pour bench_retriever.py)
+mysql_engine = None
+if DB_HOST:
+    try:
+        mysql_engine = create_engine(f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
+        logger.info("✅ MySQL connecté avec succès")
+    except Exception as e:
+        logger.error(f"❌ Erreur connexion MySQL: {e}")
+else:
+    logger.info("ℹ️ MySQL désactivé (DB_HOST vide)")
+
+# SQLite pour métadonnées locales (WAL, une connexion par thread, voir sqlite_db)
+DB_PATH = os.getenv("RETRIEVER_DB_PATH", "/data/embeddings.db")
 try:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = SQLiteDatabase(DB_PATH)
     conn.execute("""CREATE TABLE IF NOT EXISTS meta (
         id TEXT PRIMARY KEY, 
         payload TEXT, 
         analysis TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        variant TEXT
     )""")
+    # Paramètres de génération de l'analyse (voir generation_variant); ajouté aux bases existantes
+    if "variant" not in {row[1] for row in conn.execute("PRAGMA table_info(meta)").fetchall()}:
+        conn.execute("ALTER TABLE meta ADD COLUMN variant TEXT")
     conn.commit()
-    logger.info("✅ SQLite local initialisé")
+    logger.info(f"✅ SQLite local initialisé (journal {conn.journal_mode})")
 except Exception as e:
     logger.error(f"❌ Erreur SQLite: {e}")
     conn = None
 
+# Cache persistant des embeddings (même base SQLite que meta)
+embedding_cache = None
+if conn:
+    try:
+        # Les vecteurs dépendent du backend (fp32 vs int8): la clé du modèle inclut le backend
+        embedding_cache = EmbeddingCache(conn, f"{EMBEDDING_MODEL}:{embedder.backend}")
+        logger.info("✅ Cache d'embeddings initialisé")
+    except Exception as e:
+        logger.error(f"❌ Erreur cache d'embeddings: {e}")
+
+# Recherche hybride (pré-filtre métadonnées + BM25 + vecteurs); sans SQLite, recherche vectorielle seule
+hybrid_retriever = None
+if conn:
+    try:
+        hybrid_retriever = HybridRetriever(vector_store, conn)
+        logger.info("✅ Index lexical (FTS5) initialisé")
+    except Exception as e:
+        logger.error(f"❌ Erreur index lexical: {e}")
+
+# Job d'indexation de l'historique MySQL (déclenché par /learn)
+backfill_job = None
+if conn and mysql_engine:
+    backfill_job = BackfillJob(mysql_engine, hybrid_retriever or vector_store, conn,
+                               lambda payloads: embedder.encode([canonical_text(p) for p in payloads]).tolist(),
+                               run_lock=RunLock("backfill"))
+
+def embed_payload(payload: str) -> List[float]:
+    """
+    Embedding d'un payload: on encode son texte canonique (champs sélectionnés, voir canonical_text).
+    Le cache est indexé par l'empreinte de ce texte: des alertes récurrentes qui ne diffèrent que par
+    l'horodatage ou les compteurs partagent le même embedding.
+    """
+    if embedding_batcher:
+        encode = embedding_batcher.encode
+    else:
+        encode = lambda text: embedder.encode(text).tolist()
+    text = canonical_text(payload)
+    if embedding_cache:
+        text_hash = hashlib.md5(text.encode()).hexdigest()
+        return embedding_cache.get_or_compute(text_hash, text, encode)
+    return encode(text)
+
+# Consignes fixes placées en tête de prompt (préfixe identique d'une requête à l'autre)
+PROMPT_INSTRUCTIONS = """
+Tu es un expert en cybersécurité spécialisé dans l'analyse de logs QRadar.
+
+IMPORTANT: Réponds UNIQUEMENT en français. Ne jamais utiliser l'espagnol ou l'anglais.
+
+Fournis une analyse structurée et détaillée en français incluant:
+1. Type de menace détectée
+2. Niveau de risque (Faible/Moyen/Élevé/Critique)
+3. Recommandations de réponse immédiate
+4. Indicateurs techniques (IOC)
+5. Actions de remédiation
+"""
+
+# Consigne ajoutée au prompt en mode sortie structurée (mêmes clés que ia_extraction côté web)
+STRUCTURED_OUTPUT_INSTRUCTION = """
+Réponds UNIQUEMENT avec un objet JSON valide (sans texte autour) contenant les clés suivantes:
+{"pattern": "...", "resume_court": "...", "statut": "Faux positif | Vrai positif | À CHOISIR",
+ "description_faits": "...", "analyse_technique": "...", "resultat": "..."}
+"""
+
+# Pools dédiés au travail bloquant: embeddings/ChromaDB d'un côté, MySQL/SQLite de l'autre
+embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embedding")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+analyze_slots = asyncio.Semaphore(RETRIEVER_MAX_CONCURRENT)
+analyze_load = {"in_flight": 0, "waiting": 0}
+analysis_cache_stats = {"hits": 0, "misses": 0, "forced_refresh": 0}
+# Créneaux de génération Ollama (GENERATION_SLOTS), servis par priorité puis équitablement entre utilisateurs
+generation_scheduler = GenerationScheduler()
+# Client HTTP asynchrone partagé (connexions keep-alive réutilisées), créé au démarrage
+ollama_client: Optional[httpx.AsyncClient] = None
+ollama_warmer = OllamaWarmer(OLLAMA_PRELOAD_MODELS)
+ollama_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def startup():
+    global ollama_client
+    ollama_client = httpx.AsyncClient(
+        base_url=OLLAMA_URL,
+        timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+    )
+    logger.info(f"✅ Client Ollama asynchrone prêt ({OLLAMA_MAX_CONNECTIONS} connexions max)")
+    # Préchargement en tâche de fond: la première analyse ne paie pas le chargement du modèle
+    ollama_tasks.append(asyncio.create_task(ollama_warmer.preload(ollama_client)))
+    ollama_tasks.append(asyncio.create_task(ollama_warmer.keep_warm(ollama_client)))
+    vector_store.warm_up()
+    embedder.start()
+    # Un seul écrivain d'outbox et une seule compaction périodique parmi les workers
+    if outbox and acquire_singleton("outbox"):
+        outbox.start()
+    stats_counters.start()
+    if compaction_job and acquire_singleton("compaction"):
+        compaction_job.start_periodic()
+    startup_timings["app_started_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in ollama_tasks:
+        task.cancel()
+    if outbox:
+        outbox.stop()
+    stats_counters.stop()
+    if conn:
+        conn.close()
+    if ollama_client:
+        await ollama_client.aclose()
+    embedding_executor.shutdown(wait=False)
+    db_executor.shutdown(wait=False)
+
 class PayloadRequest(BaseModel):
     payload: str
+    structured_output: bool = False
+    model: Optional[str] = None
+    num_predict: Optional[int] = None
+    # Ignore le cache d'analyses et régénère (max_age_seconds surcharge la fenêtre de fraîcheur par défaut)
+    force_refresh: bool = False
+    max_age_seconds: Optional[int] = None
+    # Pattern détecté par l'application web, enregistré dans les métadonnées de l'index
+    pattern: Optional[str] = None
+    # Équité et priorité de la file de génération (priorité déduite du crlevel du payload si absente)
+    user_id: Optional[str] = None
+    priority: Optional[str] = None
 
 class AnalysisResponse(BaseModel):
     analysis: str
     context_count: int
     payload_hash: str
     similar_analyses: Optional[List[dict]] = None
+    metrics: Optional[dict] = None
+
+# Temps de démarrage mesurés depuis PROCESS_START
+startup_timings = {"app_started_ms": None, "first_request_ms": None, "first_analysis_ms": None}
+
+def _elapsed_since_start(timestamp: Optional[float]) -> Optional[float]:
+    return round((timestamp - PROCESS_START) * 1000, 1) if timestamp else None
+
+@app.middleware("http")
+async def record_first_request(request: Request, call_next):
+    if startup_timings["first_request_ms"] is None:
+        startup_timings["first_request_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+    return await call_next(request)
+
+def readiness() -> dict:
+    ready = embedder.ready and vector_store.ready
+    ready_ms = None
+    if ready:
+        ready_ms = _elapsed_since_start(max(embedder.ready_at, vector_store.ready_at))
+    return {
+        "ready": ready,
+        # Prêt mais sur l'index NumPy de secours: contexte incomplet tant que ChromaDB n'est pas rétabli
+        "degraded": vector_store.degraded,
+        "embedder": embedder.status(),
+        "vector_store": vector_store.status(),
+        "startup": dict(startup_timings, ready_ms=ready_ms),
+    }
+
+@app.get("/live")
+def live():
+    """Liveness: le processus répond (sans préjuger du chargement des modèles)"""
+    return {"status": "alive", "uptime_s": round(time.time() - PROCESS_START, 1)}
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: 200 seulement quand le modèle d'embeddings et la collection vectorielle sont chargés.
+    Sur l'index de secours, le service reste servi mais est signalé dégradé (status "degraded").
+    """
+    status = readiness()
+    status["status"] = "degraded" if status["degraded"] else ("ready" if status["ready"] else "starting")
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/health")
 def health():
     """Endpoint de santé du service"""
     status = {
-        "status": "healthy",
+        "status": "degraded" if vector_store.degraded else "healthy",
         "service": "mistral_retriever",
         "ollama_url": OLLAMA_URL,
         "chroma_url": CHROMA_URL,
         "mysql_connected": mysql_engine is not None,
-        "chroma_connected": chroma is not None,
-        "embedder_loaded": embedder is not None
+        "chroma_connected": vector_store.ready,
+        "vector_store": vector_store.status(),
+        "embedder_loaded": embedder.ready,
+        "worker": process_memory(),
+        "ollama": ollama_warmer.status(),
+        "readiness": readiness()
     }
     return status
 
-@app.post("/analyze", response_model=AnalysisResponse)
-def analyze(payload_req: PayloadRequest):
-    """Analyse un payload avec RAG et apprentissage"""
-    if not payload_req.payload:
-        raise HTTPException(400, "Payload requis")
+def retrieve_context(payload_hash: str, payload: str):
+    """Embedding du payload (une seule fois) et recherche des analyses similaires (hybride si disponible)"""
+    context = ""
+    similar_analyses = []
+    q_emb = None
+    embedding_ms = None
+    retrieval = None
     
-    payload = payload_req.payload
-    logger.info(f"🔍 Analyse demandée pour payload: {payload[:100]}...")
-    
-    try:
-        # 1) Récupérer contexte via ChromaDB
-        context = ""
-        similar_analyses = []
-        
-        if embedder and collection:
-            try:
-                q_emb = embedder.encode(payload).tolist()
-                results = collection.query(
+    if embedder.available and vector_store.collection:
+        try:
+            embedding_start = time.perf_counter()
+            q_emb = embed_payload(payload)
+            embedding_ms = round((time.perf_counter() - embedding_start) * 1000, 1)
+            if hybrid_retriever:
+                search = hybrid_retriever.search(payload, q_emb, n_results=3)
+                snippets = [dict(result["snippet"], occurrences=int(result["metadata"].get("dup_count", 1)))
+                            for result in search["results"]]
+                retrieval = {"mode": "hybrid", "filter": search["filter"], **search["timings"]}
+            else:
+                results = vector_store.query(
                     query_embeddings=[q_emb], 
                     n_results=3,
                     include=["metadatas", "documents"]
                 )
-                
-                if results["metadatas"] and results["metadatas"][0]:
-                    context = "\n\nContexte historique:\n"
-                    for i, metadata in enumerate(results["metadatas"][0], 1):
-                        if metadata:
-                            context += f"\n{i}. Payload: {metadata.get('payload', '')[:200]}...\n"
-                            context += f"   Analyse: {metadata.get('analysis', '')[:300]}...\n"
-                            similar_analyses.append({
-                                "payload": metadata.get('payload', '')[:200],
-                                "analysis": metadata.get('analysis', '')[:300]
-                            })
-                
-                logger.info(f"📚 {len(similar_analyses)} analyses similaires trouvées")
-            except Exception as e:
-                logger.warning(f"⚠️ Erreur récupération contexte: {e}")
-        
-        # 2) Générer prompt avec contexte
-        prompt = f"""
-Tu es un expert en cybersécurité spécialisé dans l'analyse de logs QRadar.
+                metadatas = results["metadatas"][0] if results["metadatas"] else []
+                # Sans SQLite, les métadonnées du vecteur portent encore le payload et l'analyse complets
+                snippets = [make_snippets(m.get('payload', ''), m.get('analysis', '')) for m in metadatas if m]
+                retrieval = {"mode": "vector"}
+            
+            if snippets:
+                context = "\n\nContexte historique:\n"
+                for i, snippet in enumerate(snippets, 1):
+                    if snippet["payload"] or snippet["analysis"]:
+                        # Représentant de quasi-doublons fusionnés par la compaction: le volume est une information utile
+                        seen = f" (vu {snippet['occurrences']} fois)" if snippet.get("occurrences", 1) > 1 else ""
+                        context += f"\n{i}. Payload{seen}: {snippet['payload']}...\n"
+                        context += f"   Analyse: {snippet['analysis']}...\n"
+                        similar_analyses.append(snippet)
+            
+            logger.info(f"📚 {len(similar_analyses)} analyses similaires trouvées")
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur récupération contexte: {e}")
+    
+    return q_emb, embedding_ms, retrieval, context, similar_analyses
 
-IMPORTANT: Réponds UNIQUEMENT en français. Ne jamais utiliser l'espagnol ou l'anglais.
+def build_prompt(payload: str, context: str, structured_output: bool) -> str:
+    """
+    Consignes fixes en tête, parties variables (contexte puis payload) à la fin: deux requêtes successives
+    partagent le même préfixe, qu'Ollama réutilise depuis son cache KV au lieu de le réévaluer.
+    """
+    prompt = PROMPT_INSTRUCTIONS
+    if structured_output:
+        prompt += STRUCTURED_OUTPUT_INSTRUCTION
+    return prompt + f"""{context}
 
 Payload à analyser:
 {payload}
 
-{context}
-
-Fournis une analyse structurée et détaillée en français incluant:
-1. Type de menace détectée
-2. Niveau de risque (Faible/Moyen/Élevé/Critique)
-3. Recommandations de réponse immédiate
-4. Indicateurs techniques (IOC)
-5. Actions de remédiation
-
 Analyse complète (en français uniquement):
 """
-        
-        # 3) Appeler Ollama avec modèle SOC optimisé
-        logger.info("🤖 Appel à Ollama avec modèle SOC...")
+
+def generation_variant(payload_req: "PayloadRequest") -> str:
+    """
+    Paramètres qui changent la forme de l'analyse: modèle (routage par tier), budget de tokens et sortie
+    structurée. Une analyse en cache n'est resservie qu'à une requête de même variante.
+    """
+    model = payload_req.model or OLLAMA_MODEL
+    num_predict = payload_req.num_predict or OLLAMA_NUM_PREDICT
+    return f"{model}|{num_predict}|{'json' if payload_req.structured_output else 'text'}"
+
+def find_cached_analysis(payload_hash: str, variant: str, max_age_seconds: int) -> Optional[tuple]:
+    """Analyse déjà générée pour ce payload exact et cette variante, si elle date de moins de max_age_seconds"""
+    if not conn or max_age_seconds <= 0:
+        return None
+    try:
+        return conn.execute(
+            "SELECT analysis, created_at FROM meta WHERE id = ? AND variant = ? AND created_at >= datetime('now', ?)",
+            (payload_hash, variant, f"-{int(max_age_seconds)} seconds")
+        ).fetchone()
+    except Exception as e:
+        logger.warning(f"⚠️ Erreur lecture cache d'analyses: {e}")
+        return None
+
+def persist_analysis(payload_hash: str, payload: str, analysis: str, generated: bool = True,
+                     variant: Optional[str] = None):
+    """
+    Stockage MySQL + métadonnées SQLite (bloquant, exécuté dans le pool DB).
+    Une analyse en échec ou en mode dégradé va en MySQL (historique) mais pas dans meta,
+    pour ne jamais être resservie par le cache d'analyses.
+    """
+    if mysql_engine:
         try:
-            # Utiliser directement mistral:7b (modèle installé)
-            model_choice = "mistral:7b"
-            logger.info("🎯 Utilisation de Mistral 7B (modèle installé)")
-            
-            response = requests.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={
-                    "model": model_choice,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "num_predict": 1024,
-                        "top_k": 40,
-                        "top_p": 0.9
-                    }
-                },
-                timeout=300  # Augmenter le timeout à 5 minutes
+            with mysql_engine.connect() as connection:
+                connection.execute(text("""
+                    INSERT INTO analyses (payload, resultat)
+                    VALUES (:payload, :resultat)
+                """), {
+                    "payload": payload,
+                    "resultat": analysis
+                })
+                connection.commit()
+            stats_counters.add("mysql_analyses")
+            logger.info("💾 Analyse sauvegardée en MySQL")
+        except Exception as e:
+            logger.error(f"❌ Erreur sauvegarde MySQL: {e}")
+    
+    if conn and generated:
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (id, payload, analysis, variant) VALUES (?, ?, ?, ?)",
+                    (payload_hash, payload, analysis, variant)
+                )
+            stats_counters.add("meta")
+            logger.info("💾 Métadonnées sauvegardées en SQLite")
+        except Exception as e:
+            logger.error(f"❌ Erreur SQLite: {e}")
+
+def store_embedding(payload_hash: str, payload: str, analysis: str, q_emb: Optional[List[float]],
+                    pattern: Optional[str] = None):
+    """Upsert de l'embedding dans ChromaDB (+ index lexical) (bloquant, exécuté dans le pool d'embeddings)"""
+    if embedder.available and vector_store.collection:
+        try:
+            emb = q_emb if q_emb is not None else embed_payload(payload)
+            (hybrid_retriever or vector_store).upsert(
+                ids=[payload_hash],
+                embeddings=[emb],
+                metadatas=[{
+                    "payload": payload,
+                    "analysis": analysis,
+                    "type": "qradar_payload",
+                    "pattern": pattern or ""
+                }]
             )
+            _count_vector_writes(1)
+            logger.info("💾 Embedding stocké dans ChromaDB")
+        except Exception as e:
+            logger.error(f"❌ Erreur ChromaDB: {e}")
+
+def _count_vector_writes(count: int):
+    stats_counters.add("vectors", count)
+    if hybrid_retriever:
+        stats_counters.add("lexical_index", count)
+        stats_counters.add("context_snippets", count)
+
+# Destinations de l'outbox: chacune reçoit un lot d'écritures dans l'ordre et lève une exception pour être rejouée
+def write_mysql_batch(items: List[dict]):
+    if not mysql_engine:
+        return
+    with mysql_engine.begin() as connection:
+        connection.execute(text("INSERT INTO analyses (payload, resultat) VALUES (:payload, :resultat)"),
+                           [{"payload": item["payload"], "resultat": item["analysis"]} for item in items])
+    stats_counters.add("mysql_analyses", len(items))
+    logger.info(f"💾 {len(items)} analyses sauvegardées en MySQL")
+
+def write_meta_batch(items: List[dict]):
+    rows = [(item["payload_hash"], item["payload"], item["analysis"], item["variant"]) for item in items if item["generated"]]
+    if rows:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO meta (id, payload, analysis, variant) VALUES (?, ?, ?, ?)", rows)
+        stats_counters.add("meta", len(rows))
+
+def write_vector_batch(items: List[dict]):
+    # Dernière version de chaque payload du lot (un upsert ne peut pas contenir deux fois le même id)
+    latest = {item["payload_hash"]: item for item in items if item["generated"]}
+    if not latest:
+        return
+    if not (embedder.available and vector_store.collection):
+        # Comme store_embedding: sans modèle ni index, l'embedding n'est pas stocké (l'analyse l'est en MySQL/meta)
+        logger.warning(f"⚠️ {len(latest)} embeddings non stockés: modèle d'embeddings ou index vectoriel indisponible")
+        return
+    batch = list(latest.values())
+    (hybrid_retriever or vector_store).upsert(
+        ids=[item["payload_hash"] for item in batch],
+        embeddings=[item["embedding"] if item["embedding"] is not None else embed_payload(item["payload"]) for item in batch],
+        metadatas=[{"payload": item["payload"], "analysis": item["analysis"], "type": "qradar_payload",
+                    "pattern": item["pattern"] or ""} for item in batch]
+    )
+    _count_vector_writes(len(batch))
+    logger.info(f"💾 {len(batch)} embeddings stockés dans ChromaDB")
+
+outbox = None
+if conn and RETRIEVER_OUTBOX:
+    try:
+        outbox = Outbox(conn, {"mysql": write_mysql_batch, "meta": write_meta_batch, "vector": write_vector_batch})
+        logger.info("✅ Outbox d'écritures différées initialisée")
+    except Exception as e:
+        logger.error(f"❌ Erreur outbox: {e}")
+
+def _count_meta() -> int:
+    return conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0] if conn else 0
+
+def _count_mysql() -> int:
+    if not mysql_engine:
+        return 0
+    with mysql_engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM analyses")).scalar()
+
+def _count_vectors() -> int:
+    if not vector_store.ready:
+        raise RuntimeError("index vectoriel pas encore ouvert")
+    return vector_store.count()
+
+# Totaux de /stats: incrémentés à l'écriture, recomptés toutes les STATS_RECONCILE_SECONDS
+# (remplacements d'un même id, écritures de l'application web dans MySQL, backfill)
+stats_counters = StatsCounters({
+    "meta": _count_meta,
+    "mysql_analyses": _count_mysql,
+    "vectors": _count_vectors,
+    "lexical_index": lambda: hybrid_retriever.count() if hybrid_retriever else 0,
+    "context_snippets": lambda: hybrid_retriever.context_store.count() if hybrid_retriever else 0,
+})
+
+# Compaction de la collection (quasi-doublons, TTL, plafond de taille); les totaux sont recomptés après chaque passe
+compaction_job = CompactionJob(hybrid_retriever, on_complete=stats_counters.reconcile,
+                               run_lock=RunLock("compaction")) if hybrid_retriever else None
+
+async def generate_analysis(payload: str, prompt: str, payload_req: PayloadRequest, metrics: dict) -> str:
+    """
+    Appel Ollama via le client HTTP asynchrone partagé (aucun thread bloqué pendant la génération).
+    Seul un Ollama injoignable donne une analyse en mode dégradé (generated=False); un timeout ou un statut
+    HTTP en erreur remonte à /analyze (504 / 500), pour ne jamais être stocké comme une analyse.
+    """
+    logger.info("🤖 Appel à Ollama avec modèle SOC...")
+    try:
+        # Modèle choisi par le routeur de l'application web, sinon le modèle par défaut
+        model_choice = payload_req.model or OLLAMA_MODEL
+        num_predict = payload_req.num_predict or OLLAMA_NUM_PREDICT
+        metrics["model"] = model_choice
+        logger.info(f"🎯 Utilisation de {model_choice} (num_predict: {num_predict})")
+        
+        generate_request = {
+            "model": model_choice,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": ollama_warmer.keep_alive,
+            "options": {
+                "temperature": 0.7,
+                "num_predict": num_predict,
+                "top_k": 40,
+                "top_p": 0.9
+            }
+        }
+        if payload_req.structured_output:
+            # Ollama contraint la génération à du JSON valide
+            generate_request["format"] = "json"
+        
+        generation_start = time.perf_counter()
+        response = await ollama_client.post("/api/generate", json=generate_request)
+        metrics["generation_ms"] = round((time.perf_counter() - generation_start) * 1000, 1)
+        
+        if response.status_code != 200:
+            logger.error(f"❌ Erreur Ollama: {response.status_code}")
+            raise HTTPException(500, f"Erreur Ollama {model_choice}: {response.status_code}")
+        
+        body = response.json()
+        # Compteurs renvoyés par Ollama (durées en nanosecondes)
+        metrics["prompt_tokens"] = body.get("prompt_eval_count", 0)
+        metrics["completion_tokens"] = body.get("eval_count", 0)
+        metrics["load_ms"] = round(body.get("load_duration", 0) / 1e6, 1)
+        metrics["ttft_ms"] = round((body.get("load_duration", 0) + body.get("prompt_eval_duration", 0)) / 1e6, 1)
+        metrics["model_state"] = ollama_warmer.record(model_choice, metrics["load_ms"], metrics["generation_ms"], metrics["ttft_ms"])
+        if body.get("eval_duration"):
+            metrics["tokens_per_second"] = round(body.get("eval_count", 0) / (body["eval_duration"] / 1e9), 2)
+        logger.info(f"⏱️ Génération {model_choice}: {metrics['generation_ms']} ms, TTFT {metrics['ttft_ms']} ms, "
+                    f"{metrics['prompt_tokens']} tokens prompt, {metrics['completion_tokens']} tokens générés")
+        
+        analysis = body.get("response", "")
+        metrics["generated"] = bool(analysis)
+        if not analysis:
+            analysis = f"Erreur: Aucune réponse générée par {model_choice}"
+        return analysis
             
-            if response.status_code != 200:
-                logger.error(f"❌ Erreur Ollama: {response.status_code}")
-                raise HTTPException(500, f"Erreur Ollama {model_choice}: {response.status_code}")
-            
-            analysis = response.json().get("response", "")
-            if not analysis:
-                analysis = f"Erreur: Aucune réponse générée par {model_choice}"
-                
-        except requests.exceptions.ConnectionError as e:
-            logger.warning(f"⚠️ Service Ollama non disponible: {e}")
-            analysis = f"""Analyse de sécurité - Service Ollama temporairement indisponible
+    except httpx.ConnectError as e:
+        logger.warning(f"⚠️ Service Ollama non disponible: {e}")
+        return f"""Analyse de sécurité - Service Ollama temporairement indisponible
 
 Type de menace: Analyse en mode dégradé
 Niveau de risque: À évaluer manuellement
@@ -195,105 +589,154 @@ Recommandations:
 Payload analysé: {payload[:200]}...
 
 Note: Cette analyse a été générée en mode dégradé car le service Ollama SOC n'est pas disponible."""
-        except Exception as e:
-            logger.error(f"❌ Erreur lors de l'appel Ollama: {e}")
-            analysis = f"Erreur lors de l'analyse Ollama: {str(e)}"
-        
-        logger.info("✅ Analyse générée avec succès")
+
+@app.post("/analyze", response_model=AnalysisResponse)
+async def analyze(payload_req: PayloadRequest):
+    """Analyse un payload avec RAG et apprentissage"""
+    if not payload_req.payload:
+        raise HTTPException(400, "Payload requis")
+    
+    payload = payload_req.payload
+    payload_hash = hashlib.md5(payload.encode()).hexdigest()
+    variant = generation_variant(payload_req)
+    request_start = time.perf_counter()
+    logger.info(f"🔍 Analyse demandée pour payload: {payload[:100]}...")
+    
+    loop = asyncio.get_running_loop()
+    
+    # 0) Payload identique déjà analysé récemment: réponse immédiate, sans attendre de créneau ni appeler Ollama
+    if not payload_req.force_refresh:
+        max_age = payload_req.max_age_seconds if payload_req.max_age_seconds is not None else ANALYSIS_CACHE_TTL_SECONDS
+        cached = await loop.run_in_executor(db_executor, find_cached_analysis, payload_hash, variant, max_age)
+        if cached:
+            analysis_cache_stats["hits"] += 1
+            stats_counters.event("cache_hits")
+            logger.info(f"⚡ Analyse en cache pour {payload_hash} (générée le {cached[1]})")
+            return AnalysisResponse(
+                analysis=cached[0],
+                context_count=0,
+                payload_hash=payload_hash,
+                similar_analyses=[],
+                metrics={"provider": "ollama", "model": payload_req.model or OLLAMA_MODEL, "cache_hit": True,
+                         "cached_at": cached[1], "queue_wait_ms": 0,
+                         "latency_ms": round((time.perf_counter() - request_start) * 1000, 1)}
+            )
+        analysis_cache_stats["misses"] += 1
+    else:
+        analysis_cache_stats["forced_refresh"] += 1
+    
+    analyze_load["waiting"] += 1
+    try:
+        await analyze_slots.acquire()
+    finally:
+        analyze_load["waiting"] -= 1
+    analyze_load["in_flight"] += 1
+    metrics = {"provider": "ollama", "model": payload_req.model or OLLAMA_MODEL, "cache_hit": False, "generated": False,
+               "queue_wait_ms": round((time.perf_counter() - request_start) * 1000, 1)}
+    try:
+        # 1) Récupérer contexte via ChromaDB (embedding et recherche hors de la boucle d'événements)
+        q_emb, metrics["embedding_ms"], metrics["retrieval"], context, similar_analyses = await loop.run_in_executor(
+            embedding_executor, retrieve_context, payload_hash, payload
+        )
         
-        # 4) Stocker dans MySQL
-        if mysql_engine:
-            try:
-                with mysql_engine.connect() as connection:
-                    connection.execute(text("""
-                        INSERT INTO analyses (payload, resultat)
-                        VALUES (:payload, :resultat)
-                    """), {
-                        "payload": payload,
-                        "resultat": analysis
-                    })
-                    connection.commit()
-                logger.info("💾 Analyse sauvegardée en MySQL")
-            except Exception as e:
-                logger.error(f"❌ Erreur sauvegarde MySQL: {e}")
+        # 2) Générer prompt avec contexte
+        prompt = build_prompt(payload, context, payload_req.structured_output)
         
-        # 5) Stocker metadata + embedding
-        payload_hash = hashlib.md5(payload.encode()).hexdigest()
+        # 3) Attendre un créneau de génération (délestage immédiat si la file est saturée), puis appeler Ollama
+        priority = payload_priority(payload, payload_req.priority)
+        slot_start = time.perf_counter()
+        try:
+            await generation_scheduler.acquire(payload_req.user_id, priority)
+        except QueueFull as e:
+            logger.warning(f"🚦 Génération délestée ({e.reason}, position {e.position}, priorité {priority})")
+            raise HTTPException(503, e.to_dict(), headers={"Retry-After": str(e.retry_after())})
+        metrics["priority"] = priority
+        metrics["generation_queue_ms"] = round((time.perf_counter() - slot_start) * 1000, 1)
+        generation_start = time.perf_counter()
+        try:
+            analysis = await generate_analysis(payload, prompt, payload_req, metrics)
+        except Exception:
+            # Échec Ollama (timeout, statut HTTP, réponse invalide): rien n'est persisté, l'erreur remonte au client
+            stats_counters.event("failed_generations")
+            raise
+        finally:
+            generation_scheduler.release(time.perf_counter() - generation_start)
+        logger.info("✅ Analyse générée avec succès")
         
-        if conn:
-            try:
-                conn.execute(
-                    "INSERT OR REPLACE INTO meta (id, payload, analysis) VALUES (?, ?, ?)",
-                    (payload_hash, payload, analysis)
-                )
-                conn.commit()
-                logger.info("💾 Métadonnées sauvegardées en SQLite")
-            except Exception as e:
-                logger.error(f"❌ Erreur SQLite: {e}")
+        # 4) Stocker dans MySQL + métadonnées SQLite, 5) embedding dans ChromaDB (si l'analyse a abouti)
+        persist_start = time.perf_counter()
+        if outbox:
+            # Une insertion locale dans l'outbox; l'écrivain en arrière-plan fait le reste par lots
+            await loop.run_in_executor(db_executor, outbox.enqueue, payload_hash, payload, analysis,
+                                       metrics["generated"], payload_req.pattern, q_emb, variant)
+        else:
+            storage = [loop.run_in_executor(db_executor, persist_analysis, payload_hash, payload, analysis,
+                                                  metrics["generated"], variant)]
+            if metrics["generated"]:
+                storage.append(loop.run_in_executor(embedding_executor, store_embedding, payload_hash, payload, analysis,
+                                                    q_emb, payload_req.pattern))
+            await asyncio.gather(*storage)
+        metrics["persist_ms"] = round((time.perf_counter() - persist_start) * 1000, 1)
         
-        # 6) Stocker embedding dans ChromaDB
-        if embedder and collection:
-            try:
-                emb = embedder.encode(payload).tolist()
-                collection.upsert(
-                    ids=[payload_hash],
-                    embeddings=[emb],
-                    metadatas=[{
-                        "payload": payload,
-                        "analysis": analysis,
-                        "type": "qradar_payload"
-                    }]
-                )
-                logger.info("💾 Embedding stocké dans ChromaDB")
-            except Exception as e:
-                logger.error(f"❌ Erreur ChromaDB: {e}")
+        metrics["latency_ms"] = round((time.perf_counter() - request_start) * 1000, 1)
+        stats_counters.event("generations" if metrics["generated"] else "failed_generations")
+        if startup_timings["first_analysis_ms"] is None:
+            startup_timings["first_analysis_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
         
         return AnalysisResponse(
             analysis=analysis,
             context_count=len(similar_analyses),
             payload_hash=payload_hash,
-            similar_analyses=similar_analyses
+            similar_analyses=similar_analyses,
+            metrics=metrics
         )
         
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("⏰ Timeout Ollama")
         raise HTTPException(504, "Timeout - Service Ollama non disponible")
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"❌ Erreur de connexion Ollama: {e}")
-        raise HTTPException(503, f"Service Ollama non disponible: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Erreur inattendue: {e}")
         raise HTTPException(500, f"Erreur inattendue: {str(e)}")
+    finally:
+        analyze_load["in_flight"] -= 1
+        analyze_slots.release()
 
 @app.get("/stats")
-def stats():
-    """Statistiques du service"""
+def stats(refresh: bool = False):
+    """Statistiques du service (totaux incrémentaux, sans requête COUNT; refresh=true force un recomptage)"""
     try:
-        # Statistiques SQLite
-        sqlite_count = 0
-        if conn:
-            cursor = conn.execute("SELECT COUNT(*) FROM meta")
-            sqlite_count = cursor.fetchone()[0]
-        
-        # Statistiques MySQL
-        mysql_count = 0
-        if mysql_engine:
-            with mysql_engine.connect() as connection:
-                result = connection.execute(text("SELECT COUNT(*) FROM analyses"))
-                mysql_count = result.fetchone()[0]
-        
-        # Statistiques ChromaDB
-        chroma_count = 0
-        if collection:
-            try:
-                chroma_count = collection.count()
-            except:
-                pass
+        if refresh:
+            stats_counters.reconcile()
+        counters = stats_counters.snapshot()
+        totals = counters["totals"]
+        lookups = analysis_cache_stats["hits"] + analysis_cache_stats["misses"]
+        outbox_stats = outbox.stats() if outbox else None
         
         return {
-            "total_embeddings_sqlite": sqlite_count,
-            "total_analyses_mysql": mysql_count,
-            "total_embeddings_chroma": chroma_count,
+            "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+            "embedding_batcher": embedding_batcher.stats() if embedding_batcher else None,
+            "embedding_text_mode": EMBEDDING_TEXT_MODE,
+            "analyze_load": dict(analyze_load, max_concurrent=RETRIEVER_MAX_CONCURRENT),
+            "analysis_cache": dict(analysis_cache_stats, ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+                                   hit_ratio=round(analysis_cache_stats["hits"] / lookups, 3) if lookups else 0),
+            "generation_scheduler": generation_scheduler.stats(),
+            "outbox": outbox_stats,
+            "sqlite": conn.stats() if conn else None,
+            "queue_depth": {
+                "analyze_waiting": analyze_load["waiting"],
+                "generation": generation_scheduler.queued,
+                "outbox": outbox_stats["depth"] if outbox_stats else 0,
+                "embedding_batcher": embedding_batcher.stats()["queue_depth"] if embedding_batcher else 0,
+            },
+            "throughput": counters["rates"],
+            "counters": {key: counters[key] for key in ("reconciled_at", "reconcile_ms", "reconcile_every_s", "drift", "errors")},
+            "total_embeddings_sqlite": totals["meta"] or 0,
+            "total_analyses_mysql": totals["mysql_analyses"] or 0,
+            "total_embeddings_chroma": totals["vectors"] or 0,
+            "total_lexical_index": totals["lexical_index"] or 0,
+            "total_context_snippets": totals["context_snippets"] or 0,
             "service": "mistral_retriever",
             "status": "healthy"
         }
@@ -301,18 +744,76 @@ def stats():
         logger.error(f"❌ Erreur stats: {e}")
         return {"error": str(e)}
 
+@app.post("/vector_store/snapshot")
+def vector_store_snapshot(name: Optional[str] = None):
+    """Exporte la collection vectorielle et son contexte SQLite (extraits, index lexical) dans /data/snapshots"""
+    try:
+        return vector_store.snapshot(name, hybrid_retriever.export_context() if hybrid_retriever else None)
+    except Exception as e:
+        logger.error(f"❌ Erreur snapshot: {e}")
+        raise HTTPException(500, f"Erreur snapshot: {str(e)}")
+
+@app.post("/vector_store/restore")
+def vector_store_restore(name: str):
+    """Réimporte un snapshot dans la collection vectorielle (et son contexte dans SQLite)"""
+    try:
+        return vector_store.restore(name, hybrid_retriever.import_context if hybrid_retriever else None)
+    except FileNotFoundError as e:
+        raise HTTPException(404, str(e))
+    except Exception as e:
+        logger.error(f"❌ Erreur restauration: {e}")
+        raise HTTPException(500, f"Erreur restauration: {str(e)}")
+
+@app.get("/vector_store/snapshots")
+def vector_store_snapshots():
+    return {"snapshots": vector_store.list_snapshots(), "status": vector_store.status()}
+
+@app.post("/vector_store/compact")
+def vector_store_compact():
+    """Lance la compaction de la collection (fusion des quasi-doublons, TTL, plafond de taille)"""
+    if not compaction_job:
+        return {"error": "Compaction indisponible (SQLite ou index lexical non initialisé)"}
+    started = compaction_job.start()
+    return {"status": "compaction_started" if started else "compaction_in_progress", "progress": compaction_job.progress()}
+
+@app.get("/vector_store/compact/status")
+def vector_store_compact_status():
+    if not compaction_job:
+        return {"error": "Compaction indisponible"}
+    return compaction_job.progress()
+
+@app.post("/outbox/replay")
+def outbox_replay(sink: Optional[str] = None, limit: int = 100):
+    """Rejoue les écritures mises à l'écart par l'outbox (une destination ou toutes)"""
+    if not outbox:
+        return {"error": "Outbox indisponible"}
+    return dict(outbox.replay_dead(sink, limit), outbox=outbox.stats())
+
 @app.get("/learn")
-def trigger_learning():
-    """Déclenche l'apprentissage sur les données existantes"""
+def trigger_learning(reset: bool = False):
+    """Déclenche l'indexation des analyses MySQL existantes (reprise au dernier point) et retourne la progression"""
+    if not backfill_job:
+        return {"error": "Indexation indisponible (MySQL, SQLite, ChromaDB ou modèle d'embeddings non initialisé)"}
     try:
-        # Ici on pourrait ajouter une logique d'apprentissage plus avancée
-        # Par exemple, réentraîner les embeddings ou optimiser les prompts
-        logger.info("🧠 Apprentissage déclenché")
-        return {"status": "learning_triggered", "message": "Apprentissage en cours"}
+        started = backfill_job.start(reset=reset)
+        if started:
+            logger.info("🧠 Apprentissage déclenché")
+        return {
+            "status": "learning_triggered" if started else "learning_in_progress",
+            "message": "Apprentissage en cours" if started else "Indexation déjà en cours",
+            "progress": backfill_job.progress()
+        }
     except Exception as e:
         logger.error(f"❌ Erreur apprentissage: {e}")
         return {"error": str(e)}
 
+@app.get("/learn/status")
+def learning_status():
+    """Progression de l'indexation de l'historique sans la relancer"""
+    if not backfill_job:
+        return {"error": "Indexation indisponible"}
+    return backfill_job.progress()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000) 
\ No newline at end of file
@@ -0,0 +1,146 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "64"))
+BACKFILL_NAME = "mysql_analyses"
+
+
+class BackfillJob:
+    """
+    Indexe l'historique de la table MySQL analyses dans la collection vectorielle.
+    Lecture en flux (curseur côté serveur, ordre des id), embeddings et upserts par lots,
+    point de reprise enregistré dans SQLite après chaque lot.
+    """
+
+    def __init__(self, mysql_engine, collection, conn, encode_batch: Callable[[List[str]], List[List[float]]],
+                 batch_size: int = BACKFILL_BATCH_SIZE, run_lock=None):
+        self.mysql_engine = mysql_engine
+        self.collection = collection
+        self.conn = conn
+        self.encode_batch = encode_batch
+        self.batch_size = batch_size
+        # Verrou partagé entre workers (workers.RunLock): un seul backfill à la fois sur le même point de reprise
+        self.run_lock = run_lock
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.state = "idle"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.indexed_this_run = 0
+        self.total = None
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS backfill_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER,
+            processed INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        self.conn.commit()
+
+    def _checkpoint(self):
+        row = self.conn.execute("SELECT last_id, processed FROM backfill_state WHERE name = ?", (BACKFILL_NAME,)).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    def _save_checkpoint(self, last_id: int, processed: int) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO backfill_state (name, last_id, processed, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            (BACKFILL_NAME, last_id, processed)
+        )
+        self.conn.commit()
+
+    def start(self, reset: bool = False) -> bool:
+        """Lance le job en arrière-plan; retourne False s'il tourne déjà (dans ce worker ou un autre)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            if self.run_lock and not self.run_lock.acquire():
+                return False
+            if reset:
+                self._save_checkpoint(0, 0)
+            self.state = "running"
+            self.error = None
+            self.started_at = time.time()
+            self.finished_at = None
+            self.indexed_this_run = 0
+            self._thread = threading.Thread(target=self._run, name="backfill", daemon=True)
+            self._thread.start()
+            return True
+
+    def _index_batch(self, rows) -> None:
+        ids, payloads, metadatas = [], [], []
+        for row in rows:
+            analysis = row.rapport_complet or row.resultat or ""
+            if not row.payload or not analysis:
+                continue
+            # Même identifiant que /analyze: une analyse déjà indexée est simplement mise à jour
+            ids.append(hashlib.md5(row.payload.encode()).hexdigest())
+            payloads.append(row.payload)
+            metadatas.append({"payload": row.payload, "analysis": analysis, "type": "qradar_payload",
+                              "pattern": row.pattern_nom or ""})
+        if not ids:
+            return
+        # Un même payload peut apparaître plusieurs fois dans le lot: l'analyse la plus récente l'emporte
+        latest = {payload_id: index for index, payload_id in enumerate(ids)}
+        keep = sorted(latest.values())
+        ids = [ids[i] for i in keep]
+        payloads = [payloads[i] for i in keep]
+        metadatas = [metadatas[i] for i in keep]
+        embeddings = self.encode_batch(payloads)
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+        self.indexed_this_run += len(ids)
+
+    def _run(self) -> None:
+        last_id, processed = self._checkpoint()
+        logger.info(f"🧠 Backfill démarré depuis l'id {last_id} ({processed} analyses déjà traitées)")
+        try:
+            with self.mysql_engine.connect() as connection:
+                self.total = connection.execute(text("SELECT COUNT(*) FROM analyses")).scalar()
+                result = connection.execution_options(stream_results=True, yield_per=self.batch_size).execute(text("""
+                    SELECT id, payload, pattern_nom, resultat, rapport_complet
+                    FROM analyses
+                    WHERE id > :last_id
+                    ORDER BY id
+                """), {"last_id": last_id})
+                for rows in result.partitions(self.batch_size):
+                    self._index_batch(rows)
+                    last_id = rows[-1].id
+                    processed += len(rows)
+                    self._save_checkpoint(last_id, processed)
+                    logger.info(f"📦 Backfill: {processed}/{self.total} analyses traitées (id {last_id})")
+            self.state = "completed"
+            logger.info(f"✅ Backfill terminé: {self.indexed_this_run} embeddings indexés")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"❌ Erreur backfill (reprise possible depuis l'id {last_id}): {e}")
+        finally:
+            self.finished_at = time.time()
+            if self.run_lock:
+                self.run_lock.release()
+
+    def progress(self) -> dict:
+        """Progression; un backfill lancé par un autre worker est rapporté depuis le point de reprise partagé"""
+        last_id, processed = self._checkpoint()
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else None
+        holder = self.run_lock.holder() if self.run_lock is not None and self.state != "running" else None
+        if holder is not None:
+            return {"state": "running", "worker_pid": holder, "last_id": last_id, "processed": processed,
+                    "total": None, "indexed_this_run": None, "elapsed_s": None, "rate_per_s": None, "error": None}
+        return {
+            "state": self.state,
+            "last_id": last_id,
+            "processed": processed,
+            "total": self.total,
+            "indexed_this_run": self.indexed_this_run,
+            "elapsed_s": round(elapsed, 1) if elapsed is not None else None,
+            "rate_per_s": round(self.indexed_this_run / elapsed, 1) if elapsed else None,
+            "error": self.error,
+        }
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark des backends d'embeddings (torch fp32 vs onnx-int8) sur le corpus de payloads.
+Mesure le débit par lots, la latence unitaire (p50/p95) et l'accord des plus proches voisins:
+recouvrement des top-k entre backends et similarité cosinus entre les deux vecteurs d'un même payload.
+
+Corpus: --corpus fichier (un payload par ligne), sinon la table meta de la base SQLite du retriever,
+sinon des payloads synthétiques.
+
+Usage: python bench_embedding_backends.py [--backends torch,onnx-int8] [--corpus payloads.txt] [--limit 1000] [--k 5]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+
+from embedding_backends import create_backend
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def load_corpus(path, db_path, limit):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()][:limit]
+    if os.path.exists(db_path):
+        rows = sqlite3.connect(db_path).execute("SELECT payload FROM meta LIMIT ?", (limit,)).fetchall()
+        if rows:
+            return [row[0] for row in rows]
+    return [
+        f"date=2024-01-{i % 28 + 1:02d} devname=FGT-{i % 7} logid=00000130{i % 10} type={'traffic' if i % 3 else 'utm'} "
+        f"srcip=10.0.{i % 255}.{i % 200} dstip=192.168.1.{i % 250} dstport={(22, 443, 3389, 445)[i % 4]} "
+        f"action={('deny', 'accept', 'block')[i % 3]} crscore={i % 60} crlevel={('low', 'medium', 'high')[i % 3]}"
+        for i in range(limit)
+    ]
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def top_k(vectors, k):
+    normalized = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    similarities = normalized @ normalized.T
+    np.fill_diagonal(similarities, -np.inf)
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx-int8")
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--db", default="/data/embeddings.db")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-samples", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.db, args.limit)
+    print(f"🧪 Benchmark backends d'embeddings sur {len(corpus)} payloads")
+
+    vectors = {}
+    for name in args.backends.split(","):
+        start = time.perf_counter()
+        backend = create_backend(MODEL_NAME, name)
+        load_s = time.perf_counter() - start
+        backend.encode(corpus[:2])  # chauffe
+
+        start = time.perf_counter()
+        encoded = [backend.encode(corpus[i:i + args.batch_size]) for i in range(0, len(corpus), args.batch_size)]
+        throughput = len(corpus) / (time.perf_counter() - start)
+        vectors[name] = np.vstack(encoded).astype(np.float32)
+
+        latencies = []
+        for text in corpus[:args.latency_samples]:
+            start = time.perf_counter()
+            backend.encode([text])
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"⚡ {name:10} | chargement {load_s:6.1f} s | {throughput:8.1f} payloads/s (lots de {args.batch_size}) | "
+              f"latence p50 {percentile(latencies, 50):6.2f} ms, p95 {percentile(latencies, 95):6.2f} ms")
+
+    names = list(vectors)
+    reference = names[0]
+    reference_neighbours = top_k(vectors[reference], args.k)
+    for name in names[1:]:
+        neighbours = top_k(vectors[name], args.k)
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(reference_neighbours, neighbours)])
+        top1 = np.mean(reference_neighbours[:, 0] == neighbours[:, 0])
+        cosine = np.mean(np.sum(vectors[reference] * vectors[name], axis=1) /
+                         (np.linalg.norm(vectors[reference], axis=1) * np.linalg.norm(vectors[name], axis=1)))
+        print(f"🎯 {name} vs {reference} | recouvrement top-{args.k}: {overlap:.3f} | top-1 identique: {top1:.3f} | "
+              f"cosinus moyen même payload: {cosine:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Benchmark de bout en bout du retriever sans Ollama ni ChromaDB réels.
+Lance dans le même processus: un Ollama de substitution (fake_ollama.py, débit et latence configurables),
+l'application FastAPI sous uvicorn avec une collection vectorielle en mémoire (CHROMA_MODE=memory),
+une base SQLite temporaire et MySQL désactivé.
+
+Mesures:
+- recall@k sur un corpus étiqueté: part des requêtes dont l'étiquette (pattern) figure parmi les k premiers
+  résultats, en recherche hybride et en recherche vectorielle seule,
+- latence de bout en bout (p50/p95/p99) et débit de /analyze sous concurrence,
+- temps par étape côté serveur: embedding, recherche, attente de créneau, génération, persistance.
+
+Corpus: --corpus fichier jsonl ({"payload": ..., "label": ...} par ligne), sinon un corpus FortiGate synthétique.
+
+Usage: python bench_retriever.py [--requests 200] [--concurrency 16] [--tokens-per-second 50] [--ttft-ms 200]
+                                 [--slots 2] [--corpus labelled.jsonl] [--k 5]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from fake_ollama import FakeOllama, serve
+
+SYNTHETIC_FAMILIES = {
+    "ssh_bruteforce": "type=traffic subtype=forward action=deny dstport=22 service=SSH policyname=deny_wan crlevel=high",
+    "rdp_scan": "type=traffic subtype=forward action=deny dstport=3389 service=RDP policyname=deny_wan crlevel=medium",
+    "ips_sql_injection": "type=utm subtype=ips action=dropped attack=SQL.Injection service=HTTP crlevel=critical",
+    "web_filter_block": "type=utm subtype=webfilter action=blocked catdesc=Malicious.Websites service=HTTPS crlevel=medium",
+    "vpn_login_fail": "type=event subtype=vpn action=ssl-login-fail vpntype=ssl-web crlevel=high",
+    "dns_tunnel": "type=utm subtype=dns action=block catdesc=Proxy.Avoidance service=DNS crlevel=high",
+    "smb_lateral": "type=traffic subtype=local action=deny dstport=445 service=SMB policyname=lan_isolation crlevel=high",
+    "outbound_https_allowed": "type=traffic subtype=forward action=accept dstport=443 service=HTTPS app=Microsoft.Portal crlevel=low",
+}
+
+
+def synthetic_corpus(size: int, seed: int = 42):
+    rng = random.Random(seed)
+    labels = list(SYNTHETIC_FAMILIES)
+    corpus = []
+    for i in range(size):
+        label = labels[i % len(labels)]
+        corpus.append({"label": label, "payload": (
+            f"date=2024-0{rng.randint(1, 9)}-{rng.randint(10, 28)} time={rng.randint(10, 23)}:{rng.randint(10, 59)}:00 "
+            f"devname=FGT-{rng.choice(['PARIS', 'LYON', 'LILLE'])} devid=FG100F{rng.randint(1000, 9999)} vd=root "
+            f"logid=00000{rng.randint(10000, 99999)} srcip=10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} "
+            f"srcport={rng.randint(1024, 65535)} dstip=192.168.{rng.randint(0, 10)}.{rng.randint(1, 254)} "
+            f"sessionid={rng.randint(10 ** 6, 10 ** 7)} {SYNTHETIC_FAMILIES[label]}"
+        )})
+    return corpus
+
+
+def load_corpus(path, size):
+    if not path:
+        return synthetic_corpus(size)
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()][:size]
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def summary(values):
+    if not values:
+        return "n/a"
+    return f"p50 {percentile(values, 50):8.1f} | p95 {percentile(values, 95):8.1f} | p99 {percentile(values, 99):8.1f} ms"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def configure_environment(args, ollama_url, data_dir):
+    """Variables lues à l'import de app.py: à positionner avant l'import"""
+    os.environ.update({
+        "OLLAMA_URL": ollama_url,
+        "OLLAMA_KEEP_WARM_INTERVAL": "0",
+        "CHROMA_MODE": "memory",
+        "RETRIEVER_DB_PATH": os.path.join(data_dir, "embeddings.db"),
+        "VECTOR_SNAPSHOT_DIR": os.path.join(data_dir, "snapshots"),
+        "ONNX_MODEL_DIR": os.environ.get("ONNX_MODEL_DIR", os.path.join(data_dir, "models")),
+        "DB_HOST": "",
+        "EMBEDDING_BACKEND": args.backend,
+        "GENERATION_SLOTS": str(args.slots),
+        "GENERATION_MAX_QUEUE": str(max(args.requests, 50)),
+        "GENERATION_MAX_WAIT_SECONDS": "600",
+        "COMPACTION_INTERVAL_HOURS": "0",
+    })
+
+
+def start_retriever(retriever, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(retriever.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="retriever", daemon=True).start()
+    return server
+
+
+async def wait_ready(client, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("retriever pas prêt")
+
+
+def seed_index(retriever, items, batch_size=64):
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        embeddings = [retriever.embed_payload(item["payload"]) for item in batch]
+        retriever.hybrid_retriever.upsert(
+            ids=[f"seed-{i + j}" for j in range(len(batch))],
+            embeddings=embeddings,
+            metadatas=[{"payload": item["payload"], "analysis": f"Analyse de référence: {item['label']}",
+                        "type": "qradar_payload", "pattern": item["label"]} for item in batch],
+        )
+
+
+def measure_recall(retriever, queries, k):
+    hybrid_hits = vector_hits = 0
+    retrieval_ms = []
+    for item in queries:
+        embedding = retriever.embed_payload(item["payload"])
+        start = time.perf_counter()
+        search = retriever.hybrid_retriever.search(item["payload"], embedding, n_results=k)
+        retrieval_ms.append((time.perf_counter() - start) * 1000)
+        hybrid_hits += item["label"] in [result["metadata"].get("pattern") for result in search["results"]]
+        vector = retriever.vector_store.query(query_embeddings=[embedding], n_results=k, include=["metadatas"])
+        vector_hits += item["label"] in [metadata.get("pattern") for metadata in vector["metadatas"][0]]
+    return hybrid_hits / len(queries), vector_hits / len(queries), retrieval_ms
+
+
+async def load_test(client, queries, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, stages, statuses = [], {}, {}
+
+    async def one(i):
+        item = queries[i % len(queries)]
+        # Payload unique (le cache d'analyses ne doit pas répondre à la place de la génération)
+        payload = f"{item['payload']} benchseq={i}"
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/analyze", json={"payload": payload, "force_refresh": True,
+                                                           "num_predict": 128, "user_id": f"bench-{i % 8}"})
+            elapsed = (time.perf_counter() - start) * 1000
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code != 200:
+            return
+        latencies.append(elapsed)
+        metrics = response.json().get("metrics") or {}
+        retrieval = metrics.get("retrieval") or {}
+        values = {
+            "embed": metrics.get("embedding_ms"),
+            "retrieve": sum(retrieval.get(key) or 0 for key in ("vector_ms", "lexical_ms", "hydrate_ms")),
+            "slot_wait": metrics.get("generation_queue_ms"),
+            "generate": metrics.get("generation_ms"),
+            "persist": metrics.get("persist_ms"),
+        }
+        for stage, value in values.items():
+            if value is not None:
+                stages.setdefault(stage, []).append(value)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, stages, statuses, time.perf_counter() - start
+
+
+async def run(args):
+    import httpx
+
+    fake = FakeOllama(args.tokens_per_second, args.ttft_ms, args.load_ms, max_tokens=args.max_tokens, parallel=args.slots)
+    ollama = serve(fake)
+    data_dir = tempfile.mkdtemp(prefix="bench_retriever_")
+    configure_environment(args, f"http://127.0.0.1:{ollama.server_port}", data_dir)
+
+    import app as retriever
+    port = free_port()
+    server = start_retriever(retriever, port)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+        start = time.perf_counter()
+        await wait_ready(client)
+        print(f"🚀 Retriever prêt en {time.perf_counter() - start:.1f} s (données: {data_dir})")
+
+        corpus = load_corpus(args.corpus, args.corpus_size)
+        random.Random(7).shuffle(corpus)
+        split = int(len(corpus) * 0.8)
+        indexed, queries = corpus[:split], corpus[split:]
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, seed_index, retriever, indexed)
+        print(f"📚 {len(indexed)} payloads indexés en {time.perf_counter() - start:.1f} s, {len(queries)} requêtes étiquetées")
+
+        hybrid, vector, retrieval_ms = await asyncio.get_running_loop().run_in_executor(
+            None, measure_recall, retriever, queries, args.k)
+        print(f"🎯 recall@{args.k}: hybride {hybrid:.3f} | vectoriel seul {vector:.3f} | recherche hybride {summary(retrieval_ms)}")
+
+        latencies, stages, statuses, elapsed = await load_test(client, queries, args.requests, args.concurrency)
+        print(f"⚡ /analyze: {args.requests} requêtes, concurrence {args.concurrency}, {args.slots} créneau(x) de génération "
+              f"({args.tokens_per_second} tokens/s, TTFT {args.ttft_ms} ms)")
+        print(f"   débit {len(latencies) / elapsed:.2f} analyses/s | statuts {statuses}")
+        print(f"   bout en bout  {summary(latencies)}")
+        for stage in ("embed", "retrieve", "slot_wait", "generate", "persist"):
+            print(f"   {stage:13} {summary(stages.get(stage))}")
+    server.should_exit = True
+    ollama.shutdown()
+    return 0 if latencies else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--load-ms", type=float, default=1000.0)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--slots", type=int, default=2, help="générations simultanées (fake Ollama et GENERATION_SLOTS)")
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--corpus-size", type=int, default=800)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backend", default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'index vectoriel NumPy (numpy_vector_store.NumpyCollection) en float16 et int8.
+Vecteurs synthétiques normalisés regroupés en familles (comme des alertes récurrentes d'un même logid),
+indexés par lots dans un répertoire temporaire, puis:
+- débit d'indexation,
+- latence de recherche top-k (p50/p95) sans filtre et avec le filtre vendor/logid de la recherche hybride,
+- recall@k par rapport à une recherche exacte float32 en mémoire,
+- taille de la matrice sur disque et temps de rechargement (relecture du journal + mmap).
+
+Usage: python bench_vector_store.py [--vectors 200000] [--dim 384] [--queries 200] [--k 10] [--dtype float16|int8|both]
+"""
+
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from numpy_vector_store import NumpyCollection
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def synthetic_vectors(args):
+    rng = np.random.default_rng(42)
+    families = rng.normal(size=(args.families, args.dim)).astype(np.float32)
+    assignment = rng.integers(0, args.families, size=args.vectors)
+    vectors = families[assignment] + args.noise * rng.normal(size=(args.vectors, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadatas = [{"vendor": "fortinet" if family % 4 else "paloalto", "logid": str(family % 200), "action": "deny"}
+                 for family in assignment]
+    return vectors, metadatas
+
+
+def run(dtype, vectors, metadatas, queries, sources, args):
+    path = tempfile.mkdtemp(prefix=f"bench_vectors_{dtype}_")
+    collection = NumpyCollection(path, dtype)
+    ids = [f"v{i}" for i in range(len(vectors))]
+
+    start = time.perf_counter()
+    for i in range(0, len(vectors), args.batch):
+        collection.upsert(ids[i:i + args.batch], vectors[i:i + args.batch], metadatas[i:i + args.batch])
+    index_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    collection = NumpyCollection(path, dtype)
+    reload_ms = (time.perf_counter() - start) * 1000
+
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    latencies, filtered_latencies, hits = [], [], 0
+    for query_index, query in enumerate(queries):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query], n_results=args.k, include=["distances"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(result["ids"][0]) & {ids[row] for row in exact[query_index]})
+
+        # Filtre de la famille du vecteur dont la requête est dérivée
+        metadata = metadatas[sources[query_index]]
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query], n_results=args.k, include=["metadatas", "distances"],
+                         where={"$and": [{"vendor": metadata["vendor"]}, {"logid": metadata["logid"]}]})
+        filtered_latencies.append((time.perf_counter() - start) * 1000)
+
+    stats = collection.stats()
+    print(f"📊 {dtype:7} | indexation {len(vectors) / index_s:9.0f} vecteurs/s | matrice {stats['matrix_bytes'] / 2 ** 20:7.1f} Mo | "
+          f"rechargement {reload_ms:7.1f} ms")
+    print(f"   recall@{args.k} {hits / (len(queries) * args.k):.4f} | recherche p50 {percentile(latencies, 50):6.2f} ms, "
+          f"p95 {percentile(latencies, 95):6.2f} ms | filtrée vendor+logid p50 {percentile(filtered_latencies, 50):6.2f} ms, "
+          f"p95 {percentile(filtered_latencies, 95):6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--families", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--dtype", choices=["float16", "int8", "both"], default="both")
+    args = parser.parse_args()
+
+    vectors, metadatas = synthetic_vectors(args)
+    rng = np.random.default_rng(7)
+    sources = rng.integers(0, len(vectors), size=args.queries)
+    queries = vectors[sources] + 0.05 * rng.normal(size=(args.queries, args.dim))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    print(f"🧪 Index NumPy: {args.vectors} vecteurs de dimension {args.dim}, {args.queries} requêtes, k={args.k}")
+    for dtype in (["float16", "int8"] if args.dtype == "both" else [args.dtype]):
+        run(dtype, vectors, metadatas, queries, sources, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Mémoire et débit d'encodage du retriever à plusieurs workers, avec et sans modèle partagé.
+- inprocess: chaque worker charge son propre modèle (LazyEmbedder), comme N processus uvicorn sans workers.py,
+- shared: un serveur d'embeddings unique (embedding_server.py) et N workers RemoteEmbedder, comme workers.py.
+
+Chaque worker encode des payloads synthétiques depuis --threads threads pendant --seconds secondes
+(un texte par appel, comme /analyze). Affiche par mode: RSS et PSS de chaque processus, mémoire totale
+(somme des PSS: les pages partagées ne sont comptées qu'une fois) et débit agrégé en embeddings/s.
+--record ajoute ces mesures (tableau markdown daté, backend et nombre de CPU) au fichier indiqué,
+par exemple BENCHMARKS.md, pour garder l'historique des résultats à côté du code.
+
+Usage: python bench_workers.py [--workers 4] [--threads 4] [--seconds 20] [--mode inprocess|shared|both]
+                               [--record BENCHMARKS.md]
+"""
+
+import os
+import sys
+import time
+import random
+import secrets
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+
+from workers import process_memory, start_embedding_server
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def worker(mode, socket_path, authkey, threads, seconds, start_at, results):
+    if mode == "shared":
+        os.environ["EMBEDDING_SERVER_AUTHKEY"] = authkey
+        from embedding_server import RemoteEmbedder
+        embedder = RemoteEmbedder(EMBEDDING_MODEL, socket_path, authkey)
+    else:
+        from model_loader import LazyEmbedder
+        embedder = LazyEmbedder(EMBEDDING_MODEL)
+    embedder.start()
+    try:
+        embedder.encode("chauffe")
+    except Exception as e:
+        # Modèle non chargé (runtime absent, poids non téléchargés): on le signale au lieu de laisser run() attendre
+        results.put({"error": str(e), "memory": process_memory()})
+        return
+    # Tous les workers encodent sur la même fenêtre de temps
+    time.sleep(max(0.0, start_at - time.time()))
+
+    counts = [0] * threads
+    deadline = time.time() + seconds
+
+    def loop(index):
+        rng = random.Random(os.getpid() * 100 + index)
+        while time.time() < deadline:
+            embedder.encode(f"devname=FGT-{rng.randint(1, 50)} logid=00000{rng.randint(10000, 99999)} type=traffic "
+                            f"action=deny srcip=10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)} dstport={rng.randint(1, 65535)}")
+            counts[index] += 1
+
+    pool = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put({"count": sum(counts), "memory": process_memory()})
+
+
+def run(mode, args):
+    server = None
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bench_workers_"), "embeddings.sock")
+    authkey = secrets.token_hex(16)
+    if mode == "shared":
+        server = start_embedding_server(socket_path, authkey)
+
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    start_at = time.time() + args.startup_seconds
+    processes = [context.Process(target=worker, args=(mode, socket_path, authkey, args.threads, args.seconds, start_at, results))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=args.startup_seconds + args.seconds + 120) for _ in processes]
+    errors = [report["error"] for report in reports if "error" in report]
+    if errors:
+        for process in processes:
+            process.join()
+        if server:
+            server.terminate()
+            server.wait()
+        raise RuntimeError(f"Mode {mode}: modèle d'embeddings non chargé dans {len(errors)} workers: {errors[0]}")
+    # Mémoire du serveur mesurée pendant que les workers sont encore connectés
+    server_memory = process_memory(str(server.pid)) if server else None
+    for process in processes:
+        process.join()
+    if server:
+        server.terminate()
+        server.wait()
+
+    total = sum(report["count"] for report in reports)
+    memories = [report["memory"] for report in reports] + ([server_memory] if server_memory else [])
+    pss_total = sum(memory["pss_mb"] or memory["rss_mb"] or 0 for memory in memories)
+    print(f"📊 {mode:9} | {args.workers} workers x {args.threads} threads | {total / args.seconds:8.1f} embeddings/s | "
+          f"mémoire totale (PSS) {pss_total:8.1f} Mo")
+    for report in reports:
+        print(f"   worker  pid {report['memory']['pid']:>7} | RSS {report['memory']['rss_mb']} Mo | "
+              f"PSS {report['memory']['pss_mb']} Mo | {report['count'] / args.seconds:.1f} embeddings/s")
+    if server_memory:
+        print(f"   serveur pid {server_memory['pid']:>7} | RSS {server_memory['rss_mb']} Mo | PSS {server_memory['pss_mb']} Mo")
+    return {"mode": mode, "throughput": total / args.seconds, "pss_total": pss_total,
+            "workers": [dict(report["memory"], rate=report["count"] / args.seconds) for report in reports],
+            "server": server_memory}
+
+
+def record(path, results, args):
+    """Ajoute les mesures au fichier de résultats (tableau markdown)"""
+    lines = [f"\n## bench_workers.py, {time.strftime('%Y-%m-%d %H:%M')}\n",
+             f"Backend {os.getenv('EMBEDDING_BACKEND', 'torch')}, {os.cpu_count()} CPU, {args.workers} workers x "
+             f"{args.threads} threads, {args.seconds} s par mode.\n",
+             "| Mode | Processus | RSS (Mo) | PSS (Mo) | Embeddings/s |",
+             "|------|-----------|----------|----------|--------------|"]
+    for result in results:
+        for memory in result["workers"]:
+            lines.append(f"| {result['mode']} | worker {memory['pid']} | {memory['rss_mb']} | {memory['pss_mb']} | "
+                         f"{memory['rate']:.1f} |")
+        if result["server"]:
+            lines.append(f"| {result['mode']} | serveur {result['server']['pid']} | {result['server']['rss_mb']} | "
+                         f"{result['server']['pss_mb']} | |")
+        lines.append(f"| {result['mode']} | **total** | | **{result['pss_total']:.1f}** | **{result['throughput']:.1f}** |")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"📝 Résultats ajoutés à {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--startup-seconds", type=float, default=60, help="délai laissé aux workers pour charger le modèle")
+    parser.add_argument("--mode", choices=["inprocess", "shared", "both"], default="both")
+    parser.add_argument("--record", help="fichier markdown auquel ajouter les mesures")
+    args = parser.parse_args()
+
+    print(f"🧪 Encodage multi-workers ({os.getenv('EMBEDDING_BACKEND', 'torch')}), {args.seconds} s par mode")
+    modes = ["inprocess", "shared"] if args.mode == "both" else [args.mode]
+    results = [run(mode, args) for mode in modes]
+    if args.record:
+        record(args.record, results, args)
+    return 0 if all(result["throughput"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import unicodedata
+from typing import Dict, Any, List
+
+# raw: payload brut (ancien comportement), canonical: champs sélectionnés par schéma
+EMBEDDING_TEXT_MODE = os.getenv("EMBEDDING_TEXT_MODE", "canonical")
+# Fenêtre de all-MiniLM-L6-v2: au-delà, le modèle tronque de toute façon
+EMBEDDING_TEXT_MAX_TOKENS = int(os.getenv("EMBEDDING_TEXT_MAX_TOKENS", "256"))
+
+# Champs retenus par source, par ordre d'importance (la troncature supprime d'abord les derniers)
+SCHEMAS = {
+    "fortinet": ["type", "subtype", "logid", "action", "utmaction", "eventtype", "level", "service", "proto",
+                 "dstport", "srcintf", "dstintf", "srcintfrole", "dstintfrole", "policytype", "policyname",
+                 "app", "appcat", "attack", "virus", "catdesc", "crlevel", "craction", "vpntype",
+                 "srccountry", "dstcountry", "msg"],
+    "microsoft365": ["workload", "operation", "recordtype", "resultstatus", "userid", "usertype", "logontype",
+                     "clientinfostring", "clientprocessname", "mailboxownerupn", "parentfolder", "subject",
+                     "objectid", "sitename", "itemtype"],
+}
+
+# Champs à forte cardinalité sans valeur sémantique (horodatages, identifiants, compteurs)
+_NOISY_KEY_RE = re.compile(
+    r"(^|_)(date|time|timestamp|eventtime|creationtime|tz|id|sessionid|devid|logid_seq|seq|uuid|guid|"
+    r"duration|sentbyte|rcvdbyte|sentpkt|rcvdpkt|bytes?|packets?|count|srcport|srcip|dstip|clientip|ip)$"
+)
+_NUMERIC_RE = re.compile(r"^[\d.:\-/ ]+$")
+_KV_TOKEN_RE = re.compile(r'\S+=\S+|\S+=|\S+')
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Découpage du tokenizer FTS5 unicode61: lettres et chiffres uniquement ("_" sépare les termes)
+_LEXICAL_RE = re.compile(r"[^\W_]+")
+
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r"[^a-z0-9_]", "", key.lower().rsplit(".", 1)[-1])
+
+
+def _parse(payload: str) -> Dict[str, Any]:
+    """JSON (aplati) ou clé=valeur QRadar, clés normalisées; même logique que le parser de l'application web"""
+    try:
+        data = json.loads(payload)
+        if isinstance(data, dict):
+            flat = {}
+            stack = [("", data)]
+            while stack:
+                prefix, value = stack.pop()
+                if isinstance(value, dict):
+                    stack.extend((f"{prefix}.{k}" if prefix else k, v) for k, v in value.items())
+                elif not isinstance(value, list):
+                    flat.setdefault(_normalize_key(prefix), value)
+            return flat
+    except ValueError:
+        pass
+    fields = {}
+    tokens = _KV_TOKEN_RE.findall(payload)
+    i = 0
+    while i < len(tokens):
+        key, sep, value = tokens[i].partition("=")
+        if sep:
+            while i + 1 < len(tokens) and "=" not in tokens[i + 1]:
+                value += " " + tokens[i + 1]
+                i += 1
+            fields.setdefault(_normalize_key(key), value.strip().strip('"'))
+        i += 1
+    return fields
+
+
+def detect_vendor(fields: Dict[str, Any]) -> str:
+    if str(fields.get("devid") or "").upper().startswith("FG") or {"logid", "devname", "vd"} <= fields.keys():
+        return "fortinet"
+    if {"workload", "operation"} & fields.keys() and {"creationtime", "userid", "organizationid"} & fields.keys():
+        return "microsoft365"
+    return "generic"
+
+
+def index_metadata(payload: str) -> Dict[str, str]:
+    """Métadonnées structurées servant au pré-filtrage (valeurs str, "" si absentes, comme l'exige Chroma)"""
+    fields = _parse(payload)
+    vendor = detect_vendor(fields) if fields else "generic"
+
+    def first(*keys):
+        for key in keys:
+            if fields.get(key) not in (None, ""):
+                return str(fields[key])[:100]
+        return ""
+
+    return {
+        "vendor": vendor,
+        "logid": first("logid", "eventid", "recordtype"),
+        "action": first("action", "operation"),
+        "device": first("devname", "hostname", "computer", "workload"),
+        "pattern": first("pattern"),
+    }
+
+
+def lexical_terms(text: str) -> List[str]:
+    """
+    Termes du texte canonique pour l'index lexical (valeurs uniquement, sans les noms de champs).
+    Même tokenisation que FTS5 unicode61 (minuscules, sans accents, coupure sur "_"): les termes d'une requête
+    se retrouvent tels quels dans lexical_vocab.
+    """
+    terms = []
+    for part in text.split(" | "):
+        value = part.partition("=")[2] or part
+        value = "".join(c for c in unicodedata.normalize("NFKD", value.lower()) if not unicodedata.combining(c))
+        terms.extend(_LEXICAL_RE.findall(value))
+    return terms
+
+
+def _cap_tokens(parts: List[str], max_tokens: int) -> str:
+    """Garde les parties entières dont l'estimation du nombre de tokens tient encore dans la fenêtre"""
+    kept = []
+    budget = max_tokens
+    for part in parts:
+        cost = len(_TOKEN_RE.findall(part))
+        if cost > budget:
+            continue
+        kept.append(part)
+        budget -= cost
+    return " | ".join(kept)
+
+
+def canonical_text(payload: str, max_tokens: int = EMBEDDING_TEXT_MAX_TOKENS) -> str:
+    """
+    Texte à encoder pour un payload: source + champs du schéma de la source, sans horodatages,
+    identifiants de session ni compteurs, limité à la fenêtre du modèle.
+    Un payload non reconnu garde ses champs non bruités, triés par clé.
+    """
+    if EMBEDDING_TEXT_MODE == "raw":
+        return payload
+    fields = _parse(payload)
+    if not fields:
+        return payload[:max_tokens * 4]
+    vendor = detect_vendor(fields)
+    if vendor in SCHEMAS:
+        keys = [key for key in SCHEMAS[vendor] if fields.get(key) not in (None, "")]
+    else:
+        keys = sorted(key for key, value in fields.items()
+                      if value not in (None, "") and not _NOISY_KEY_RE.search(key)
+                      and not _NUMERIC_RE.match(str(value)))
+    parts = [f"vendor={vendor}"] + [f"{key}={fields[key]}" for key in keys]
+    return _cap_tokens(parts, max_tokens)
@@ -0,0 +1,218 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Similarité cosinus à partir de laquelle deux entrées d'un même groupe (vendor, logid, action) sont fusionnées
+COMPACTION_SIMILARITY = float(os.getenv("COMPACTION_SIMILARITY", "0.97"))
+# Durée de vie d'une entrée sans nouvelle occurrence; 0 désactive
+VECTOR_TTL_DAYS = float(os.getenv("VECTOR_TTL_DAYS", "180"))
+# Taille maximale de la collection (les plus anciennes sont évincées au-delà); 0 désactive
+VECTOR_MAX_ENTRIES = int(os.getenv("VECTOR_MAX_ENTRIES", "0"))
+# Compaction automatique toutes les N heures; 0: uniquement sur demande (POST /vector_store/compact)
+COMPACTION_INTERVAL_HOURS = float(os.getenv("COMPACTION_INTERVAL_HOURS", "24"))
+COMPACTION_PAGE_SIZE = int(os.getenv("COMPACTION_PAGE_SIZE", "1000"))
+# Taille des sous-groupes comparés deux à deux (borne la mémoire et le coût d'un groupe très fréquent)
+COMPACTION_GROUP_CHUNK = int(os.getenv("COMPACTION_GROUP_CHUNK", "2000"))
+DELETE_CHUNK = 500
+
+
+class CompactionJob:
+    """
+    Maintenance de la collection vectorielle, en arrière-plan:
+    1. migration des entrées indexées avant les métadonnées allégées (payload complet, sans indexed_at),
+    2. éviction TTL des entrées plus anciennes que VECTOR_TTL_DAYS,
+    3. fusion des quasi-doublons: dans chaque groupe (vendor, logid, action), l'entrée la plus récente
+       représente celles dont le cosinus dépasse COMPACTION_SIMILARITY et cumule leur dup_count,
+    4. plafond VECTOR_MAX_ENTRIES: les entrées les plus anciennes au-delà sont évincées.
+    """
+
+    def __init__(self, retriever, on_complete: Optional[Callable[[], None]] = None, run_lock=None):
+        self.retriever = retriever
+        self.vector_store = retriever.vector_store
+        self.on_complete = on_complete
+        # Verrou partagé entre workers (workers.RunLock): compactions à la demande et périodiques jamais simultanées
+        self.run_lock = run_lock
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.state = "idle"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Dict[str, int] = {}
+
+    def start(self) -> bool:
+        """Lance une compaction en arrière-plan; retourne False si une compaction tourne déjà (ici ou ailleurs)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            if self.run_lock and not self.run_lock.acquire():
+                return False
+            self.state = "running"
+            self.error = None
+            self.started_at = time.time()
+            self.finished_at = None
+            self.result = {"scanned": 0, "migrated": 0, "expired": 0, "merged": 0, "representatives": 0, "capped": 0}
+            self._thread = threading.Thread(target=self._run, name="vector-compaction", daemon=True)
+            self._thread.start()
+            return True
+
+    def start_periodic(self, interval_hours: float = COMPACTION_INTERVAL_HOURS) -> None:
+        if interval_hours <= 0:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_hours * 3600)
+                self.start()
+
+        threading.Thread(target=loop, name="vector-compaction-timer", daemon=True).start()
+
+    def _scan(self) -> Dict[str, dict]:
+        """Métadonnées de toute la collection, par pages (sans les embeddings)"""
+        entries = {}
+        offset = 0
+        while True:
+            page = self.vector_store.get(include=["metadatas"], limit=COMPACTION_PAGE_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            entries.update(zip(page["ids"], (metadata or {} for metadata in page["metadatas"])))
+            offset += len(page["ids"])
+        return entries
+
+    def _migrate(self, entries: Dict[str, dict]) -> None:
+        """
+        Entrées antérieures aux métadonnées allégées (payload complet): réécrites via l'upsert hybride
+        (extraits en SQLite, index lexical, indexed_at). Entrées déjà allégées sans indexed_at: simplement datées.
+        """
+        now = time.time()
+        full = [item_id for item_id, metadata in entries.items() if "payload" in metadata]
+        for i in range(0, len(full), COMPACTION_PAGE_SIZE):
+            page = self.vector_store.get(ids=full[i:i + COMPACTION_PAGE_SIZE], include=["embeddings", "metadatas"])
+            self.retriever.upsert(ids=page["ids"], embeddings=[list(e) for e in page["embeddings"]],
+                                  metadatas=[dict(metadata or {}) for metadata in page["metadatas"]])
+            # Métadonnées réécrites (vendor, logid, action...): nécessaires au regroupement qui suit
+            migrated = self.vector_store.get(ids=page["ids"], include=["metadatas"])
+            entries.update(zip(migrated["ids"], (metadata or {} for metadata in migrated["metadatas"])))
+            self.result["migrated"] += len(page["ids"])
+
+        undated = [item_id for item_id, metadata in entries.items() if "payload" not in metadata and "indexed_at" not in metadata]
+        for i in range(0, len(undated), COMPACTION_PAGE_SIZE):
+            chunk = undated[i:i + COMPACTION_PAGE_SIZE]
+            self.vector_store.update(ids=chunk, metadatas=[dict(entries[item_id], indexed_at=now, dup_count=1)
+                                                           for item_id in chunk])
+            self.result["migrated"] += len(chunk)
+
+        for item_id in undated:
+            entries[item_id] = dict(entries[item_id], indexed_at=now, dup_count=1)
+
+    def _delete(self, ids: List[str], entries: Dict[str, dict]) -> None:
+        for i in range(0, len(ids), DELETE_CHUNK):
+            self.retriever.delete(ids[i:i + DELETE_CHUNK])
+        for item_id in ids:
+            entries.pop(item_id, None)
+
+    def _merge_group(self, ids: List[str]) -> List[str]:
+        """Fusionne les quasi-doublons d'un sous-groupe; retourne les ids absorbés (à supprimer)"""
+        page = self.vector_store.get(ids=ids, include=["embeddings", "metadatas"])
+        if len(page["ids"]) < 2:
+            return []
+        vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        metadatas = [dict(metadata or {}) for metadata in page["metadatas"]]
+        # Les plus récentes d'abord: le représentant garde l'analyse la plus à jour
+        order = sorted(range(len(page["ids"])), key=lambda i: metadatas[i].get("indexed_at", 0), reverse=True)
+
+        representatives: List[int] = []
+        counts: Dict[int, int] = {}
+        absorbed = []
+        for i in order:
+            if representatives:
+                similarities = vectors[representatives] @ vectors[i]
+                best = int(np.argmax(similarities))
+                if similarities[best] >= COMPACTION_SIMILARITY:
+                    representative = representatives[best]
+                    counts[representative] += int(metadatas[i].get("dup_count", 1))
+                    absorbed.append(page["ids"][i])
+                    continue
+            representatives.append(i)
+            counts[i] = int(metadatas[i].get("dup_count", 1))
+
+        changed = [i for i in representatives if counts[i] != int(metadatas[i].get("dup_count", 1))]
+        if changed:
+            self.vector_store.update(ids=[page["ids"][i] for i in changed],
+                                     metadatas=[dict(metadatas[i], dup_count=counts[i]) for i in changed])
+            self.result["representatives"] += len(changed)
+        return absorbed
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        logger.info("🧹 Compaction de la collection vectorielle démarrée")
+        try:
+            entries = self._scan()
+            self.result["scanned"] = len(entries)
+            self._migrate(entries)
+
+            if VECTOR_TTL_DAYS > 0:
+                cutoff = time.time() - VECTOR_TTL_DAYS * 86400
+                expired = [item_id for item_id, metadata in entries.items() if metadata.get("indexed_at", cutoff) < cutoff]
+                self._delete(expired, entries)
+                self.result["expired"] = len(expired)
+
+            groups: Dict[tuple, List[str]] = {}
+            for item_id, metadata in entries.items():
+                key = (metadata.get("vendor", ""), metadata.get("logid", ""), metadata.get("action", ""))
+                groups.setdefault(key, []).append(item_id)
+            for ids in groups.values():
+                for i in range(0, len(ids), COMPACTION_GROUP_CHUNK):
+                    chunk = ids[i:i + COMPACTION_GROUP_CHUNK]
+                    if len(chunk) < 2:
+                        continue
+                    absorbed = self._merge_group(chunk)
+                    self._delete(absorbed, entries)
+                    self.result["merged"] += len(absorbed)
+
+            if VECTOR_MAX_ENTRIES and len(entries) > VECTOR_MAX_ENTRIES:
+                oldest = sorted(entries, key=lambda item_id: entries[item_id].get("indexed_at", 0))
+                capped = oldest[:len(entries) - VECTOR_MAX_ENTRIES]
+                self._delete(capped, entries)
+                self.result["capped"] = len(capped)
+
+            self.state = "completed"
+            logger.info(f"✅ Compaction terminée en {round(time.perf_counter() - start, 1)} s: {self.result}, "
+                        f"{len(entries)} entrées restantes")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"❌ Erreur compaction: {e}")
+        finally:
+            self.finished_at = time.time()
+            if self.run_lock:
+                self.run_lock.release()
+            if self.on_complete:
+                try:
+                    self.on_complete()
+                except Exception as e:
+                    logger.warning(f"⚠️ Erreur après compaction: {e}")
+
+    def progress(self) -> dict:
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else None
+        holder = self.run_lock.holder() if self.run_lock is not None and self.state != "running" else None
+        if holder is not None:
+            # Compaction en cours dans un autre worker: ses compteurs ne sont pas visibles d'ici
+            return {"state": "running", "worker_pid": holder, "result": None, "elapsed_s": None, "error": None,
+                    "policy": {"similarity": COMPACTION_SIMILARITY, "ttl_days": VECTOR_TTL_DAYS,
+                               "max_entries": VECTOR_MAX_ENTRIES, "interval_hours": COMPACTION_INTERVAL_HOURS}}
+        return {
+            "state": self.state,
+            "result": self.result,
+            "elapsed_s": round(elapsed, 1) if elapsed is not None else None,
+            "error": self.error,
+            "policy": {"similarity": COMPACTION_SIMILARITY, "ttl_days": VECTOR_TTL_DAYS,
+                       "max_entries": VECTOR_MAX_ENTRIES, "interval_hours": COMPACTION_INTERVAL_HOURS},
+        }
@@ -0,0 +1,66 @@
+import os
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Longueur des extraits injectés dans le prompt (contexte historique)
+SNIPPET_PAYLOAD_CHARS = int(os.getenv("SNIPPET_PAYLOAD_CHARS", "200"))
+SNIPPET_ANALYSIS_CHARS = int(os.getenv("SNIPPET_ANALYSIS_CHARS", "300"))
+# Limite de variables d'une requête SQLite (999 sur les versions anciennes)
+HYDRATE_CHUNK = 500
+
+# Champs qui ne doivent plus être stockés dans les métadonnées de l'index vectoriel
+HEAVY_FIELDS = ("payload", "analysis")
+
+
+def make_snippets(payload: str, analysis: str) -> Dict[str, str]:
+    return {"payload": (payload or "")[:SNIPPET_PAYLOAD_CHARS], "analysis": (analysis or "")[:SNIPPET_ANALYSIS_CHARS]}
+
+
+class ContextStore:
+    """
+    Extraits de contexte (payload et analyse tronqués) calculés à l'écriture et stockés dans SQLite,
+    indexés par l'id du vecteur. L'index vectoriel ne garde que les champs de filtrage;
+    les résultats d'une recherche sont réhydratés en une seule requête.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Transactions d'écriture seulement; les lectures passent sans verrou par la connexion WAL du thread
+        self._lock = threading.Lock()
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS context_snippets (
+            id TEXT PRIMARY KEY,
+            payload_snippet TEXT,
+            analysis_snippet TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        self.conn.commit()
+
+    def put(self, ids: List[str], payloads: List[str], analyses: List[str]) -> None:
+        rows = []
+        for item_id, payload, analysis in zip(ids, payloads, analyses):
+            snippets = make_snippets(payload, analysis)
+            rows.append((item_id, snippets["payload"], snippets["analysis"]))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO context_snippets (id, payload_snippet, analysis_snippet, updated_at) "
+                "VALUES (?, ?, ?, CURRENT_TIMESTAMP)", rows
+            )
+
+    def hydrate(self, ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Extraits des ids demandés (les ids inconnus sont absents du résultat)"""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for i in range(0, len(ids), HYDRATE_CHUNK):
+            chunk = ids[i:i + HYDRATE_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT id, payload_snippet, analysis_snippet FROM context_snippets "
+                f"WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update({row[0]: {"payload": row[1] or "", "analysis": row[2] or ""} for row in rows})
+        return found
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM context_snippets").fetchone()[0]
@@ -0,0 +1,88 @@
+import os
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# torch: SentenceTransformer fp32 (historique), onnx-int8: ONNX Runtime avec poids quantifiés en int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "/data/models")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0: choix automatique d'ONNX Runtime
+MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "256"))
+
+
+class TorchBackend:
+    """SentenceTransformer en PyTorch fp32"""
+
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts):
+        return self.model.encode(texts)
+
+
+class OnnxInt8Backend:
+    """
+    Même modèle exporté en ONNX puis quantifié dynamiquement en int8 (une seule fois, mis en cache sur /data).
+    Reproduit le pooling de all-MiniLM-L6-v2: moyenne des tokens pondérée par le masque puis normalisation L2.
+    """
+
+    name = "onnx-int8"
+
+    def __init__(self, model_name: str):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+        quantized_path = os.path.join(model_dir, "model_int8.onnx")
+        if not os.path.exists(quantized_path):
+            self._export(model_name, model_dir, quantized_path)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(quantized_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _export(model_name: str, model_dir: str, quantized_path: str) -> None:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        from transformers import AutoTokenizer
+
+        start = time.perf_counter()
+        os.makedirs(model_dir, exist_ok=True)
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(model_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        quantize_dynamic(os.path.join(model_dir, "model.onnx"), quantized_path, weight_type=QuantType.QInt8)
+        logger.info(f"📦 Modèle {model_name} exporté en ONNX int8 en {round(time.perf_counter() - start, 1)} s")
+
+    def encode(self, texts):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        tokens = self.tokenizer(batch, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        feed = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden = self.session.run(None, feed)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        normalized = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return normalized[0] if single else normalized
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxInt8Backend.name: OnnxInt8Backend,
+}
+
+
+def create_backend(model_name: str, backend: str = EMBEDDING_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend d'embeddings inconnu: {backend} (valeurs possibles: {', '.join(BACKENDS)})")
+    return BACKENDS[backend](model_name)
@@ -0,0 +1,96 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+# Fenêtre de regroupement: le premier texte arrivé attend au plus EMBEDDING_BATCH_WAIT_MS que d'autres le rejoignent
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+
+
+class EmbeddingBatcher:
+    """
+    File d'encodage partagée: les demandes concurrentes sont regroupées pendant quelques millisecondes
+    puis encodées en un seul appel au modèle, chaque appelant récupérant son propre vecteur.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE, max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._metrics = {"batches": 0, "items": 0, "max_batch": 0, "errors": 0,
+                         "total_wait_ms": 0.0, "total_encode_ms": 0.0}
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text: str, timeout: float = 60) -> List[float]:
+        """Encode un texte via la file (bloquant pour l'appelant, groupé pour le modèle)"""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [text for text, _, _ in batch]
+            encode_start = time.perf_counter()
+            try:
+                vectors = self.encode_batch(texts)
+            except Exception as e:
+                logger.error(f"❌ Erreur encodage par lot ({len(texts)} textes): {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._lock:
+                    self._metrics["errors"] += 1
+                continue
+            encode_ms = (time.perf_counter() - encode_start) * 1000
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._lock:
+                self._metrics["batches"] += 1
+                self._metrics["items"] += len(batch)
+                self._metrics["max_batch"] = max(self._metrics["max_batch"], len(batch))
+                self._metrics["total_wait_ms"] += sum((encode_start - queued_at) * 1000 for _, _, queued_at in batch)
+                self._metrics["total_encode_ms"] += encode_ms
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        batches = metrics["batches"]
+        items = metrics["items"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self._queue.qsize(),
+            "batches": batches,
+            "items": items,
+            "errors": metrics["errors"],
+            "avg_batch_size": round(items / batches, 2) if batches else 0,
+            "max_batch": metrics["max_batch"],
+            "avg_queue_wait_ms": round(metrics["total_wait_ms"] / items, 2) if items else None,
+            "avg_encode_ms": round(metrics["total_encode_ms"] / batches, 2) if batches else None,
+        }
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximal d'embeddings conservés; au-delà, les moins récemment utilisés sont évincés
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# L'éviction n'est vérifiée que toutes les N insertions pour ne pas compter la table à chaque requête
+EMBEDDING_CACHE_EVICT_EVERY = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY", "100"))
+# last_used n'est rafraîchi que s'il date de plus de N secondes (précision suffisante pour l'éviction LRU),
+# et les rafraîchissements sont écrits par lots de EMBEDDING_CACHE_TOUCH_BATCH
+EMBEDDING_CACHE_TOUCH_SECONDS = float(os.getenv("EMBEDDING_CACHE_TOUCH_SECONDS", "300"))
+EMBEDDING_CACHE_TOUCH_BATCH = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", "100"))
+
+
+class EmbeddingCache:
+    """
+    Cache persistant des embeddings dans la base SQLite locale (à côté de la table meta),
+    indexé par payload_hash. Les vecteurs sont stockés en float32 brut.
+    """
+
+    def __init__(self, conn, model_name: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.conn = conn
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts_since_evict = 0
+        # Rafraîchissements de last_used en attente d'écriture (payload_hash -> date d'utilisation)
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS embedding_cache (
+            payload_hash TEXT PRIMARY KEY,
+            model TEXT,
+            dim INTEGER,
+            embedding BLOB,
+            last_used REAL
+        )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used)")
+        self.conn.commit()
+        # Nombre d'entrées tenu à jour à l'écriture (exact à chaque passage d'éviction), sans COUNT pour /stats
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    def get(self, payload_hash: str) -> Optional[List[float]]:
+        # Lecture sans verrou (connexion WAL du thread); seule la comptabilité passe par le verrou
+        row = self.conn.execute(
+            "SELECT model, embedding, last_used FROM embedding_cache WHERE payload_hash = ?", (payload_hash,)
+        ).fetchone()
+        # Un embedding calculé par un autre modèle n'est pas réutilisable
+        if row is None or row[0] != self.model_name:
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            if now - (row[2] or 0) > EMBEDDING_CACHE_TOUCH_SECONDS:
+                self._touched[payload_hash] = now
+                if len(self._touched) >= EMBEDDING_CACHE_TOUCH_BATCH:
+                    self._flush_touched()
+                    self.conn.commit()
+        return np.frombuffer(row[1], dtype=np.float32).tolist()
+
+    def _flush_touched(self) -> None:
+        """Écrit les rafraîchissements de last_used en attente (verrou déjà pris, validation par l'appelant)"""
+        if self._touched:
+            self.conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE payload_hash = ?",
+                                  [(used, payload_hash) for payload_hash, used in self._touched.items()])
+            self._touched.clear()
+
+    def put(self, payload_hash: str, embedding: List[float]) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            # Remplacement d'une entrée existante (autre modèle, calcul concurrent): pas de nouvelle entrée
+            existed = self.conn.execute(
+                "SELECT 1 FROM embedding_cache WHERE payload_hash = ?", (payload_hash,)
+            ).fetchone() is not None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO embedding_cache (payload_hash, model, dim, embedding, last_used) VALUES (?, ?, ?, ?, ?)",
+                (payload_hash, self.model_name, int(vector.shape[0]), vector.tobytes(), time.time())
+            )
+            self._touched.pop(payload_hash, None)
+            if not existed:
+                self._inserts_since_evict += 1
+                self.entries += 1
+            if self._inserts_since_evict >= EMBEDDING_CACHE_EVICT_EVERY:
+                self._inserts_since_evict = 0
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        """Supprime les entrées les moins récemment utilisées au-delà de max_entries (verrou déjà pris)"""
+        # Dates d'utilisation à jour avant de choisir les entrées à évincer
+        self._flush_touched()
+        count = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        self.entries = count
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM embedding_cache WHERE payload_hash IN "
+                "(SELECT payload_hash FROM embedding_cache ORDER BY last_used ASC LIMIT ?)", (excess,)
+            )
+            self.evicted += excess
+            self.entries -= excess
+            logger.info(f"🧹 {excess} embeddings évincés du cache")
+
+    def get_or_compute(self, payload_hash: str, text: str, encode: Callable[[str], List[float]]) -> List[float]:
+        """Retourne l'embedding en cache, sinon le calcule une seule fois et le stocke"""
+        embedding = self.get(payload_hash)
+        if embedding is not None:
+            return embedding
+        embedding = encode(text)
+        try:
+            self.put(payload_hash, embedding)
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur écriture cache d'embeddings: {e}")
+        return embedding
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "evicted": self.evicted,
+        }
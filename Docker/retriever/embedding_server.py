@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Serveur d'embeddings partagé par les workers uvicorn (lancé par workers.py quand RETRIEVER_WORKERS > 1).
+Un seul processus charge le modèle (LazyEmbedder); les workers l'interrogent via RemoteEmbedder sur une
+socket Unix (multiprocessing.connection, authentifiée par EMBEDDING_SERVER_AUTHKEY). Les textes reçus de
+tous les workers passent par une même EmbeddingBatcher: des requêtes simultanées de workers différents
+sont encodées dans le même lot.
+
+Usage autonome: python embedding_server.py --socket /tmp/embeddings.sock
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client
+from typing import Optional
+
+import numpy as np
+
+from model_loader import LazyEmbedder, EMBEDDER_WAIT_TIMEOUT
+from embedding_batcher import EmbeddingBatcher
+from workers import process_memory
+
+logger = logging.getLogger(__name__)
+
+# Socket du serveur d'embeddings; vide: modèle chargé dans le processus de l'application
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+EMBEDDING_SERVER_AUTHKEY = os.getenv("EMBEDDING_SERVER_AUTHKEY", "retriever")
+
+
+class EmbeddingServer:
+    """Une connexion par worker (et par thread du worker), servie par son propre thread"""
+
+    def __init__(self, embedder: LazyEmbedder, address: str, authkey: str = EMBEDDING_SERVER_AUTHKEY):
+        self.embedder = embedder
+        self.address = address
+        self.authkey = authkey.encode()
+        self.batcher = EmbeddingBatcher(lambda texts: embedder.encode(texts))
+        self.connections = 0
+        self.requests = 0
+
+    def _encode(self, texts):
+        if isinstance(texts, str):
+            return np.asarray(self.batcher.encode(texts, timeout=EMBEDDER_WAIT_TIMEOUT), dtype=np.float32)
+        futures = [self.batcher.submit(text) for text in texts]
+        return np.asarray([future.result(timeout=EMBEDDER_WAIT_TIMEOUT) for future in futures], dtype=np.float32)
+
+    def _handle(self, connection) -> None:
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                self.requests += 1
+                try:
+                    if request[0] == "encode":
+                        reply = ("ok", self._encode(request[1]))
+                    elif request[0] == "status":
+                        reply = ("ok", dict(self.embedder.status(), server=self.stats()))
+                    else:
+                        reply = ("error", f"requête inconnue: {request[0]}")
+                except Exception as e:
+                    reply = ("error", str(e))
+                try:
+                    connection.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self) -> None:
+        self.embedder.start()
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            logger.info(f"✅ Serveur d'embeddings à l'écoute sur {self.address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    logger.warning(f"⚠️ Connexion refusée: {e}")
+                    continue
+                self.connections += 1
+                threading.Thread(target=self._handle, args=(connection,), name="embedding-connection", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {"connections": self.connections, "requests": self.requests,
+                "batcher": self.batcher.stats(), "memory": process_memory()}
+
+
+class RemoteEmbedder:
+    """
+    Même interface que LazyEmbedder (start, encode, ready, available, status) pour un modèle servi
+    par EmbeddingServer. Une connexion par thread: multiprocessing.connection n'est pas thread-safe.
+    """
+
+    def __init__(self, model_name: str, address: str = EMBEDDING_SERVER_SOCKET, authkey: str = EMBEDDING_SERVER_AUTHKEY):
+        self.model_name = model_name
+        self.address = address
+        self.authkey = authkey.encode()
+        self.backend = os.getenv("EMBEDDING_BACKEND", "torch")
+        self._local = threading.local()
+        self._started = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.error: Optional[str] = None
+        self.ready_at: Optional[float] = None
+        self.remote_status: dict = {}
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.connection = connection
+        return connection
+
+    def _call(self, *request):
+        # Une reconnexion si le serveur a été redémarré entre deux appels
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send(request)
+                status, value = connection.recv()
+                break
+            except (EOFError, OSError):
+                self._local.connection = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"Serveur d'embeddings: {value}")
+        return value
+
+    def start(self) -> None:
+        """Attend en arrière-plan que le serveur ait chargé le modèle (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._wait_ready, name="embedder-remote", daemon=True).start()
+
+    def _wait_ready(self) -> None:
+        deadline = time.time() + EMBEDDER_WAIT_TIMEOUT
+        while time.time() < deadline:
+            try:
+                self.remote_status = self._call("status")
+            except Exception as e:
+                self.remote_status = {"state": "unreachable", "error": str(e)}
+            if self.remote_status.get("state") == "ready":
+                self.ready_at = time.time()
+                self._ready.set()
+                logger.info(f"✅ Modèle d'embeddings partagé prêt (serveur pid {self.remote_status['server']['memory']['pid']})")
+                return
+            if self.remote_status.get("state") == "failed":
+                break
+            time.sleep(0.5)
+        self.error = self.remote_status.get("error") or "serveur d'embeddings non prêt"
+        logger.error(f"❌ Erreur serveur d'embeddings: {self.error}")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def available(self) -> bool:
+        return self.error is None
+
+    def encode(self, texts, timeout: float = EMBEDDER_WAIT_TIMEOUT):
+        self.start()
+        return self._call("encode", texts)
+
+    def status(self) -> dict:
+        if self.ready:
+            try:
+                self.remote_status = self._call("status")
+            except Exception as e:
+                return {"model": self.model_name, "backend": self.backend, "state": "unreachable",
+                        "error": str(e), "shared": True}
+        state = "ready" if self.ready else ("failed" if self.error else ("loading" if self._started else "idle"))
+        return {**self.remote_status, "model": self.model_name, "backend": self.backend, "state": state,
+                "error": self.error, "shared": True, "socket": self.address}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or "/tmp/embeddings.sock")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    EmbeddingServer(LazyEmbedder(args.model), args.socket).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
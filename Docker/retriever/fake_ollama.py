@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Serveur Ollama de substitution pour les benchmarks du retriever (API /api/generate et /api/tags).
+Simule le chargement du modèle (premier appel ou préchargement sans prompt), la latence avant le premier token,
+l'évaluation du prompt et un débit de génération en tokens/s, avec un nombre limité de générations simultanées
+(comme OLLAMA_NUM_PARALLEL). Les durées renvoyées suivent le format d'Ollama (nanosecondes).
+
+Usage autonome: python fake_ollama.py [--port 11434] [--tokens-per-second 20] [--ttft-ms 300] [--parallel 1]
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STRUCTURED_RESPONSE = {
+    "pattern": "fortinet_traffic_deny",
+    "resume_court": "Trafic refusé par la politique du pare-feu",
+    "statut": "Faux positif",
+    "description_faits": "Connexion entrante bloquée par le FortiGate.",
+    "analyse_technique": "Flux refusé par une règle explicite, aucune charge malveillante observée.",
+    "resultat": "Aucune action requise.",
+}
+
+
+class FakeOllama:
+    def __init__(self, tokens_per_second: float = 20.0, ttft_ms: float = 300.0, load_ms: float = 2000.0,
+                 prompt_tokens_per_second: float = 500.0, max_tokens: int = 200, parallel: int = 1):
+        self.tokens_per_second = tokens_per_second
+        self.ttft_ms = ttft_ms
+        self.load_ms = load_ms
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.max_tokens = max_tokens
+        self._slots = threading.Semaphore(parallel)
+        self._loaded = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _load(self, model: str) -> float:
+        with self._lock:
+            if model in self._loaded:
+                return 0.0
+            self._loaded.add(model)
+        time.sleep(self.load_ms / 1000)
+        return self.load_ms / 1000
+
+    def generate(self, request: dict) -> dict:
+        model = request.get("model", "mistral:7b")
+        prompt = request.get("prompt")
+        with self._slots:
+            self.requests += 1
+            load_s = self._load(model)
+            if not prompt:
+                return {"model": model, "response": "", "done": True, "load_duration": int(load_s * 1e9)}
+            prompt_tokens = max(1, len(prompt) // 4)
+            prompt_eval_s = self.ttft_ms / 1000 + prompt_tokens / self.prompt_tokens_per_second
+            tokens = min(self.max_tokens, int((request.get("options") or {}).get("num_predict") or self.max_tokens))
+            eval_s = tokens / self.tokens_per_second
+            time.sleep(prompt_eval_s + eval_s)
+        if request.get("format") == "json":
+            text = json.dumps(STRUCTURED_RESPONSE, ensure_ascii=False)
+        else:
+            text = "Type de menace: trafic refusé. Niveau de risque: Faible. " * max(1, tokens // 12)
+        return {
+            "model": model, "response": text, "done": True,
+            "load_duration": int(load_s * 1e9),
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_eval_s * 1e9),
+            "eval_count": tokens, "eval_duration": int(eval_s * 1e9),
+            "total_duration": int((load_s + prompt_eval_s + eval_s) * 1e9),
+        }
+
+
+def make_handler(fake: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._reply(200, {"models": [{"name": model} for model in sorted(fake._loaded)]})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self._reply(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            self._reply(200, fake.generate(json.loads(self.rfile.read(length) or b"{}")))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(fake: FakeOllama, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Démarre le serveur dans un thread; port 0: port libre choisi par le système (server.server_port)"""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-second", type=float, default=20.0)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--load-ms", type=float, default=2000.0)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=1)
+    args = parser.parse_args()
+    fake = FakeOllama(args.tokens_per_second, args.ttft_ms, args.load_ms, max_tokens=args.max_tokens, parallel=args.parallel)
+    server = serve(fake, args.host, args.port)
+    print(f"🤖 Ollama de substitution sur {args.host}:{server.server_port} "
+          f"({args.tokens_per_second} tokens/s, TTFT {args.ttft_ms} ms, {args.parallel} génération(s) simultanée(s))")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+import math
+import heapq
+import asyncio
+import itertools
+from typing import Dict, Optional
+
+from canonical_text import _parse
+
+# Générations Ollama simultanées (aligné sur OLLAMA_NUM_PARALLEL; 1 ou 2 sur CPU)
+GENERATION_SLOTS = int(os.getenv("GENERATION_SLOTS", "1"))
+# Au-delà, les nouvelles demandes sont refusées immédiatement avec leur position
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "50"))
+# Attente maximale en file: inférieure au timeout de l'application web (120 s) pour lui répondre avant qu'elle abandonne
+GENERATION_MAX_WAIT_SECONDS = float(os.getenv("GENERATION_MAX_WAIT_SECONDS", "90"))
+
+# Rang de priorité par crlevel FortiGate (plus petit = servi en premier)
+PRIORITY_RANKS = {"critical": 0, "high": 1, "medium": 2, "low": 3, "none": 3}
+DEFAULT_PRIORITY = "medium"
+
+
+def payload_priority(payload: str, override: Optional[str] = None) -> str:
+    """Priorité d'une demande: valeur explicite de l'appelant, sinon crlevel du payload, sinon medium"""
+    level = (override or str(_parse(payload).get("crlevel") or "")).strip().lower()
+    return level if level in PRIORITY_RANKS else DEFAULT_PRIORITY
+
+
+class QueueFull(Exception):
+    """Demande refusée par délestage (file pleine, attente estimée ou effective trop longue)"""
+
+    def __init__(self, reason: str, position: int, queued: int, estimated_wait_s: Optional[float]):
+        super().__init__(reason)
+        self.reason = reason
+        self.position = position
+        self.queued = queued
+        self.estimated_wait_s = estimated_wait_s
+
+    def to_dict(self) -> dict:
+        return {"error": "Service de génération saturé", "reason": self.reason, "queue_position": self.position,
+                "queued": self.queued, "estimated_wait_s": self.estimated_wait_s,
+                "retry_after_s": self.retry_after()}
+
+    def retry_after(self) -> int:
+        return max(1, int(math.ceil(self.estimated_wait_s or 5)))
+
+
+class GenerationScheduler:
+    """
+    File d'attente des générations Ollama devant un nombre fixe de créneaux.
+    Ordre de service: priorité (crlevel), puis rang de la demande chez son utilisateur (la 2e demande d'un
+    utilisateur passe après la 1re de tous les autres), puis ordre d'arrivée.
+    Délestage précoce: file pleine ou attente estimée au-delà de max_wait_s -> QueueFull avec la position.
+    Toutes les méthodes s'exécutent dans la boucle d'événements (pas de verrou nécessaire).
+    """
+
+    def __init__(self, slots: int = GENERATION_SLOTS, max_queue: int = GENERATION_MAX_QUEUE,
+                 max_wait_s: float = GENERATION_MAX_WAIT_SECONDS):
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self._free = self.slots
+        self._heap = []
+        self._seq = itertools.count()
+        self._queued_by_user: Dict[str, int] = {}
+        # Moyenne glissante de la durée d'une génération, base de l'estimation d'attente
+        self.avg_generation_s: Optional[float] = None
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_estimate": 0, "shed_timeout": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued_by_user.values())
+
+    def _position(self, key) -> int:
+        return 1 + sum(1 for entry in self._heap if entry[0] < key and not entry[1].done())
+
+    def _estimate(self, position: int) -> Optional[float]:
+        if self.avg_generation_s is None:
+            return None
+        # Créneaux occupés à libérer + tours complets de la file devant nous
+        return round(math.ceil(position / self.slots) * self.avg_generation_s, 1)
+
+    async def acquire(self, user: str, priority: str = DEFAULT_PRIORITY) -> None:
+        """Attend un créneau de génération; lève QueueFull si la demande est délestée"""
+        if self._free > 0 and not self.queued:
+            self._free -= 1
+            self.counters["admitted"] += 1
+            return
+
+        user = user or "anonymous"
+        key = (PRIORITY_RANKS.get(priority, PRIORITY_RANKS[DEFAULT_PRIORITY]), self._queued_by_user.get(user, 0),
+               next(self._seq))
+        position = self._position(key)
+        estimate = self._estimate(position)
+        if self.queued >= self.max_queue:
+            self.counters["shed_queue_full"] += 1
+            raise QueueFull("queue_full", position, self.queued, estimate)
+        if estimate is not None and estimate > self.max_wait_s:
+            self.counters["shed_estimate"] += 1
+            raise QueueFull("estimated_wait_too_long", position, self.queued, estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (key, future, user))
+        self._queued_by_user[user] = self._queued_by_user.get(user, 0) + 1
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            self._abandon(future, user)
+            if isinstance(e, asyncio.CancelledError):
+                # Client parti: la demande quitte simplement la file
+                raise
+            self.counters["shed_timeout"] += 1
+            raise QueueFull("wait_timeout", self._position(key), self.queued, self.max_wait_s)
+        self.counters["admitted"] += 1
+
+    def _abandon(self, future: asyncio.Future, user: str) -> None:
+        """Demande abandonnée: créneau rendu s'il venait d'être attribué, sinon retrait du décompte de la file"""
+        if future.done() and not future.cancelled():
+            self.release()
+            return
+        future.cancel()  # l'entrée reste dans le tas et sera ignorée par release
+        self._queued_by_user[user] -= 1
+        if not self._queued_by_user[user]:
+            del self._queued_by_user[user]
+
+    def release(self, generation_s: Optional[float] = None) -> None:
+        """Libère un créneau (et enregistre la durée de la génération) puis réveille la demande suivante"""
+        if generation_s is not None:
+            self.avg_generation_s = generation_s if self.avg_generation_s is None else \
+                round(0.8 * self.avg_generation_s + 0.2 * generation_s, 3)
+        while self._heap:
+            _, future, user = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self._queued_by_user[user] -= 1
+            if not self._queued_by_user[user]:
+                del self._queued_by_user[user]
+            future.set_result(True)
+            return
+        self._free += 1
+
+    def stats(self) -> dict:
+        return dict(self.counters, slots=self.slots, busy=self.slots - self._free, queued=self.queued,
+                    queued_by_user=dict(self._queued_by_user), max_queue=self.max_queue,
+                    max_wait_s=self.max_wait_s, avg_generation_s=self.avg_generation_s)
@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from canonical_text import canonical_text, index_metadata, lexical_terms
+from context_store import ContextStore, HEAVY_FIELDS, HYDRATE_CHUNK, make_snippets
+
+logger = logging.getLogger(__name__)
+
+# Nombre de candidats demandés à chaque index avant fusion (borne le coût quelle que soit la taille de la collection)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Constante de la fusion par rang réciproque (RRF): score = somme des 1 / (k + rang)
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+# Termes de la requête lexicale: seuls les plus sélectifs (moins de documents) sont gardés dans le MATCH
+MAX_QUERY_TERMS = int(os.getenv("HYBRID_LEXICAL_TERMS", "8"))
+
+# Taille des pages lues ou écrites lors d'un snapshot / restore du contexte SQLite
+CONTEXT_PAGE_SIZE = 1000
+
+# Filtres essayés du plus précis au plus large jusqu'à obtenir assez de candidats
+FILTER_LEVELS = [("vendor", "logid", "action"), ("vendor", "logid"), ("vendor",), ()]
+
+
+def _where(metadata: Dict[str, str], keys) -> Optional[dict]:
+    conditions = [{key: metadata[key]} for key in keys if metadata.get(key)]
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class HybridRetriever:
+    """
+    Recherche hybride: index vectoriel pré-filtré par métadonnées (vendor, logid, action)
+    + index lexical BM25 (SQLite FTS5) sur les valeurs des champs, fusionnés par rang réciproque.
+    """
+
+    def __init__(self, vector_store, conn):
+        self.vector_store = vector_store
+        self.conn = conn
+        self.context_store = ContextStore(conn)
+        # Transactions d'écriture seulement; les lectures passent sans verrou par la connexion WAL du thread
+        self._lock = threading.Lock()
+        # vendor indexé: le filtre par source fait partie du MATCH (appliqué par FTS5, pas après coup)
+        legacy = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'lexical_index' AND sql LIKE '%vendor UNINDEXED%'"
+        ).fetchone()
+        if legacy:
+            self.conn.execute("ALTER TABLE lexical_index RENAME TO lexical_index_legacy")
+        self.conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS lexical_index USING fts5(
+            id UNINDEXED, vendor, terms
+        )""")
+        if legacy:
+            self.conn.execute("INSERT INTO lexical_index (id, vendor, terms) SELECT id, vendor, terms FROM lexical_index_legacy")
+            self.conn.execute("DROP TABLE lexical_index_legacy")
+            logger.info("✅ Index lexical migré (vendor indexé)")
+        # Nombre de documents par terme, pour choisir les termes les plus sélectifs d'une requête
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lexical_vocab USING fts5vocab(lexical_index, 'col')")
+        self.conn.commit()
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict]) -> None:
+        """
+        Même signature que collection.upsert: enrichit les métadonnées (vendor, logid, action, device, pattern)
+        et alimente l'index lexical. Un "pattern" fourni dans les métadonnées (pattern connu de l'appelant) est conservé.
+        Le payload et l'analyse complets ne vont pas dans l'index vectoriel: seuls leurs extraits sont stockés (SQLite).
+        """
+        slim = []
+        rows = []
+        # Un payload déjà représentant de quasi-doublons garde son compteur quand il est réindexé
+        uncounted = [item_id for item_id, metadata in zip(ids, metadatas) if "dup_count" not in metadata]
+        existing = self.vector_store.get(ids=uncounted, include=["metadatas"]) if uncounted else {"ids": [], "metadatas": []}
+        counts = {item_id: (metadata or {}).get("dup_count", 1) for item_id, metadata in zip(existing["ids"], existing["metadatas"])}
+        for item_id, metadata in zip(ids, metadatas):
+            structured = index_metadata(metadata.get("payload", ""))
+            if metadata.get("pattern"):
+                structured["pattern"] = str(metadata["pattern"])[:100]
+            kept = {key: value for key, value in metadata.items() if key not in HEAVY_FIELDS}
+            # Date d'indexation (TTL) et nombre de quasi-doublons représentés (compaction, voir compaction.py)
+            kept.setdefault("indexed_at", time.time())
+            kept.setdefault("dup_count", counts.get(item_id, 1))
+            slim.append(dict(kept, **structured))
+            rows.append((item_id, structured["vendor"], " ".join(lexical_terms(canonical_text(metadata.get("payload", ""))))))
+        # Extraits et index lexical dans une même transaction, écrits avant le vecteur:
+        # un résultat de recherche a toujours de quoi être réhydraté
+        with self._lock, self.conn:
+            self.context_store.put(ids, [m.get("payload", "") for m in metadatas], [m.get("analysis", "") for m in metadatas])
+            self.conn.executemany("DELETE FROM lexical_index WHERE id = ?", [(row[0],) for row in rows])
+            self.conn.executemany("INSERT INTO lexical_index (id, vendor, terms) VALUES (?, ?, ?)", rows)
+        self.vector_store.upsert(ids=ids, embeddings=embeddings, metadatas=slim)
+
+    def _vector_candidates(self, query_embedding: List[float], metadata: Dict[str, str], limit: int, minimum: int):
+        """Recherche vectorielle avec le filtre le plus précis qui retourne au moins `minimum` candidats"""
+        for keys in FILTER_LEVELS:
+            where = _where(metadata, keys)
+            if keys and where is None:
+                continue
+            kwargs = {"query_embeddings": [query_embedding], "n_results": limit, "include": ["metadatas", "distances"]}
+            if where:
+                kwargs["where"] = where
+            try:
+                results = self.vector_store.query(**kwargs)
+            except Exception as e:
+                # Chroma lève une erreur si le filtre retient moins d'éléments que n_results sur certaines versions
+                logger.debug(f"Filtre {keys} ignoré: {e}")
+                continue
+            ids = results["ids"][0] if results["ids"] else []
+            if len(ids) >= minimum or not keys:
+                return ids, dict(zip(ids, results["metadatas"][0])), keys
+        return [], {}, ()
+
+    def _selective_terms(self, terms: List[str]) -> List[str]:
+        """Termes présents dans l'index, du plus rare au plus fréquent, limités à MAX_QUERY_TERMS"""
+        placeholders = ",".join("?" * len(terms))
+        frequencies = self.conn.execute(
+            f"SELECT term, doc FROM lexical_vocab WHERE col = 'terms' AND term IN ({placeholders})", terms
+        ).fetchall()
+        return [term for term, _ in sorted(frequencies, key=lambda row: row[1])[:MAX_QUERY_TERMS]]
+
+    def _lexical_candidates(self, text: str, vendor: str, limit: int) -> List[str]:
+        terms = list(dict.fromkeys(lexical_terms(text)))
+        if not terms:
+            return []
+        # Lecture sans verrou: connexion WAL du thread appelant, en parallèle des autres lectures et écritures
+        terms = self._selective_terms(terms)
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        match = f"terms : ({match})"
+        if vendor:
+            match = f'vendor : "{vendor}" AND {match}'
+        rows = self.conn.execute(
+            "SELECT id FROM lexical_index WHERE lexical_index MATCH ? ORDER BY bm25(lexical_index, 0, 0, 1) LIMIT ?",
+            (match, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, payload: str, query_embedding: List[float], n_results: int = 3) -> Dict[str, object]:
+        """
+        Retourne les n_results meilleures analyses (métadonnées de filtrage, extraits de contexte, scores)
+        et les timings de chaque étape
+        """
+        metadata = index_metadata(payload)
+        text = canonical_text(payload)
+        timings = {}
+
+        start = time.perf_counter()
+        vector_ids, metadatas, filter_keys = self._vector_candidates(query_embedding, metadata, HYBRID_CANDIDATES, n_results)
+        timings["vector_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        start = time.perf_counter()
+        try:
+            lexical_ids = self._lexical_candidates(text, metadata["vendor"], HYBRID_CANDIDATES)
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur index lexical: {e}")
+            lexical_ids = []
+        timings["lexical_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        scores: Dict[str, float] = {}
+        for rank, item_id in enumerate(vector_ids, 1):
+            scores[item_id] = scores.get(item_id, 0) + VECTOR_WEIGHT / (RRF_K + rank)
+        for rank, item_id in enumerate(lexical_ids, 1):
+            scores[item_id] = scores.get(item_id, 0) + LEXICAL_WEIGHT / (RRF_K + rank)
+        best = sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+        # Extraits de contexte des meilleurs résultats en une seule requête SQLite
+        start = time.perf_counter()
+        snippets = self.context_store.hydrate(best)
+        timings["hydrate_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        vector_rank = {item_id: rank for rank, item_id in enumerate(vector_ids, 1)}
+        lexical_rank = {item_id: rank for rank, item_id in enumerate(lexical_ids, 1)}
+        results = [{
+            "id": item_id,
+            "metadata": metadatas.get(item_id) or {},
+            # Vecteurs indexés avant les extraits: on retombe sur le payload complet encore présent dans leurs métadonnées
+            "snippet": snippets.get(item_id) or make_snippets((metadatas.get(item_id) or {}).get("payload", ""),
+                                                              (metadatas.get(item_id) or {}).get("analysis", "")),
+            "score": round(scores[item_id], 5),
+            "vector_rank": vector_rank.get(item_id),
+            "lexical_rank": lexical_rank.get(item_id),
+        } for item_id in best]
+        return {"results": results, "filter": list(filter_keys), "timings": timings}
+
+    def delete(self, ids: List[str]) -> None:
+        """Supprime des entrées de l'index vectoriel, de l'index lexical et des extraits de contexte"""
+        if not ids:
+            return
+        self.vector_store.delete(ids=ids)
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM lexical_index WHERE id = ?", [(item_id,) for item_id in ids])
+            self.conn.executemany("DELETE FROM context_snippets WHERE id = ?", [(item_id,) for item_id in ids])
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM lexical_index").fetchone()[0]
+
+    def export_context(self) -> Iterator[dict]:
+        """
+        Extraits et index lexical, pour vector_store.snapshot: les vecteurs ne portent que les métadonnées
+        de filtrage, un snapshot sans ces lignes se restaurerait sans contexte. Lecture par pages de rowid.
+        """
+        for kind, query in (
+            ("snippet", "SELECT rowid, id, payload_snippet, analysis_snippet FROM context_snippets "
+                        "WHERE rowid > ? ORDER BY rowid LIMIT ?"),
+            ("lexical", "SELECT rowid, id, vendor, terms FROM lexical_index WHERE rowid > ? ORDER BY rowid LIMIT ?"),
+        ):
+            last = 0
+            while True:
+                rows = self.conn.execute(query, (last, CONTEXT_PAGE_SIZE)).fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                for _, item_id, first, second in rows:
+                    if kind == "snippet":
+                        yield {"kind": kind, "id": item_id, "payload": first or "", "analysis": second or ""}
+                    else:
+                        yield {"kind": kind, "id": item_id, "vendor": first or "", "terms": second or ""}
+
+    def import_context(self, records: List[dict]) -> None:
+        """Réimporte des lignes de export_context (vector_store.restore), avant les vecteurs correspondants"""
+        snippets = [(r["id"], r["payload"], r["analysis"]) for r in records if r.get("kind") == "snippet"]
+        lexical = [(r["id"], r["vendor"], r["terms"]) for r in records if r.get("kind") == "lexical"]
+        with self._lock, self.conn:
+            if snippets:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO context_snippets (id, payload_snippet, analysis_snippet, updated_at) "
+                    "VALUES (?, ?, ?, CURRENT_TIMESTAMP)", snippets
+                )
+            if lexical:
+                # id n'est pas indexé: une seule suppression par lot, et aucune sur un index vide (store neuf)
+                if self.conn.execute("SELECT 1 FROM lexical_index LIMIT 1").fetchone():
+                    for i in range(0, len(lexical), HYDRATE_CHUNK):
+                        chunk = [row[0] for row in lexical[i:i + HYDRATE_CHUNK]]
+                        self.conn.execute(f"DELETE FROM lexical_index WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                self.conn.executemany("INSERT INTO lexical_index (id, vendor, terms) VALUES (?, ?, ?)", lexical)
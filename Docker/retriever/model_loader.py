@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+from embedding_backends import create_backend, EMBEDDING_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Délai maximal d'attente du modèle pour une requête arrivée pendant le chargement
+EMBEDDER_WAIT_TIMEOUT = float(os.getenv("EMBEDDER_WAIT_TIMEOUT", "120"))
+WARMUP_TEXT = "date=2024-01-01 devname=FGT logid=0000000013 type=traffic action=deny srcip=10.0.0.1 dstip=10.0.0.2"
+
+
+class LazyEmbedder:
+    """
+    Modèle d'embeddings chargé en tâche de fond (import du runtime compris, voir embedding_backends),
+    suivi d'un encodage de chauffe. Les appels à encode attendent la fin du chargement.
+    """
+
+    def __init__(self, model_name: str, backend: str = EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+        self._loaded = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+        self.error: Optional[str] = None
+        self.ready_at: Optional[float] = None
+        self.timings = {"load_ms": None, "warmup_ms": None}
+
+    def start(self) -> None:
+        """Démarre le chargement en arrière-plan (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load, name="embedder-loader", daemon=True).start()
+
+    def _load(self) -> None:
+        try:
+            start = time.perf_counter()
+            model = create_backend(self.model_name, self.backend)
+            self.timings["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+            # Premier encodage: initialise les noyaux et alloue les buffers avant la première vraie requête
+            start = time.perf_counter()
+            model.encode([WARMUP_TEXT])
+            self.timings["warmup_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+            self._model = model
+            self.ready_at = time.time()
+            logger.info(f"✅ Modèle d'embeddings chargé ({self.backend}: chargement {self.timings['load_ms']} ms, "
+                        f"chauffe {self.timings['warmup_ms']} ms)")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"❌ Erreur chargement embeddings: {e}")
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    @property
+    def available(self) -> bool:
+        """Vrai tant que le chargement n'a pas échoué (le modèle peut encore être en cours de chargement)"""
+        return self.error is None
+
+    def encode(self, texts, timeout: float = EMBEDDER_WAIT_TIMEOUT):
+        self.start()
+        if not self._loaded.wait(timeout):
+            raise TimeoutError(f"Modèle d'embeddings non chargé après {timeout} s")
+        if self._model is None:
+            raise RuntimeError(f"Modèle d'embeddings indisponible: {self.error}")
+        return self._model.encode(texts)
+
+    def status(self) -> dict:
+        state = "ready" if self.ready else ("failed" if self.error else ("loading" if self._started else "idle"))
+        return {"model": self.model_name, "backend": self.backend, "state": state, "error": self.error, **self.timings}
@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUMPY_VECTOR_PATH = os.getenv("NUMPY_VECTOR_PATH", "/data/vectors")
+# float16: 2 octets par dimension; int8: 1 octet par dimension + une échelle float32 par vecteur
+NUMPY_VECTOR_DTYPE = os.getenv("NUMPY_VECTOR_DTYPE", "float16")
+# Lignes converties en float32 par bloc pendant une recherche: des blocs qui tiennent en cache CPU
+# convertissent nettement plus vite (voir bench_vector_store.py)
+NUMPY_SEARCH_CHUNK = int(os.getenv("NUMPY_SEARCH_CHUNK", "4096"))
+# Réécriture des fichiers quand la part de lignes remplacées ou supprimées dépasse ce ratio
+NUMPY_VACUUM_RATIO = float(os.getenv("NUMPY_VACUUM_RATIO", "0.3"))
+NUMPY_VACUUM_MIN_ROWS = 1000
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+class NumpyCollection:
+    """
+    Collection vectorielle locale, sans dépendance autre que NumPy, avec l'interface de collection Chroma
+    utilisée par le retriever (upsert, query, get, update, delete, count, filtres where d'égalité).
+
+    Fichiers (append-only, suffixés par la génération courante enregistrée dans settings.json):
+    - vectors.<génération>.<f16|i8>: matrice des embeddings normalisés, mappée en mémoire (np.memmap),
+    - scales.<génération>.f32: échelle de chaque vecteur (int8 uniquement),
+    - rows.<génération>.jsonl: journal id/métadonnées de chaque ligne, mises à jour de métadonnées et suppressions.
+    Un upsert d'un id existant ajoute une ligne et rend l'ancienne inactive; vacuum() écrit une nouvelle
+    génération sans les lignes inactives quand elles deviennent trop nombreuses.
+
+    Recherche exacte: produit scalaire (cosinus) de la requête avec toute la matrice, par blocs, puis top-k
+    par argpartition. Les distances suivent l'espace l2 de Chroma: 2 - 2 cos sur vecteurs normalisés.
+    """
+
+    def __init__(self, path: str = NUMPY_VECTOR_PATH, dtype: str = NUMPY_VECTOR_DTYPE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        settings = self._read_settings()
+        self.dtype = settings.get("dtype", dtype)
+        if self.dtype not in ("float16", "int8"):
+            raise ValueError(f"NUMPY_VECTOR_DTYPE inconnu: {self.dtype}")
+        self.dim: Optional[int] = settings.get("dim")
+        self.generation: int = settings.get("generation", 0)
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _vectors_file(self, generation: Optional[int] = None) -> str:
+        suffix = "f16" if self.dtype == "float16" else "i8"
+        return self._file(f"vectors.{self.generation if generation is None else generation}.{suffix}")
+
+    def _scales_file(self, generation: Optional[int] = None) -> str:
+        return self._file(f"scales.{self.generation if generation is None else generation}.f32")
+
+    def _rows_file(self, generation: Optional[int] = None) -> str:
+        return self._file(f"rows.{self.generation if generation is None else generation}.jsonl")
+
+    def _read_settings(self) -> dict:
+        try:
+            with open(self._file("settings.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_settings(self) -> None:
+        with open(self._file("settings.json.tmp"), "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "generation": self.generation}, f)
+        os.replace(self._file("settings.json.tmp"), self._file("settings.json"))
+
+    def _load(self) -> None:
+        start = time.perf_counter()
+        self._ids: List[str] = []
+        self._metadatas: List[dict] = []
+        self._index: Dict[str, int] = {}
+        self._columns: Dict[str, Dict[str, object]] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._matrix = None
+        self._scales = None
+        self._dead = 0
+
+        stored = 0
+        if self.dim:
+            stored = os.path.getsize(self._vectors_file()) // (self.dim * np.dtype(self.dtype).itemsize) \
+                if os.path.exists(self._vectors_file()) else 0
+        rows = []
+        if os.path.exists(self._rows_file()):
+            with open(self._rows_file(), "rb+") as f:
+                data = f.read()
+                # Dernière ligne tronquée par un arrêt brutal: retirée pour que les ajouts suivants restent lisibles
+                complete = data.rfind(b"\n") + 1
+                if complete < len(data):
+                    f.truncate(complete)
+            rows = [json.loads(line) for line in data[:complete].decode("utf-8").splitlines() if line]
+        for record in rows:
+            if "row" in record:
+                # Vecteur écrit avant son entrée de journal: une ligne sans vecteur complet est ignorée
+                if record["row"] >= stored:
+                    continue
+                self._append_row(record["id"], record.get("metadata") or {})
+            elif record.get("deleted"):
+                self._kill(record["id"])
+            elif record["id"] in self._index:
+                self._metadatas[self._index[record["id"]]] = record.get("metadata") or {}
+        # Vecteurs écrits sans entrée de journal (arrêt entre les deux écritures): tronqués
+        if stored > len(self._ids):
+            with open(self._vectors_file(), "r+b") as f:
+                f.truncate(len(self._ids) * self.dim * np.dtype(self.dtype).itemsize)
+            if self.dtype == "int8":
+                with open(self._scales_file(), "r+b") as f:
+                    f.truncate(len(self._ids) * 4)
+        self._remap()
+        if self._ids:
+            logger.info(f"✅ Index vectoriel NumPy chargé: {self.count()} vecteurs ({self.dtype}, "
+                        f"{round((time.perf_counter() - start) * 1000, 1)} ms)")
+
+    def _remap(self) -> None:
+        rows = len(self._ids)
+        if not rows:
+            self._matrix = self._scales = None
+            return
+        self._matrix = np.memmap(self._vectors_file(), dtype=self.dtype, mode="r", shape=(rows, self.dim))
+        if self.dtype == "int8":
+            self._scales = np.memmap(self._scales_file(), dtype=np.float32, mode="r", shape=(rows,))
+
+    def _append_row(self, item_id: str, metadata: dict) -> None:
+        row = len(self._ids)
+        self._kill(item_id)
+        self._ids.append(item_id)
+        self._metadatas.append(metadata)
+        self._index[item_id] = row
+        if row >= len(self._alive):
+            self._alive = np.concatenate([self._alive, np.zeros(max(1024, row), dtype=bool)])
+        self._alive[row] = True
+        for key, column in self._columns.items():
+            self._column_append(column, metadata.get(key))
+
+    def _kill(self, item_id: str) -> None:
+        row = self._index.pop(item_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self._dead += 1
+
+    def _journal(self, records: List[dict]) -> None:
+        with open(self._rows_file(), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    @staticmethod
+    def _column_append(column: dict, value) -> None:
+        codes = column["codes"]
+        code = codes.setdefault(value, len(codes))
+        size = column["size"]
+        if size >= len(column["values"]):
+            column["values"] = np.concatenate([column["values"], np.zeros(max(1024, size), dtype=np.int32)])
+        column["values"][size] = code
+        column["size"] = size + 1
+
+    def _column(self, key: str) -> dict:
+        """Codes entiers de la valeur de `key` pour chaque ligne (construits au premier filtre sur cette clé)"""
+        column = self._columns.get(key)
+        if column is None:
+            column = {"codes": {}, "values": np.zeros(0, dtype=np.int32), "size": 0}
+            for metadata in self._metadatas:
+                self._column_append(column, metadata.get(key))
+            self._columns[key] = column
+        return column
+
+    def _mask(self, where: Optional[dict]) -> np.ndarray:
+        rows = len(self._ids)
+        mask = self._alive[:rows].copy()
+        if not where:
+            return mask
+        conditions = where["$and"] if "$and" in where else [where]
+        for condition in conditions:
+            for key, value in condition.items():
+                if isinstance(value, dict):
+                    if set(value) != {"$eq"}:
+                        raise ValueError(f"Opérateur non supporté par l'index NumPy: {value}")
+                    value = value["$eq"]
+                column = self._column(key)
+                code = column["codes"].get(value)
+                if code is None:
+                    return np.zeros(rows, dtype=bool)
+                mask &= column["values"][:rows] == code
+        return mask
+
+    def _encode(self, vectors: np.ndarray):
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors *= np.asarray(self._scales[rows])[:, None]
+        return vectors
+
+    def upsert(self, ids: List[str], embeddings, metadatas: Optional[List[dict]] = None, documents=None) -> None:
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_settings()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Dimension {vectors.shape[1]} différente de celle de l'index ({self.dim})")
+            encoded, scales = self._encode(vectors)
+            # Vecteurs d'abord, journal ensuite: au rechargement, seules les lignes journalisées comptent
+            with open(self._vectors_file(), "ab") as f:
+                f.write(encoded.tobytes())
+            if scales is not None:
+                with open(self._scales_file(), "ab") as f:
+                    f.write(scales.tobytes())
+            first = len(self._ids)
+            records = []
+            for offset, (item_id, metadata) in enumerate(zip(ids, metadatas)):
+                self._append_row(item_id, dict(metadata or {}))
+                records.append({"row": first + offset, "id": item_id, "metadata": metadata or {}})
+            self._journal(records)
+            self._remap()
+            if self._dead > NUMPY_VACUUM_MIN_ROWS and self._dead > NUMPY_VACUUM_RATIO * len(self._ids):
+                self.vacuum()
+
+    add = upsert
+
+    def update(self, ids: List[str], metadatas: Optional[List[dict]] = None, embeddings=None, documents=None) -> None:
+        if embeddings is not None:
+            with self._lock:
+                current = [self._metadatas[self._index[i]] if i in self._index else {} for i in ids]
+            self.upsert(ids, embeddings, metadatas or current)
+            return
+        if not metadatas:
+            return
+        with self._lock:
+            records = []
+            for item_id, metadata in zip(ids, metadatas):
+                row = self._index.get(item_id)
+                if row is None:
+                    continue
+                self._metadatas[row] = dict(metadata or {})
+                for key, column in self._columns.items():
+                    code = column["codes"].setdefault(self._metadatas[row].get(key), len(column["codes"]))
+                    column["values"][row] = code
+                records.append({"id": item_id, "metadata": metadata or {}})
+            self._journal(records)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> None:
+        with self._lock:
+            if ids is None:
+                ids = [self._ids[row] for row in np.flatnonzero(self._mask(where))] if where else []
+            ids = [item_id for item_id in ids if item_id in self._index]
+            for item_id in ids:
+                self._kill(item_id)
+            self._journal([{"id": item_id, "deleted": True} for item_id in ids])
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["metadatas"]
+        with self._lock:
+            if ids is not None:
+                rows = np.array([self._index[i] for i in ids if i in self._index], dtype=np.int64)
+                if where:
+                    rows = rows[self._mask(where)[rows]]
+            else:
+                rows = np.flatnonzero(self._mask(where))
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            result = {"ids": [self._ids[row] for row in rows], "embeddings": None, "metadatas": None, "documents": None}
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[row] for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = self._decode(rows).tolist() if len(rows) else []
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["metadatas", "distances"]
+        queries = _normalize(query_embeddings)
+        while True:
+            result = self._query(queries, n_results, where, include)
+            if result is not None:
+                return result
+
+    def _query(self, queries: np.ndarray, n_results: int, where: Optional[dict], include: List[str]) -> Optional[dict]:
+        with self._lock:
+            mask = self._mask(where)
+            matrix, scales, generation = self._matrix, self._scales, self.generation
+        result = {"ids": [], "distances": [], "metadatas": [], "documents": [], "embeddings": None}
+        candidates = int(mask.sum())
+        if matrix is None or not candidates:
+            for _ in queries:
+                for key in ("ids", "distances", "metadatas", "documents"):
+                    result[key].append([])
+            return result
+
+        # Filtre sélectif (cas de la recherche hybride): seules les lignes retenues sont lues et comparées.
+        # Sinon produit scalaire par blocs sur toute la matrice mappée, lignes exclues à -inf.
+        # Les lignes ajoutées après l'instantané du masque sont ignorées.
+        rows = len(mask)
+        positions = np.flatnonzero(mask) if candidates < rows // 4 else None
+        total = rows if positions is None else len(positions)
+        scores = np.empty((total, len(queries)), dtype=np.float32)
+        for start in range(0, total, NUMPY_SEARCH_CHUNK):
+            end = min(total, start + NUMPY_SEARCH_CHUNK)
+            selection = slice(start, end) if positions is None else positions[start:end]
+            block = np.asarray(matrix[selection], dtype=np.float32) @ queries.T
+            if scales is not None:
+                block *= np.asarray(scales[selection])[:, None]
+            scores[start:end] = block
+        if positions is None:
+            scores[~mask] = -np.inf
+            positions = np.arange(rows)
+
+        k = min(n_results, candidates)
+        with self._lock:
+            # Numéros de ligne renumérotés par un vacuum pendant le calcul: recherche à refaire
+            if self.generation != generation:
+                return None
+            for column in scores.T:
+                top = np.argpartition(-column, k - 1)[:k] if k < total else np.arange(total)
+                top = top[np.argsort(-column[top], kind="stable")][:k]
+                result["ids"].append([self._ids[positions[i]] for i in top])
+                result["distances"].append([float(2 - 2 * column[i]) for i in top])
+                result["metadatas"].append([self._metadatas[positions[i]] for i in top] if "metadatas" in include else None)
+                result["documents"].append([None] * len(top))
+        return result
+
+    def vacuum(self) -> dict:
+        """
+        Écrit une nouvelle génération de fichiers sans les lignes inactives; settings.json, remplacé atomiquement,
+        désigne la génération active: un arrêt pendant la réécriture laisse l'ancienne génération intacte
+        """
+        with self._lock:
+            start = time.perf_counter()
+            removed = len(self._ids) - self.count()
+            rows = np.flatnonzero(self._alive[:len(self._ids)])
+            previous, generation = self.generation, self.generation + 1
+            with open(self._vectors_file(generation), "wb") as f:
+                for i in range(0, len(rows), NUMPY_SEARCH_CHUNK):
+                    f.write(np.asarray(self._matrix[rows[i:i + NUMPY_SEARCH_CHUNK]]).tobytes())
+            if self.dtype == "int8":
+                with open(self._scales_file(generation), "wb") as f:
+                    f.write(np.asarray(self._scales[rows], dtype=np.float32).tobytes())
+            with open(self._rows_file(generation), "w", encoding="utf-8") as f:
+                for new_row, row in enumerate(rows):
+                    f.write(json.dumps({"row": new_row, "id": self._ids[row], "metadata": self._metadatas[row]},
+                                       ensure_ascii=False) + "\n")
+            self.generation = generation
+            self._write_settings()
+            for path in (self._vectors_file(previous), self._scales_file(previous), self._rows_file(previous)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._load()
+            duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            logger.info(f"🧹 Index NumPy réécrit: {removed} lignes inactives supprimées en {duration_ms} ms")
+            return {"removed": removed, "rows": len(self._ids), "duration_ms": duration_ms}
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = len(self._ids)
+            return {"engine": "numpy", "dtype": self.dtype, "dim": self.dim, "count": self.count(),
+                    "rows": rows, "inactive_rows": rows - self.count(), "path": self.path,
+                    "matrix_bytes": rows * (self.dim or 0) * np.dtype(self.dtype).itemsize}
@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Durée de maintien en mémoire du modèle après chaque appel ("30m", "2h"...; -1: indéfiniment, 0: déchargé aussitôt)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Intervalle (s) des appels de maintien au chaud quand le service est inactif; 0 désactive
+OLLAMA_KEEP_WARM_INTERVAL = int(os.getenv("OLLAMA_KEEP_WARM_INTERVAL", "0"))
+# Au-delà de ce temps de chargement renvoyé par Ollama, l'appel est compté comme "à froid"
+COLD_LOAD_THRESHOLD_MS = float(os.getenv("OLLAMA_COLD_LOAD_THRESHOLD_MS", "500"))
+LATENCY_WINDOW = 200
+
+
+def parse_keep_alive(value: str) -> Union[int, str]:
+    """Ollama attend un nombre de secondes ou une durée Go ("30m"): "-1" doit être envoyé comme entier"""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _percentile(values, percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+class OllamaWarmer:
+    """
+    Préchargement des modèles Ollama au démarrage (requête sans prompt: Ollama charge le modèle et répond),
+    maintien en mémoire via keep_alive et suivi séparé des latences de génération à froid et à chaud.
+    """
+
+    def __init__(self, models: List[str], keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 keep_warm_interval: int = OLLAMA_KEEP_WARM_INTERVAL):
+        self.models = [model for model in dict.fromkeys(models) if model]
+        self.keep_alive = parse_keep_alive(keep_alive)
+        self.keep_warm_interval = keep_warm_interval
+        self.preload_state: Dict[str, dict] = {model: {"state": "pending"} for model in self.models}
+        self.last_call: Dict[str, float] = {}
+        self._latencies = {"cold": deque(maxlen=LATENCY_WINDOW), "warm": deque(maxlen=LATENCY_WINDOW)}
+        self._ttft = {"cold": deque(maxlen=LATENCY_WINDOW), "warm": deque(maxlen=LATENCY_WINDOW)}
+        self._counts = {"cold": 0, "warm": 0}
+
+    async def _load(self, client, model: str) -> dict:
+        start = time.perf_counter()
+        response = await client.post("/api/generate", json={"model": model, "keep_alive": self.keep_alive})
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        self.last_call[model] = time.time()
+        return {"elapsed_ms": elapsed, "load_ms": round(response.json().get("load_duration", 0) / 1e6, 1)}
+
+    async def preload(self, client) -> None:
+        """Charge chaque modèle configuré; une erreur (Ollama pas encore démarré) n'empêche pas le service de démarrer"""
+        for model in self.models:
+            self.preload_state[model] = {"state": "loading"}
+            try:
+                timings = await self._load(client, model)
+                self.preload_state[model] = {"state": "loaded", "loaded_at": time.time(), **timings}
+                logger.info(f"🔥 Modèle Ollama {model} préchargé en {timings['elapsed_ms']} ms (keep_alive {self.keep_alive})")
+            except Exception as e:
+                self.preload_state[model] = {"state": "failed", "error": str(e)}
+                logger.warning(f"⚠️ Préchargement du modèle Ollama {model} impossible: {e}")
+
+    async def keep_warm(self, client) -> None:
+        """Rafraîchit le keep_alive des modèles restés sans appel depuis plus d'un intervalle"""
+        if self.keep_warm_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.keep_warm_interval)
+            for model in self.models:
+                if time.time() - self.last_call.get(model, 0) < self.keep_warm_interval:
+                    continue
+                try:
+                    await self._load(client, model)
+                except Exception as e:
+                    logger.warning(f"⚠️ Maintien au chaud du modèle Ollama {model} impossible: {e}")
+
+    def record(self, model: str, load_ms: float, generation_ms: float, ttft_ms: float) -> str:
+        """Enregistre une génération et retourne sa classe ("cold" si Ollama a dû charger le modèle)"""
+        kind = "cold" if load_ms >= COLD_LOAD_THRESHOLD_MS else "warm"
+        self.last_call[model] = time.time()
+        self._counts[kind] += 1
+        self._latencies[kind].append(generation_ms)
+        self._ttft[kind].append(ttft_ms)
+        return kind
+
+    def status(self) -> dict:
+        latency = {}
+        for kind in ("cold", "warm"):
+            values = list(self._latencies[kind])
+            ttft = list(self._ttft[kind])
+            latency[kind] = {
+                "count": self._counts[kind],
+                "p50_ms": _percentile(values, 50),
+                "p95_ms": _percentile(values, 95),
+                "ttft_p50_ms": _percentile(ttft, 50),
+                "last_ms": values[-1] if values else None,
+            }
+        return {
+            "keep_alive": self.keep_alive,
+            "keep_warm_interval_s": self.keep_warm_interval,
+            "cold_threshold_ms": COLD_LOAD_THRESHOLD_MS,
+            "preload": self.preload_state,
+            "latency": latency,
+        }
@@ -0,0 +1,301 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+# Attente maximale avant de traiter une écriture isolée (les suivantes arrivées entre-temps partent dans le même lot)
+OUTBOX_FLUSH_INTERVAL_MS = float(os.getenv("OUTBOX_FLUSH_INTERVAL_MS", "200"))
+# Tentatives d'une écriture isolée avant de vérifier si elle est seule en cause (voir _settle_poison)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "60"))
+
+
+# Erreurs liées à la donnée elle-même (la rejouer n'y changera rien), reconnues par nom de classe pour ne pas
+# importer les pilotes: DataError/IntegrityError de SQLAlchemy et des pilotes DB-API, encodage.
+# Les erreurs de schéma ou de code touchent toutes les écritures: elles passent par la sonde (_settle_poison).
+PERMANENT_ERRORS = {"DataError", "IntegrityError", "UnicodeError"}
+
+
+def is_permanent_error(error: Exception) -> bool:
+    return any(cls.__name__ in PERMANENT_ERRORS for cls in type(error).__mro__)
+
+
+class Outbox:
+    """
+    File d'écritures durable (table SQLite outbox) vidée en arrière-plan par lots.
+    Chaque destination (sink) a son propre curseur: elle reçoit les écritures dans l'ordre d'enregistrement,
+    une destination en panne ne retarde pas les autres. Un lot en échec est rejoué avec un délai croissant;
+    après un échec, les écritures repassent une par une pour isoler celle qui bloque.
+    Une écriture n'est mise à l'écart (outbox_dead, ligne complète, rejouable via replay_dead) que si l'erreur
+    est permanente ou si la destination accepte l'écriture suivante: une destination simplement indisponible
+    est réessayée indéfiniment, sans perte. Une ligne est supprimée quand toutes les destinations l'ont traitée.
+    """
+
+    def __init__(self, conn, sinks: Dict[str, Callable[[List[dict]], None]], batch_size: int = OUTBOX_BATCH_SIZE):
+        self.conn = conn
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {"enqueued": 0, "written": 0, "batches": 0, "failures": 0, "dead": 0}
+        self.last_error: Optional[str] = None
+        self.last_batch_ms: Dict[str, float] = {}
+        # Après l'échec d'un lot, ses écritures repassent une par une jusqu'à ce seq
+        self._isolate_until: Dict[str, int] = {}
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload_hash TEXT,
+            payload TEXT,
+            analysis TEXT,
+            generated INTEGER,
+            pattern TEXT,
+            embedding BLOB,
+            created_at REAL,
+            variant TEXT
+        )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox_cursors (
+            sink TEXT PRIMARY KEY,
+            last_seq INTEGER,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL DEFAULT 0,
+            last_error TEXT
+        )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox_dead (
+            sink TEXT,
+            seq INTEGER,
+            payload_hash TEXT,
+            error TEXT,
+            failed_at REAL,
+            payload TEXT,
+            analysis TEXT,
+            generated INTEGER,
+            pattern TEXT,
+            embedding BLOB,
+            variant TEXT
+        )""")
+        # Bases créées avant que outbox et outbox_dead ne gardent la ligne complète
+        for table, columns in (("outbox", (("variant", "TEXT"),)),
+                               ("outbox_dead", (("payload", "TEXT"), ("analysis", "TEXT"), ("generated", "INTEGER"),
+                                                ("pattern", "TEXT"), ("embedding", "BLOB"), ("variant", "TEXT")))):
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})").fetchall()}
+            for column, kind in columns:
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        # Une destination ajoutée plus tard démarre après les écritures déjà présentes
+        start = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM outbox").fetchone()[0]
+        for sink in sinks:
+            self.conn.execute("INSERT OR IGNORE INTO outbox_cursors (sink, last_seq) VALUES (?, ?)", (sink, start))
+        self.conn.commit()
+
+    def enqueue(self, payload_hash: str, payload: str, analysis: str, generated: bool,
+                pattern: Optional[str] = None, embedding: Optional[List[float]] = None,
+                variant: Optional[str] = None) -> int:
+        """Enregistre une écriture (une insertion SQLite locale) et réveille l'écrivain"""
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (payload_hash, payload, analysis, generated, pattern, embedding, created_at, variant) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (payload_hash, payload, analysis, int(generated), pattern or "", blob, time.time(), variant)
+            )
+            self.conn.commit()
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Arrête l'écrivain après une dernière passe; le reste éventuel repart au prochain démarrage"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(timeout=1.0)
+            self._wakeup.clear()
+            # Laisse les écritures concurrentes rejoindre le lot
+            time.sleep(OUTBOX_FLUSH_INTERVAL_MS / 1000)
+            self.drain()
+        self.drain()
+
+    @staticmethod
+    def _row(row) -> dict:
+        return {
+            "seq": row[0], "payload_hash": row[1], "payload": row[2], "analysis": row[3],
+            "generated": bool(row[4]), "pattern": row[5] or None,
+            "embedding": np.frombuffer(row[6], dtype=np.float32).tolist() if row[6] else None,
+            "variant": row[7],
+        }
+
+    def _rows(self, after_seq: int, limit: int) -> List[dict]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT seq, payload_hash, payload, analysis, generated, pattern, embedding, variant FROM outbox "
+                "WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def drain(self) -> int:
+        """Une passe sur chaque destination prête; retourne le nombre d'écritures effectuées"""
+        written = 0
+        for sink, write in self.sinks.items():
+            with self._lock:
+                last_seq, attempts, next_attempt_at = self.conn.execute(
+                    "SELECT last_seq, attempts, next_attempt_at FROM outbox_cursors WHERE sink = ?", (sink,)
+                ).fetchone()
+            if next_attempt_at > time.time():
+                continue
+            while True:
+                # Après un échec, une seule écriture à la fois pour isoler celle qui bloque
+                limit = 1 if attempts or last_seq < self._isolate_until.get(sink, 0) else self.batch_size
+                rows = self._rows(last_seq, limit)
+                if not rows:
+                    break
+                start = time.perf_counter()
+                try:
+                    write(rows)
+                except Exception as e:
+                    settled = self._settle_poison(sink, write, rows[0], attempts + 1, e) if len(rows) == 1 else None
+                    if settled:
+                        last_seq, probed = settled
+                        attempts = 0
+                        written += probed
+                        continue
+                    self._isolate_until[sink] = max(self._isolate_until.get(sink, 0), rows[-1]["seq"])
+                    self._record_failure(sink, rows, attempts + 1, e)
+                    break
+                self.last_batch_ms[sink] = round((time.perf_counter() - start) * 1000, 1)
+                last_seq, attempts = rows[-1]["seq"], 0
+                with self._lock, self.conn:
+                    self.conn.execute(
+                        "UPDATE outbox_cursors SET last_seq = ?, attempts = 0, next_attempt_at = 0, last_error = NULL "
+                        "WHERE sink = ?", (last_seq, sink)
+                    )
+                self.counters["batches"] += 1
+                written += len(rows)
+                if len(rows) < limit or self._stopping.is_set():
+                    break
+        self.counters["written"] += written
+        self._purge()
+        return written
+
+    def _settle_poison(self, sink: str, write: Callable[[List[dict]], None], row: dict, attempts: int,
+                       error: Exception):
+        """
+        Décide si une écriture isolée en échec bloque seule sa destination. Oui si l'erreur est permanente,
+        ou si, après OUTBOX_MAX_ATTEMPTS tentatives, la destination accepte l'écriture suivante (sonde).
+        Dans ce cas l'écriture est mise à l'écart et le curseur avance; retourne (dernier seq traité, écritures
+        effectuées par la sonde). Sinon (panne de la destination, ou pas d'écriture suivante pour trancher): None.
+        """
+        if not is_permanent_error(error):
+            if attempts < OUTBOX_MAX_ATTEMPTS:
+                return None
+            probe = self._rows(row["seq"], 1)
+            if not probe:
+                return None
+            try:
+                write(probe)
+            except Exception:
+                return None
+        else:
+            probe = []
+        last_seq = probe[0]["seq"] if probe else row["seq"]
+        blob = np.asarray(row["embedding"], dtype=np.float32).tobytes() if row["embedding"] is not None else None
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO outbox_dead (sink, seq, payload_hash, error, failed_at, payload, analysis, generated, "
+                "pattern, embedding, variant) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sink, row["seq"], row["payload_hash"], str(error), time.time(), row["payload"], row["analysis"],
+                 int(row["generated"]), row["pattern"] or "", blob, row["variant"])
+            )
+            self.conn.execute(
+                "UPDATE outbox_cursors SET last_seq = ?, attempts = 0, next_attempt_at = 0, last_error = ? WHERE sink = ?",
+                (last_seq, str(error), sink)
+            )
+        self.counters["dead"] += 1
+        self.counters["failures"] += 1
+        self.last_error = f"{sink}: {error}"
+        logger.error(f"❌ Outbox {sink}: écriture {row['seq']} mise à l'écart après {attempts} tentatives "
+                     f"({'erreur permanente' if not probe else 'écriture suivante acceptée'}): {error}")
+        return last_seq, len(probe)
+
+    def _record_failure(self, sink: str, rows: List[dict], attempts: int, error: Exception) -> None:
+        self.counters["failures"] += 1
+        self.last_error = f"{sink}: {error}"
+        delay = min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** attempts)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox_cursors SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE sink = ?",
+                (attempts, time.time() + delay, str(error), sink)
+            )
+        logger.warning(f"⚠️ Outbox {sink}: échec du lot ({len(rows)} écritures, tentative {attempts}), "
+                       f"nouvel essai dans {delay} s: {error}")
+
+    def replay_dead(self, sink: Optional[str] = None, limit: int = 100) -> dict:
+        """Rejoue les écritures mises à l'écart (d'une destination ou de toutes); celles qui passent sont retirées"""
+        with self._lock:
+            query = ("SELECT rowid, sink, seq, payload_hash, payload, analysis, generated, pattern, embedding, variant "
+                     "FROM outbox_dead WHERE payload IS NOT NULL")
+            params: list = []
+            if sink:
+                query += " AND sink = ?"
+                params.append(sink)
+            dead = self.conn.execute(query + " ORDER BY seq LIMIT ?", params + [limit]).fetchall()
+        replayed, failed = 0, 0
+        for rowid, dead_sink, *row in dead:
+            write = self.sinks.get(dead_sink)
+            if write is None:
+                continue
+            try:
+                write([self._row(row)])
+            except Exception as e:
+                failed += 1
+                logger.warning(f"⚠️ Outbox {dead_sink}: écriture {row[0]} toujours en échec: {e}")
+                continue
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM outbox_dead WHERE rowid = ?", (rowid,))
+            replayed += 1
+        return {"replayed": replayed, "failed": failed}
+
+    def _purge(self) -> None:
+        """Supprime les lignes traitées (ou mises à l'écart) par toutes les destinations"""
+        with self._lock:
+            self.conn.execute(
+                f"DELETE FROM outbox WHERE seq <= (SELECT MIN(last_seq) FROM outbox_cursors "
+                f"WHERE sink IN ({','.join('?' * len(self.sinks))}))", list(self.sinks)
+            )
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = {
+                sink: {"pending": count, "attempts": attempts, "last_error": last_error}
+                for sink, count, attempts, last_error in self.conn.execute(
+                    # seq est monotone (AUTOINCREMENT): l'écart au dernier seq donne la profondeur sans parcourir la table
+                    "SELECT c.sink, MAX(0, (SELECT COALESCE(MAX(seq), 0) FROM outbox) - c.last_seq), c.attempts, "
+                    "c.last_error FROM outbox_cursors c"
+                ).fetchall() if sink in self.sinks
+            }
+            oldest = self.conn.execute("SELECT created_at FROM outbox ORDER BY seq LIMIT 1").fetchone()
+            oldest = oldest[0] if oldest else None
+            dead = self.conn.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+        return dict(self.counters, depth=max([s["pending"] for s in pending.values()] or [0]), sinks=pending,
+                    dead_total=dead, oldest_pending_age_s=round(time.time() - oldest, 1) if oldest else None,
+                    last_error=self.last_error, last_batch_ms=self.last_batch_ms,
+                    running=bool(self._thread and self._thread.is_alive()))
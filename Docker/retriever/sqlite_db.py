@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import logging
+import threading
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Attente maximale d'un verrou d'écriture tenu par un autre thread avant "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "10"))
+# Requêtes préparées gardées en cache par connexion (toutes nos requêtes sont des chaînes constantes paramétrées)
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+# NORMAL en WAL: durable à chaque checkpoint, sans fsync à chaque commit
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+
+class SQLiteDatabase:
+    """
+    Accès à la base SQLite locale sûr entre threads: journal WAL (lectures concurrentes pendant une écriture),
+    une connexion par thread (les transactions d'un thread ne sont jamais validées par un autre),
+    attente des verrous via busy_timeout et cache de requêtes préparées.
+
+    Expose le sous-ensemble de sqlite3.Connection utilisé par les modules (execute, executemany, commit,
+    et `with db:` pour une transaction), qui s'applique à la connexion du thread appelant.
+    `with db:` ouvre une transaction BEGIN IMMEDIATE validée à la sortie (annulée sur exception);
+    les blocs imbriqués font partie de la transaction englobante.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = SQLITE_BUSY_TIMEOUT_SECONDS,
+                 cached_statements: int = SQLITE_CACHED_STATEMENTS):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        # Le mode WAL est persistant dans le fichier: une seule bascule suffit
+        self.journal_mode = self.connection().execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if self.journal_mode != "wal":
+            logger.warning(f"⚠️ SQLite: journal WAL indisponible pour {path} (mode {self.journal_mode})")
+
+    def connection(self) -> sqlite3.Connection:
+        """Connexion du thread appelant, ouverte à la première utilisation"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False uniquement pour permettre close() depuis le thread d'arrêt
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, cached_statements=self.cached_statements,
+                                   check_same_thread=False)
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        return self.connection().executemany(sql, seq_of_parameters)
+
+    def commit(self) -> None:
+        # Dans un bloc `with db:`, la validation est faite par le bloc le plus externe
+        if not getattr(self._local, "depth", 0):
+            self.connection().commit()
+
+    def rollback(self) -> None:
+        self.connection().rollback()
+
+    def __enter__(self) -> sqlite3.Connection:
+        conn = self.connection()
+        if self._local.depth == 0:
+            if conn.in_transaction:
+                conn.commit()
+            # Verrou d'écriture pris dès le début: pas d'échec en cours de transaction pour conflit lecture -> écriture
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        return conn
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            if exc_type is None:
+                self._local.conn.commit()
+            else:
+                self._local.conn.rollback()
+        return False
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.warning(f"⚠️ Fermeture connexion SQLite: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        with self._lock:
+            connections = len(self._connections)
+        return {"path": self.path, "journal_mode": self.journal_mode, "connections": connections,
+                "busy_timeout_s": self.busy_timeout, "cached_statements": self.cached_statements}
@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Intervalle de recomptage exact des tables (corrige les écarts: remplacements, écritures externes, backfill)
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", "300"))
+# Fenêtres de calcul des débits (secondes)
+RATE_WINDOWS = (60, 300)
+
+
+class StatsCounters:
+    """
+    Totaux maintenus à l'écriture (add) et recomptés périodiquement par les fonctions de comptage
+    enregistrées (reconcile), plus des compteurs d'événements par seconde pour les débits.
+    Lire un instantané ne touche à aucune base: /stats répond en temps constant.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], int]], reconcile_seconds: int = STATS_RECONCILE_SECONDS):
+        self.sources = sources
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Optional[int]] = {name: None for name in sources}
+        self._buckets: Dict[str, list] = {}
+        self._history = max(RATE_WINDOWS)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reconciled_at: Optional[float] = None
+        self.reconcile_ms: Optional[float] = None
+        self.drift: Dict[str, int] = {}
+        self.errors: Dict[str, str] = {}
+
+    def add(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            if self._totals.get(name) is not None:
+                self._totals[name] += count
+
+    def event(self, name: str, count: int = 1) -> None:
+        """Compte un événement dans le seau de la seconde courante (anneau de max(RATE_WINDOWS) secondes)"""
+        second = int(time.time())
+        with self._lock:
+            buckets = self._buckets.setdefault(name, [[0, 0] for _ in range(self._history)])
+            bucket = buckets[second % self._history]
+            if bucket[0] != second:
+                bucket[0], bucket[1] = second, 0
+            bucket[1] += count
+
+    def rate(self, name: str, window: int) -> float:
+        """Événements par seconde sur les `window` dernières secondes"""
+        now = int(time.time())
+        with self._lock:
+            buckets = self._buckets.get(name) or []
+            total = sum(count for second, count in buckets if now - window < second <= now)
+        return round(total / window, 3)
+
+    def reconcile(self) -> None:
+        """Recompte chaque total (requêtes COUNT) et enregistre l'écart avec la valeur incrémentale"""
+        start = time.perf_counter()
+        for name, count in self.sources.items():
+            try:
+                exact = count()
+            except Exception as e:
+                self.errors[name] = str(e)
+                continue
+            self.errors.pop(name, None)
+            with self._lock:
+                if self._totals[name] is not None:
+                    self.drift[name] = self._totals[name] - exact
+                self._totals[name] = exact
+        self.reconciled_at = time.time()
+        self.reconcile_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning(f"⚠️ Erreur recomptage des statistiques: {e}")
+            # Une source pas encore disponible au démarrage (index vectoriel en cours d'ouverture) est retentée plus tôt
+            if self._stop.wait(min(30, self.reconcile_seconds) if self.errors else self.reconcile_seconds):
+                return
+
+    def totals(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            return dict(self._totals)
+
+    def snapshot(self) -> dict:
+        rates = {name: {f"per_s_{window}s": self.rate(name, window) for window in RATE_WINDOWS}
+                 for name in list(self._buckets)}
+        return {
+            "totals": self.totals(),
+            "rates": rates,
+            "reconciled_at": self.reconciled_at,
+            "reconcile_ms": self.reconcile_ms,
+            "reconcile_every_s": self.reconcile_seconds,
+            "drift": dict(self.drift),
+            "errors": dict(self.errors),
+        }
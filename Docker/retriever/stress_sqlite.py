@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test de charge concurrente de la couche SQLite du retriever (sqlite_db.SQLiteDatabase).
+Des threads écrivains (upserts meta par lots, comme l'outbox) et lecteurs (lookups par id, comme le cache
+d'analyses) tournent en parallèle sur une base temporaire. Le mode "shared" reproduit l'ancien accès
+(une seule connexion partagée, check_same_thread=False, commit après chaque requête) pour comparaison.
+
+Vérifie à la fin: aucune erreur, toutes les lignes écrites présentes, PRAGMA integrity_check = ok.
+Code de sortie non nul si une vérification échoue.
+
+Usage: python stress_sqlite.py [--mode layer|shared|both] [--writers 8] [--readers 16] [--seconds 10] [--batch 20]
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS meta (
+    id TEXT PRIMARY KEY,
+    payload TEXT,
+    analysis TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)"""
+
+
+def open_db(mode, path):
+    if mode == "layer":
+        return SQLiteDatabase(path)
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+def run(mode, args):
+    path = os.path.join(tempfile.mkdtemp(prefix="stress_sqlite_"), "embeddings.db")
+    db = open_db(mode, path)
+    db.execute(SCHEMA)
+    db.commit()
+
+    stop = threading.Event()
+    written = set()
+    written_lock = threading.Lock()
+    counters = {"writes": 0, "reads": 0, "hits": 0}
+    errors = []
+
+    def writer(index):
+        n = 0
+        while not stop.is_set():
+            rows = [(f"w{index}-{n + i}", f"payload {index} {n + i} " + "x" * 200, "analyse " + "y" * 500)
+                    for i in range(args.batch)]
+            try:
+                if mode == "layer":
+                    with db:
+                        db.executemany("INSERT OR REPLACE INTO meta (id, payload, analysis) VALUES (?, ?, ?)", rows)
+                else:
+                    for row in rows:
+                        db.execute("INSERT OR REPLACE INTO meta (id, payload, analysis) VALUES (?, ?, ?)", row)
+                        db.commit()
+            except Exception as e:
+                errors.append(f"writer: {type(e).__name__}: {e}")
+                continue
+            with written_lock:
+                written.update(row[0] for row in rows)
+                counters["writes"] += len(rows)
+            n += args.batch
+
+    def reader(index):
+        rng = random.Random(index)
+        while not stop.is_set():
+            with written_lock:
+                known = rng.choice(tuple(written)) if written else None
+            try:
+                row = db.execute("SELECT analysis, created_at FROM meta WHERE id = ?", (known or "absent",)).fetchone()
+            except Exception as e:
+                errors.append(f"reader: {type(e).__name__}: {e}")
+                continue
+            with written_lock:
+                counters["reads"] += 1
+                counters["hits"] += row is not None
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    check = sqlite3.connect(path)
+    present = {row[0] for row in check.execute("SELECT id FROM meta")}
+    missing = len(written - present)
+    integrity = check.execute("PRAGMA integrity_check").fetchone()[0]
+    journal = check.execute("PRAGMA journal_mode").fetchone()[0]
+    check.close()
+
+    ok = not errors and not missing and integrity == "ok"
+    print(f"{'✅' if ok else '❌'} {mode:6} | journal {journal:6} | {counters['writes'] / elapsed:9.0f} écritures/s | "
+          f"{counters['reads'] / elapsed:9.0f} lectures/s | erreurs {len(errors)} | lignes manquantes {missing} | "
+          f"integrity_check {integrity}")
+    for error in sorted(set(errors))[:5]:
+        print(f"   ⚠️ {error}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["layer", "shared", "both"], default="both")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--batch", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"🧪 Stress SQLite: {args.writers} écrivains (lots de {args.batch}), {args.readers} lecteurs, {args.seconds} s")
+    modes = ["shared", "layer"] if args.mode == "both" else [args.mode]
+    results = [run(mode, args) for mode in modes]
+    # Seule la couche SQLiteDatabase doit passer; le mode shared sert de référence
+    return 0 if results[-1] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from typing import Callable, Iterable, Optional, List
+from urllib.parse import urlparse
+
+from numpy_vector_store import NumpyCollection
+
+logger = logging.getLogger(__name__)
+
+# persistent: fichiers locaux (volume /data), http: serveur Chroma du compose, memory: éphémère (ancien comportement),
+# numpy: index local mappé en mémoire sans Chroma (numpy_vector_store), recherche exacte
+CHROMA_MODE = os.getenv("CHROMA_MODE", "persistent")
+# Index utilisé si Chroma ne peut pas être ouvert (numpy, ou none: pas de contexte tant que Chroma est indisponible)
+VECTOR_FALLBACK = os.getenv("VECTOR_FALLBACK", "numpy")
+# Intervalle entre deux tentatives de réouverture de Chroma pendant que l'index de secours est utilisé
+VECTOR_FALLBACK_RETRY_SECONDS = float(os.getenv("VECTOR_FALLBACK_RETRY_SECONDS", "30"))
+CHROMA_PATH = os.getenv("CHROMA_PATH", "/data/chroma")
+CHROMA_URL = os.getenv("CHROMA_URL", "http://chromadb:8000")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "mistral_analyses")
+SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR", "/data/snapshots")
+SNAPSHOT_PAGE_SIZE = int(os.getenv("VECTOR_SNAPSHOT_PAGE_SIZE", "1000"))
+
+
+class VectorStore:
+    """
+    Collection vectorielle ouverte à la demande: le service démarre sans attendre le chargement
+    de l'index, qui se fait au premier accès (ou en tâche de fond via warm_up).
+    """
+
+    def __init__(self, mode: str = CHROMA_MODE, collection_name: str = COLLECTION_NAME):
+        self.mode = mode
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._collection = None
+        self.error: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.engine: Optional[str] = None
+        # Index de secours en service: Chroma est retenté en tâche de fond (voir _retry_chroma)
+        self.degraded = False
+        self.fallback_migrated = 0
+        self._retry_thread: Optional[threading.Thread] = None
+        # En mode dégradé, les écritures passent par ce verrou (aucune ne tombe dans le secours pendant la bascule);
+        # update/delete sont aussi rejoués sur Chroma, qui peut contenir des ids absents du secours
+        self._write_lock = threading.Lock()
+        self._pending: List[tuple] = []
+
+    def _create_client(self):
+        import chromadb
+        if self.mode == "http":
+            url = urlparse(CHROMA_URL)
+            return chromadb.HttpClient(host=url.hostname, port=url.port or 8000)
+        if self.mode == "persistent":
+            os.makedirs(CHROMA_PATH, exist_ok=True)
+            return chromadb.PersistentClient(path=CHROMA_PATH)
+        return chromadb.Client()
+
+    @property
+    def collection(self):
+        if self._collection is not None:
+            return self._collection
+        with self._lock:
+            if self._collection is None:
+                start = time.perf_counter()
+                try:
+                    if self.mode == "numpy":
+                        self._collection, self.engine = NumpyCollection(), "numpy"
+                    else:
+                        self._collection, self.engine = self._open_chroma(), "chroma"
+                    self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+                    self.ready_at = time.time()
+                    self.error = None
+                    logger.info(f"✅ Index vectoriel {self.engine} ({self.mode}) ouvert en {self.load_ms} ms")
+                except Exception as e:
+                    self.error = str(e)
+                    logger.error(f"❌ Erreur connexion ChromaDB ({self.mode}): {e}")
+                    self._open_fallback(start)
+        return self._collection
+
+    def _open_chroma(self):
+        return self._create_client().get_or_create_collection(self.collection_name)
+
+    def _open_fallback(self, start: float) -> None:
+        """
+        Chroma indisponible: index NumPy local plutôt qu'aucun contexte (état dégradé, visible dans /ready).
+        Chroma est retenté en tâche de fond; à sa réouverture, les entrées écrites entre-temps y sont reportées.
+        """
+        if self.mode == "numpy" or VECTOR_FALLBACK != "numpy":
+            return
+        try:
+            fallback = NumpyCollection()
+            # degraded avant la collection: une écriture qui voit le secours passe toujours par _write_lock
+            self.degraded = True
+            self._collection, self.engine = fallback, "numpy"
+            self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.ready_at = time.time()
+            logger.warning(f"⚠️ Index vectoriel NumPy utilisé à la place de ChromaDB ({self.count()} vecteurs)")
+        except Exception as e:
+            logger.error(f"❌ Erreur index NumPy de secours: {e}")
+            return
+        if self._retry_thread is None or not self._retry_thread.is_alive():
+            self._retry_thread = threading.Thread(target=self._retry_chroma, name="vector-store-retry", daemon=True)
+            self._retry_thread.start()
+
+    def _retry_chroma(self) -> None:
+        """Retente Chroma jusqu'à ce qu'il s'ouvre, puis y reporte l'index de secours et rebascule"""
+        while True:
+            time.sleep(VECTOR_FALLBACK_RETRY_SECONDS)
+            try:
+                chroma = self._open_chroma()
+            except Exception as e:
+                self.error = str(e)
+                logger.info(f"🔁 ChromaDB ({self.mode}) toujours indisponible: {e}")
+                continue
+            try:
+                migrated = self._migrate(self._collection, chroma)
+            except Exception as e:
+                self.error = str(e)
+                logger.warning(f"⚠️ Report de l'index de secours vers ChromaDB interrompu: {e}")
+                continue
+            self.error = None
+            self.fallback_migrated += migrated
+            logger.info(f"✅ ChromaDB ({self.mode}) rétabli: {migrated} vecteurs de l'index de secours reportés")
+            return
+
+    def _migrate(self, fallback, chroma) -> int:
+        """
+        Reporte le mode dégradé dans Chroma puis rebascule. Chaque étape tient _write_lock (les écritures attendent
+        au plus une page): update/delete en attente rejoués d'abord, puis une page du secours copiée et retirée.
+        Secours vide: bascule sur Chroma dans le même verrou.
+        """
+        migrated = 0
+        while True:
+            with self._write_lock:
+                for method, kwargs in self._pending:
+                    getattr(chroma, method)(**kwargs)
+                self._pending.clear()
+                page = fallback.get(limit=SNAPSHOT_PAGE_SIZE, offset=0, include=["embeddings", "metadatas"])
+                if not page["ids"]:
+                    self._collection, self.engine = chroma, "chroma"
+                    self.degraded = False
+                    return migrated
+                chroma.upsert(ids=page["ids"], embeddings=page["embeddings"], metadatas=page["metadatas"])
+                fallback.delete(ids=page["ids"])
+                migrated += len(page["ids"])
+
+    def _write(self, method: str, kwargs: dict):
+        collection = self.collection
+        if not self.degraded:
+            return getattr(collection, method)(**kwargs)
+        with self._write_lock:
+            # Peut avoir rebasculé sur Chroma pendant l'attente du verrou
+            result = getattr(self.collection, method)(**kwargs)
+            if self.degraded and method != "upsert":
+                self._pending.append((method, kwargs))
+            return result
+
+    @property
+    def ready(self) -> bool:
+        return self._collection is not None
+
+    def warm_up(self) -> None:
+        """Ouvre la collection en arrière-plan pour que la première requête n'en paie pas le coût"""
+        threading.Thread(target=lambda: self.collection, name="vector-store-warmup", daemon=True).start()
+
+    def query(self, **kwargs):
+        return self.collection.query(**kwargs)
+
+    def upsert(self, **kwargs):
+        return self._write("upsert", kwargs)
+
+    def get(self, **kwargs):
+        return self.collection.get(**kwargs)
+
+    def update(self, **kwargs):
+        return self._write("update", kwargs)
+
+    def delete(self, **kwargs):
+        return self._write("delete", kwargs)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def snapshot(self, name: Optional[str] = None, context: Optional[Iterable[dict]] = None) -> dict:
+        """
+        Exporte la collection (ids, embeddings, métadonnées) dans un fichier jsonl.gz.
+        Le format ne dépend pas du mode, un snapshot peut donc être restauré sur un autre backend.
+        `context`: lignes écrites avant les vecteurs (extraits et index lexical, voir HybridRetriever.export_context).
+        """
+        name = name or time.strftime("%Y%m%d-%H%M%S")
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        path = os.path.join(SNAPSHOT_DIR, f"{name}.jsonl.gz")
+        collection = self.collection
+        exported = 0
+        context_count = 0
+        start = time.perf_counter()
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            for record in context or ():
+                f.write(json.dumps(record) + "\n")
+                context_count += 1
+            offset = 0
+            while True:
+                page = collection.get(limit=SNAPSHOT_PAGE_SIZE, offset=offset, include=["embeddings", "metadatas"])
+                if not page["ids"]:
+                    break
+                for item_id, embedding, metadata in zip(page["ids"], page["embeddings"], page["metadatas"]):
+                    f.write(json.dumps({"id": item_id, "embedding": list(embedding), "metadata": metadata}) + "\n")
+                exported += len(page["ids"])
+                offset += SNAPSHOT_PAGE_SIZE
+        os.replace(path + ".tmp", path)
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"📸 Snapshot {name}: {exported} embeddings et {context_count} lignes de contexte exportés en {duration_ms} ms")
+        return {"name": name, "path": path, "count": exported, "context_count": context_count, "duration_ms": duration_ms}
+
+    def restore(self, name: str, import_context: Optional[Callable[[List[dict]], None]] = None) -> dict:
+        """
+        Réimporte un snapshot par lots (upsert: les entrées plus récentes non présentes sont conservées).
+        Les lignes de contexte (clé "kind") sont passées à `import_context`, ignorées sans SQLite.
+        """
+        path = os.path.join(SNAPSHOT_DIR, f"{os.path.basename(name)}.jsonl.gz")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Snapshot introuvable: {name}")
+        restored = 0
+        context_count = 0
+        start = time.perf_counter()
+        batch: List[dict] = []
+        context: List[dict] = []
+
+        def flush():
+            # Via upsert (et non la collection capturée): une bascule Chroma <-> secours pendant la restauration est suivie
+            self.upsert(ids=[item["id"] for item in batch],
+                        embeddings=[item["embedding"] for item in batch],
+                        metadatas=[item["metadata"] for item in batch])
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                if "kind" in item:
+                    context.append(item)
+                    if len(context) >= SNAPSHOT_PAGE_SIZE:
+                        if import_context:
+                            import_context(context)
+                        context_count += len(context)
+                        context = []
+                    continue
+                # Contexte placé avant les vecteurs dans le fichier: importé avant le premier vecteur
+                if context:
+                    if import_context:
+                        import_context(context)
+                    context_count += len(context)
+                    context = []
+                batch.append(item)
+                if len(batch) >= SNAPSHOT_PAGE_SIZE:
+                    flush()
+                    restored += len(batch)
+                    batch = []
+        if context:
+            if import_context:
+                import_context(context)
+            context_count += len(context)
+        if batch:
+            flush()
+            restored += len(batch)
+        if context_count and not import_context:
+            logger.warning(f"⚠️ Snapshot {name}: {context_count} lignes de contexte ignorées (pas de base SQLite)")
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"♻️ Snapshot {name} restauré: {restored} embeddings et {context_count} lignes de contexte en {duration_ms} ms")
+        return {"name": name, "count": restored, "context_count": context_count, "duration_ms": duration_ms}
+
+    def list_snapshots(self) -> List[dict]:
+        if not os.path.isdir(SNAPSHOT_DIR):
+            return []
+        snapshots = []
+        for filename in sorted(os.listdir(SNAPSHOT_DIR)):
+            if filename.endswith(".jsonl.gz"):
+                path = os.path.join(SNAPSHOT_DIR, filename)
+                snapshots.append({"name": filename[:-len(".jsonl.gz")], "size_bytes": os.path.getsize(path),
+                                  "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(path)))})
+        return snapshots
+
+    def status(self) -> dict:
+        status = {"mode": self.mode, "engine": self.engine, "collection": self.collection_name, "ready": self.ready,
+                  "degraded": self.degraded, "fallback_migrated": self.fallback_migrated,
+                  "load_ms": self.load_ms, "error": self.error}
+        if isinstance(self._collection, NumpyCollection):
+            status["numpy"] = self._collection.stats()
+        return status
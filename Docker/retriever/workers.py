@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Lancement du retriever (CMD du Dockerfile).
+RETRIEVER_WORKERS=1: un seul processus uvicorn, modèle d'embeddings chargé dans le processus (comportement historique).
+RETRIEVER_WORKERS>1: le modèle est chargé une seule fois dans un processus serveur d'embeddings (embedding_server.py)
+joint par les workers uvicorn via une socket Unix; chaque worker ne garde que l'application, sans torch ni poids.
+
+Le chargement avant fork (copy-on-write) n'est pas retenu: l'application démarre des threads à l'import
+(chargement du modèle, file d'encodage) qui ne survivent pas au fork, les pools OpenMP de torch ne sont pas
+sûrs après fork, et les compteurs de références Python recopient progressivement les pages partagées.
+
+Usage: python workers.py [--host 0.0.0.0] [--port 5000] [--workers N]
+"""
+
+import os
+import sys
+import time
+import fcntl
+import atexit
+import secrets
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RETRIEVER_WORKERS = int(os.getenv("RETRIEVER_WORKERS", "1"))
+# Verrous des tâches de fond à instance unique (outbox, compaction périodique) partagés entre workers
+SINGLETON_LOCK_DIR = os.getenv("RETRIEVER_LOCK_DIR", "/data/locks")
+EMBEDDING_SERVER_START_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_START_TIMEOUT", "30"))
+
+_singleton_locks = {}
+
+
+def acquire_singleton(name: str) -> bool:
+    """
+    Verrou exclusif non bloquant (flock) gardé pendant toute la vie du processus: parmi plusieurs workers,
+    un seul obtient True pour `name`. Le verrou est libéré par le système à la mort du processus.
+    """
+    if name in _singleton_locks:
+        return True
+    try:
+        os.makedirs(SINGLETON_LOCK_DIR, exist_ok=True)
+        handle = open(os.path.join(SINGLETON_LOCK_DIR, f"{name}.lock"), "w")
+    except OSError as e:
+        # Sans répertoire de verrous (tests, lancement local), on suppose un seul processus
+        logger.warning(f"⚠️ Verrou {name} indisponible ({e}): tâche démarrée sans coordination")
+        return True
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    handle.write(str(os.getpid()))
+    handle.flush()
+    _singleton_locks[name] = handle
+    return True
+
+
+class RunLock:
+    """
+    Verrou exclusif non bloquant (flock) tenu le temps d'un traitement à la demande (backfill, compaction):
+    parmi plusieurs workers, un seul l'exécute à la fois; les autres rapportent qu'il est en cours ailleurs.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._handle = None
+
+    def _open(self):
+        os.makedirs(SINGLETON_LOCK_DIR, exist_ok=True)
+        return open(os.path.join(SINGLETON_LOCK_DIR, f"{self.name}.run.lock"), "a+")
+
+    def acquire(self) -> bool:
+        if self._handle is not None:
+            return True
+        try:
+            handle = self._open()
+        except OSError as e:
+            # Comme acquire_singleton: sans répertoire de verrous, on suppose un seul processus
+            logger.warning(f"⚠️ Verrou {self.name} indisponible ({e}): traitement lancé sans coordination")
+            return True
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.truncate(0)
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._handle = handle
+        return True
+
+    def release(self) -> None:
+        if self._handle is not None:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+
+    def holder(self) -> Optional[int]:
+        """pid du worker qui tient le verrou s'il s'agit d'un autre processus, sinon None"""
+        if self._handle is not None:
+            return None
+        try:
+            handle = self._open()
+        except OSError:
+            return None
+        try:
+            fcntl.flock(handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            return None
+        except OSError:
+            handle.seek(0)
+            pid = handle.read().strip()
+            return int(pid) if pid.isdigit() else -1
+        finally:
+            handle.close()
+
+
+def process_memory(pid: str = "self") -> dict:
+    """RSS et PSS (pages partagées réparties entre processus) en Mo, lus dans /proc; None hors Linux"""
+    memory = {"pid": os.getpid() if pid == "self" else int(pid), "rss_mb": None, "pss_mb": None}
+    for path, key, field in ((f"/proc/{pid}/status", "rss_mb", "VmRSS:"), (f"/proc/{pid}/smaps_rollup", "pss_mb", "Pss:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        memory[key] = round(int(line.split()[1]) / 1024, 1)
+                        break
+        except OSError:
+            pass
+    return memory
+
+
+def start_embedding_server(socket_path: str, authkey: str) -> subprocess.Popen:
+    env = dict(os.environ, EMBEDDING_SERVER_AUTHKEY=authkey)
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_server.py"),
+                               "--socket", socket_path], env=env)
+    deadline = time.time() + EMBEDDING_SERVER_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if server.poll() is not None:
+            raise RuntimeError(f"Serveur d'embeddings arrêté au démarrage (code {server.returncode})")
+        if time.time() > deadline:
+            server.terminate()
+            raise RuntimeError("Socket du serveur d'embeddings absente")
+        time.sleep(0.1)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("RETRIEVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RETRIEVER_PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=RETRIEVER_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    import uvicorn
+    if args.workers <= 1:
+        uvicorn.run("app:app", host=args.host, port=args.port)
+        return 0
+
+    if os.getenv("CHROMA_MODE", "persistent") in ("persistent", "numpy"):
+        logger.warning(f"⚠️ CHROMA_MODE={os.getenv('CHROMA_MODE', 'persistent')} avec plusieurs workers: chaque processus "
+                       "ouvre l'index local, préférer CHROMA_MODE=http (serveur chromadb partagé)")
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="retriever_"), "embeddings.sock")
+    authkey = secrets.token_hex(16)
+    server = start_embedding_server(socket_path, authkey)
+    atexit.register(server.terminate)
+    os.environ["EMBEDDING_SERVER_SOCKET"] = socket_path
+    os.environ["EMBEDDING_SERVER_AUTHKEY"] = authkey
+    logger.info(f"🚀 {args.workers} workers uvicorn, modèle d'embeddings partagé (pid {server.pid}, {socket_path})")
+    uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,9 +47,15 @@ from parser import parse_payload, extract_critical_fields, flatten_dict
 from normalizer import generate_soc_report
 import json
 import os
-from gpt_analysis import analyze_payload_with_gpt, generate_short_summary
+from gpt_analysis import analyze_payload_with_gpt, generate_short_summary, DEFAULT_PROMPT
 # from mistral_local_analyzer import analyze_payload_with_mistral  # Supprimé - remplacé par TGI
-from pattern_storage import store_analysis, find_existing_pattern, get_all_patterns
+from pattern_storage import store_analysis, store_analyses_bulk, find_existing_pattern, get_all_patterns
+from batch_analysis import group_payloads, build_group_prompt
+from ia_extraction import extract_analysis_fields, apply_user_intent
+from model_router import route_payload, tier_stats, TIERS
+from llm_telemetry import record_gpt_call, record_llm_call, get_llm_stats, get_latency_percentiles, GROUP_BY_COLUMNS
+from triage_pipeline import build_default_pipeline, TriageContext
+from concurrent.futures import ThreadPoolExecutor
 from auth import check_login_db, login_user, logout_user, is_logged_in
 from db_config import init_db, SessionLocal, Analysis, Pattern, User, Log
 from logger import log_action, log_error, log_warning, log_success
@@ -77,6 +83,13 @@ MISTRAL_URL = os.getenv('MISTRAL_URL', 'http://tgi:80')
 MISTRAL_LEARNER_URL = os.getenv('MISTRAL_LEARNER_URL', 'http://retriever:5000')
 print(f"🔗 Configuration Mistral - URL: {MISTRAL_URL}, Learner: {MISTRAL_LEARNER_URL}")
 
+# Configuration de l'analyse par lot
+BATCH_MAX_PAYLOADS = int(os.getenv('BATCH_MAX_PAYLOADS', '1000'))
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+
+# Pipeline de triage: règles -> cache d'analyses -> petit modèle -> gros modèle
+triage_pipeline = build_default_pipeline(MISTRAL_LEARNER_URL)
+
 def get_openai_api_key(user_id=None):
     # Si un user_id est fourni, vérifier d'abord la clé API personnelle
     if user_id:
@@ -101,6 +114,15 @@ def get_openai_api_key(user_id=None):
     except Exception:
         return None
 
+def is_known_pattern(pattern_nom):
+    """Indique si le pattern détecté existe déjà en base (utilisé par le routage des modèles)"""
+    if not pattern_nom or pattern_nom == "unknown_pattern":
+        return False
+    try:
+        return find_existing_pattern(pattern_nom) is not None
+    except Exception:
+        return False
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     error = None
@@ -172,6 +194,8 @@ def analyze_ia():
     flat_fields = flatten_dict(payload_dict)
     pattern_nom = flat_fields.get("pattern", "unknown_pattern")
     print(f"🎯 [ANALYZE_IA] Pattern détecté: {pattern_nom}")
+    routing = route_payload(flat_fields, extract_critical_fields(flat_fields), is_known_pattern(pattern_nom), data.get("tier"))
+    print(f"🧭 [ANALYZE_IA] Niveau {routing['tier']} (score {routing['score']}) → {routing['gpt_model']}, max_tokens {routing['max_tokens']}")
     
     api_key = get_openai_api_key(user_id)
     print(f"🔑 [ANALYZE_IA] Récupération de la clé API pour l'utilisateur {user_id}")
@@ -183,11 +207,14 @@ def analyze_ia():
     from gpt_analysis import analyze_payload_with_gpt
     try:
         print(f"🤖 [ANALYZE_IA] Appel de l'API GPT en cours...")
-        ia_response = analyze_payload_with_gpt(payload_dict, api_key, custom_prompt=custom_prompt)
+        ia_response = analyze_payload_with_gpt(payload_dict, api_key, custom_prompt=custom_prompt, structured_output=bool(data.get("structured_output", False)),
+                                               model=routing["gpt_model"], max_tokens=routing["max_tokens"])
+        tier_stats.record(routing["tier"], ia_response.get("latency_ms", 0), ia_response.get("success", False))
         print(f"📥 [ANALYZE_IA] Réponse GPT reçue: {type(ia_response)}")
         
         # Vérifier si l'analyse a réussi
         if not ia_response.get("success", False):
+            record_gpt_call(ia_response, "analyze_ia", user_id, pattern_nom, routing["tier"])
             error_msg = ia_response.get("error", "Erreur inconnue lors de l'analyse IA")
             print(f"❌ [ANALYZE_IA] Erreur GPT: {error_msg}")
             log_error(user_id, "analyze_ia_gpt_error", f"Erreur GPT: {error_msg}", request.remote_addr, request.headers.get('User-Agent'))
@@ -200,42 +227,23 @@ def analyze_ia():
     except Exception as gpt_error:
         log_error(user_id, "analyze_ia_gpt_exception", f"Exception GPT: {str(gpt_error)}", request.remote_addr, request.headers.get('User-Agent'))
         return jsonify({"error": f"Erreur lors de l'analyse IA: {str(gpt_error)}"}), 500
-    import re
-    pattern_match = re.search(r'Pattern du payload\s*[:：\-–]?\s*([^\n]{1,50})', ia_text)
-    short_desc_match = re.search(r'Résumé court\s*[:：\-–]?\s*([^\n]{1,120})', ia_text)
-    statut_match = re.search(r'Statut\s*[:：\-–]?\s*([^\n]{1,50})', ia_text)
-    description_match = re.search(r'1\. Description des faits\s*\n(.+?)\n2\.', ia_text, re.DOTALL)
-    analyse_technique_match = re.search(r'2\. Analyse technique\s*\n(.+?)\n3\.', ia_text, re.DOTALL)
-    resultat_match = re.search(r'3\. Résultat\s*\n(.+)', ia_text, re.DOTALL)
-    extracted_pattern = pattern_match.group(1).strip() if pattern_match else pattern_nom
-    resume_court = short_desc_match.group(1).strip() if short_desc_match else ""
-    statut = statut_match.group(1).strip() if statut_match else ""
-    description_faits = description_match.group(1).strip() if description_match else ""
-    analyse_technique = analyse_technique_match.group(1).strip() if analyse_technique_match else ""
-    resultat = resultat_match.group(1).strip() if resultat_match else ""
+    fields = extract_analysis_fields(ia_text, pattern_nom, data.get("user_intent", ""))
+    extracted_pattern = fields["pattern"]
+    resume_court = fields["short_description"]
+    statut = fields["statut"]
+    description_faits = fields["description_faits"]
+    analyse_technique = fields["analyse_technique"]
+    resultat = fields["result"]
+    justification = resultat
     
-    print(f"📋 [ANALYZE_IA] Extraction des données:")
+    print(f"📋 [ANALYZE_IA] Extraction des données (JSON structuré: {fields['structured']}):")
     print(f"   - Pattern: {extracted_pattern}")
     print(f"   - Résumé: {len(resume_court)} caractères")
     print(f"   - Statut: {statut}")
     print(f"   - Description: {len(description_faits)} caractères")
     print(f"   - Analyse technique: {len(analyse_technique)} caractères")
     print(f"   - Résultat: {len(resultat)} caractères")
-    justification = resultat
-    if not statut and resultat:
-        if re.search(r'faux positif', resultat, re.IGNORECASE):
-            statut = "Faux positif"
-        elif re.search(r'positif[\s_-]*confirm[ée]', resultat, re.IGNORECASE):
-            statut = "Vrai positif"
-    if not statut:
-        statut = "À CHOISIR"
-    user_intent = data.get("user_intent", "")
-    if user_intent == "faux_positif":
-        statut = "Faux positif"
-    elif user_intent == "positif_confirme":
-        statut = "Vrai positif"
-    elif user_intent:
-        statut = user_intent
+    record_gpt_call(ia_response, "analyze_ia", user_id, extracted_pattern, routing["tier"])
     from pattern_storage import store_analysis
     try:
         store_analysis(
@@ -266,7 +274,8 @@ def analyze_ia():
         "description_faits": description_faits,
         "statut": statut,
         "summary": flat_fields,
-        "parsed": payload_dict
+        "parsed": payload_dict,
+        "routing": {"tier": routing["tier"], "score": routing["score"], "model": routing["gpt_model"], "max_tokens": routing["max_tokens"]}
     })
 
 @app.route("/save_pattern", methods=["POST"])
@@ -382,10 +391,28 @@ def analyze_mistral():
     flat_fields = flatten_dict(payload_dict)
     pattern_nom = flat_fields.get("pattern", "unknown_pattern")
     
+    routing = route_payload(flat_fields, extract_critical_fields(flat_fields), is_known_pattern(pattern_nom), data.get("tier"))
+    
     # Appel au nouveau service TGI Retriever
+    call_start = time.perf_counter()
+
+    def _record_ollama_failure(error):
+        """Appel en échec: compté dans les latences du niveau et dans la télémétrie LLM"""
+        latency_ms = (time.perf_counter() - call_start) * 1000
+        tier_stats.record(routing["tier"], latency_ms, success=False)
+        record_llm_call("ollama", routing["ollama_model"], "analyze_mistral", latency_ms=latency_ms, success=False, error=error, user_id=user_id, pattern_nom=pattern_nom, tier=routing["tier"])
+
     try:
         response = requests.post(f'{MISTRAL_LEARNER_URL}/analyze', 
-                               json={'payload': raw_payload}, 
+                               json={
+                                   'payload': raw_payload,
+                                   'structured_output': bool(data.get("structured_output", False)),
+                                   'model': routing["ollama_model"],
+                                   'num_predict': routing["num_predict"],
+                                   'pattern': pattern_nom if pattern_nom != "unknown_pattern" else None,
+                                   'force_refresh': bool(data.get("force_refresh", False)),
+                                   'user_id': str(user_id) if user_id else None
+                               }, 
                                timeout=120)
         
         if response.status_code == 200:
@@ -394,60 +421,69 @@ def analyze_mistral():
             context_count = result.get('context_count', 0)
             payload_hash = result.get('payload_hash', '')
             similar_analyses = result.get('similar_analyses', [])
+            retriever_metrics = result.get('metrics') or {}
             
             log_action(user_id, "analyze_mistral_tgi_context", f"Contexte trouvé: {context_count} analyses similaires", request.remote_addr, request.headers.get('User-Agent'))
             
+        elif response.status_code == 503 and response.headers.get("Retry-After"):
+            # File de génération saturée côté retriever: on relaie la position et le délai conseillé
+            queue = response.json()["detail"]
+            _record_ollama_failure("File de génération saturée")
+            log_error(user_id, "analyze_mistral_tgi_queue_full", f"Génération délestée: {queue.get('reason')}, position {queue.get('queue_position')}", request.remote_addr, request.headers.get('User-Agent'))
+            return jsonify({
+                "error": "[ERREUR TGI MISTRAL] File de génération saturée, réessayez plus tard",
+                "queue_position": queue.get("queue_position"),
+                "estimated_wait_s": queue.get("estimated_wait_s"),
+                "retry_after_s": queue.get("retry_after_s")
+            }), 503, {"Retry-After": str(queue.get("retry_after_s", 5))}
+            
         else:
             error_msg = f'[ERREUR TGI MISTRAL] {response.text}'
+            _record_ollama_failure(error_msg)
             log_error(user_id, "analyze_mistral_tgi_error", f"Erreur TGI Mistral: {error_msg}", request.remote_addr, request.headers.get('User-Agent'))
             return jsonify({"error": f"Erreur lors de l'analyse TGI Mistral: {error_msg}"}), 500
             
     except requests.exceptions.Timeout:
         error_msg = '[ERREUR TGI MISTRAL] Timeout - Service non disponible'
+        _record_ollama_failure("Timeout")
         log_error(user_id, "analyze_mistral_tgi_timeout", error_msg, request.remote_addr, request.headers.get('User-Agent'))
         return jsonify({"error": error_msg}), 504
     except requests.exceptions.ConnectionError as e:
         error_msg = f'[ERREUR TGI MISTRAL] Service non disponible: {str(e)}'
+        _record_ollama_failure(error_msg)
         log_error(user_id, "analyze_mistral_tgi_connection", f"Erreur de connexion TGI: {str(e)}", request.remote_addr, request.headers.get('User-Agent'))
         return jsonify({"error": error_msg}), 503
     except Exception as mistral_error:
         error_msg = f'[ERREUR TGI MISTRAL] {str(mistral_error)}'
+        _record_ollama_failure(error_msg)
         log_error(user_id, "analyze_mistral_tgi_exception", f"Exception TGI Mistral: {str(mistral_error)}", request.remote_addr, request.headers.get('User-Agent'))
         return jsonify({"error": f"Erreur lors de l'analyse TGI Mistral: {str(mistral_error)}"}), 500
     
-    # Extraction des informations (comme dans analyze_ia)
-    import re
-    pattern_match = re.search(r'Pattern du payload\s*[:：\-–]?\s*([^\n]{1,50})', ia_response)
-    short_desc_match = re.search(r'Résumé court\s*[:：\-–]?\s*([^\n]{1,120})', ia_response)
-    statut_match = re.search(r'Statut\s*[:：\-–]?\s*([^\n]{1,50})', ia_response)
-    description_match = re.search(r'1\. Description des faits\s*\n(.+?)\n2\.', ia_response, re.DOTALL)
-    analyse_technique_match = re.search(r'2\. Analyse technique\s*\n(.+?)\n3\.', ia_response, re.DOTALL)
-    resultat_match = re.search(r'3\. Résultat\s*\n(.+)', ia_response, re.DOTALL)
+    # Extraction des informations (extracteur partagé avec analyze_ia)
+    fields = extract_analysis_fields(ia_response, pattern_nom, data.get("user_intent", ""))
+    extracted_pattern = fields["pattern"]
+    resume_court = fields["short_description"]
+    statut = fields["statut"]
+    description_faits = fields["description_faits"]
+    analyse_technique = fields["analyse_technique"]
+    resultat = fields["result"]
     
-    extracted_pattern = pattern_match.group(1).strip() if pattern_match else pattern_nom
-    resume_court = short_desc_match.group(1).strip() if short_desc_match else ""
-    statut = statut_match.group(1).strip() if statut_match else ""
-    description_faits = description_match.group(1).strip() if description_match else ""
-    analyse_technique = analyse_technique_match.group(1).strip() if analyse_technique_match else ""
-    resultat = resultat_match.group(1).strip() if resultat_match else ""
-    justification = resultat
-    
-    if not statut and resultat:
-        if re.search(r'faux positif', resultat, re.IGNORECASE):
-            statut = "Faux positif"
-        elif re.search(r'positif[\s_-]*confirm[ée]', resultat, re.IGNORECASE):
-            statut = "Vrai positif"
-    
-    if not statut:
-        statut = "À CHOISIR"
-    
-    user_intent = data.get("user_intent", "")
-    if user_intent == "faux_positif":
-        statut = "Faux positif"
-    elif user_intent == "positif_confirme":
-        statut = "Vrai positif"
-    elif user_intent:
-        statut = user_intent
+    call_latency_ms = (time.perf_counter() - call_start) * 1000
+    tier_stats.record(routing["tier"], call_latency_ms)
+    record_llm_call(
+        provider=retriever_metrics.get("provider", "ollama"),
+        model=retriever_metrics.get("model", routing["ollama_model"]),
+        operation="analyze_mistral",
+        prompt_tokens=retriever_metrics.get("prompt_tokens", 0),
+        completion_tokens=retriever_metrics.get("completion_tokens", 0),
+        latency_ms=call_latency_ms,
+        ttft_ms=retriever_metrics.get("ttft_ms"),
+        queue_wait_ms=retriever_metrics.get("queue_wait_ms"),
+        cache_hit=retriever_metrics.get("cache_hit", False),
+        user_id=user_id,
+        pattern_nom=extracted_pattern,
+        tier=routing["tier"]
+    )
     
     # Le stockage est déjà fait par le service Retriever
     # Pas besoin de stocker à nouveau ici
@@ -467,9 +503,179 @@ def analyze_mistral():
         "context_count": context_count,
         "payload_hash": payload_hash,
         "similar_analyses": similar_analyses,
+        "cached": retriever_metrics.get("cache_hit", False),
+        "cached_at": retriever_metrics.get("cached_at"),
+        "routing": {"tier": routing["tier"], "score": routing["score"], "model": routing["ollama_model"], "num_predict": routing["num_predict"]},
         "source": "mistral_tgi_rag"
     })
 
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch():
+    """Analyse un lot de payloads: regroupement par forme, une analyse IA par groupe"""
+    if not is_logged_in(session):
+        return jsonify({"error": "Non authentifié"}), 401
+    
+    data = request.get_json() or {}
+    raw_payloads = data.get("payloads", [])
+    custom_prompt = data.get("custom_prompt", None)
+    user_intent = data.get("user_intent", "")
+    structured_output = bool(data.get("structured_output", False))
+    user_id = session.get("user_id")
+    
+    if not isinstance(raw_payloads, list) or not raw_payloads:
+        return jsonify({"error": "Liste de payloads requise"}), 400
+    if len(raw_payloads) > BATCH_MAX_PAYLOADS:
+        return jsonify({"error": f"Trop de payloads ({len(raw_payloads)}), maximum {BATCH_MAX_PAYLOADS}"}), 400
+    raw_payloads = [p if isinstance(p, str) else json.dumps(p) for p in raw_payloads]
+    
+    log_action(user_id, "analyze_batch_start", f"Début analyse par lot - {len(raw_payloads)} payloads", request.remote_addr, request.headers.get('User-Agent'))
+    
+    api_key = get_openai_api_key(user_id)
+    if not api_key:
+        log_error(user_id, "analyze_batch_api_error", "Aucune clé API disponible (ni personnelle, ni par défaut)", request.remote_addr, request.headers.get('User-Agent'))
+        return jsonify({"error": "Aucune clé API disponible (ni personnelle, ni par défaut)"}), 500
+    
+    groups = list(group_payloads(raw_payloads).values())
+    print(f"📦 [ANALYZE_BATCH] {len(raw_payloads)} payloads → {len(groups)} groupes")
+    
+    # Un routage par groupe, à partir du membre représentatif
+    for group in groups:
+        representative = group["members"][0]
+        group["routing"] = route_payload(representative["flat"], representative["critical"],
+                                         is_known_pattern(representative["flat"].get("pattern")), data.get("tier"))
+    
+    def analyze_group(group):
+        prompt = build_group_prompt(group, DEFAULT_PROMPT, custom_prompt)
+        routing = group["routing"]
+        ia_response = analyze_payload_with_gpt(group["members"][0]["parsed"], api_key, custom_prompt=prompt, structured_output=structured_output,
+                                               model=routing["gpt_model"], max_tokens=routing["max_tokens"])
+        tier_stats.record(routing["tier"], ia_response.get("latency_ms", 0), ia_response.get("success", False))
+        return ia_response
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MAX_WORKERS, len(groups)))) as executor:
+        group_responses = list(executor.map(analyze_group, groups))
+    
+    results = [None] * len(raw_payloads)
+    entries = []
+    groups_summary = []
+    for group_id, (group, ia_response) in enumerate(zip(groups, group_responses)):
+        members = group["members"]
+        if not ia_response.get("success", False):
+            record_gpt_call(ia_response, "analyze_batch", user_id, members[0]["flat"].get("pattern"), group["routing"]["tier"])
+            error_msg = ia_response.get("error", "Erreur inconnue lors de l'analyse IA")
+            log_warning(user_id, "analyze_batch_group_error", f"Groupe {group_id} ({len(members)} payloads): {error_msg}", request.remote_addr, request.headers.get('User-Agent'))
+            groups_summary.append({"group": group_id, "size": len(members), "vendor": group["vendor"], "logid": group["logid"], "action": group["action"], "error": error_msg})
+            for member in members:
+                results[member["index"]] = {"index": member["index"], "group": group_id, "error": error_msg}
+            continue
+        
+        ia_text = ia_response.get("analysis", "")
+        default_pattern = members[0]["flat"].get("pattern", "unknown_pattern")
+        fields = extract_analysis_fields(ia_text, default_pattern, user_intent)
+        record_gpt_call(ia_response, "analyze_batch", user_id, fields["pattern"], group["routing"]["tier"])
+        groups_summary.append({"group": group_id, "size": len(members), "vendor": group["vendor"], "logid": group["logid"], "action": group["action"], "pattern": fields["pattern"], "statut": fields["statut"], "tier": group["routing"]["tier"]})
+        
+        # Diffuser le résultat du groupe à chacun de ses membres
+        for member in members:
+            entries.append({
+                "payload": member["raw"],
+                "rapport_ia": ia_text,
+                "pattern_nom": fields["pattern"],
+                "resume_court": fields["short_description"],
+                "description_faits": fields["description_faits"],
+                "analyse_technique": fields["analyse_technique"],
+                "resultat": fields["result"],
+                "justification": fields["result"],
+                "tags": None,
+                "statut": fields["statut"],
+            })
+            results[member["index"]] = dict(fields, index=member["index"], group=group_id, ia_text=ia_text)
+    
+    stored = 0
+    try:
+        stored = store_analyses_bulk(entries, user_id=user_id)
+    except Exception as store_error:
+        log_error(user_id, "analyze_batch_store_error", f"Erreur lors du stockage en lot: {str(store_error)}", request.remote_addr, request.headers.get('User-Agent'))
+        # On continue quand même pour retourner le résultat de l'analyse
+    
+    log_success(user_id, "analyze_batch_complete", f"Analyse par lot terminée - {len(raw_payloads)} payloads, {len(groups)} appels IA, {stored} analyses stockées", request.remote_addr, request.headers.get('User-Agent'))
+    return jsonify({
+        "total": len(raw_payloads),
+        "group_count": len(groups),
+        "llm_calls": len(groups),
+        "stored": stored,
+        "groups": groups_summary,
+        "results": results
+    })
+
+@app.route("/analyze_triage", methods=["POST"])
+def analyze_triage():
+    """Analyse en cascade: seuls les payloads non résolus par les niveaux rapides atteignent le gros modèle"""
+    if not is_logged_in(session):
+        return jsonify({"error": "Non authentifié"}), 401
+    
+    data = request.get_json() or {}
+    raw_payload = data.get("payload", "")
+    custom_prompt = data.get("custom_prompt", None)
+    user_id = session.get("user_id")
+    if not raw_payload.strip():
+        return jsonify({"error": "Payload requis"}), 400
+    
+    log_action(user_id, "analyze_triage_start", f"Début triage - Payload length: {len(raw_payload)} chars", request.remote_addr, request.headers.get('User-Agent'))
+    try:
+        payload_dict = json.loads(raw_payload)
+    except Exception:
+        payload_dict = parse_payload(raw_payload)
+    flat_fields = flatten_dict(payload_dict)
+    pattern_nom = flat_fields.get("pattern", "unknown_pattern")
+    routing = route_payload(flat_fields, extract_critical_fields(flat_fields), is_known_pattern(pattern_nom), data.get("tier"))
+    
+    context = TriageContext(raw_payload, payload_dict, pattern_nom, routing, user_id=user_id,
+                            api_key=get_openai_api_key(user_id), custom_prompt=custom_prompt)
+    try:
+        result = triage_pipeline.run(context)
+    except Exception as e:
+        log_error(user_id, "analyze_triage_error", f"Erreur lors du triage: {str(e)}", request.remote_addr, request.headers.get('User-Agent'))
+        return jsonify({"error": f"Erreur lors de l'analyse IA: {str(e)}"}), 500
+    statut = apply_user_intent(result["statut"], data.get("user_intent", ""))
+    print(f"🎯 [ANALYZE_TRIAGE] Résolu par le niveau {result['tier']} - Pattern: {result['pattern']}, Statut: {statut}")
+    
+    # Seul le gros modèle produit une nouvelle analyse à stocker
+    # (le retriever stocke déjà les analyses du petit modèle, règles et cache n'apportent rien de nouveau)
+    if result["tier"] == "large_model":
+        try:
+            store_analysis(
+                payload=raw_payload,
+                rapport_ia=result["ia_text"],
+                pattern_nom=result["pattern"],
+                resume_court=result["short_description"],
+                description_faits=result["description_faits"],
+                analyse_technique=result["analyse_technique"],
+                resultat=result["result"],
+                justification=result["result"],
+                user_id=user_id,
+                tags=None,
+                statut=statut
+            )
+        except Exception as store_error:
+            log_error(user_id, "analyze_triage_store_error", f"Erreur lors du stockage: {str(store_error)}", request.remote_addr, request.headers.get('User-Agent'))
+            # On continue quand même pour retourner le résultat de l'analyse
+    
+    log_success(user_id, "analyze_triage_complete", f"Triage terminé - Niveau: {result['tier']}, Pattern: {result['pattern']}, Statut: {statut}", request.remote_addr, request.headers.get('User-Agent'))
+    return jsonify({
+        "ia_text": result["ia_text"],
+        "pattern": result["pattern"],
+        "short_description": result["short_description"],
+        "result": result["result"],
+        "analyse_technique": result["analyse_technique"],
+        "description_faits": result["description_faits"],
+        "statut": statut,
+        "summary": flat_fields,
+        "parsed": payload_dict,
+        "triage": {"tier": result["tier"], "model": result.get("model"), "trace": result["trace"]},
+        "routing": {"tier": routing["tier"], "score": routing["score"], "model": routing["gpt_model"], "max_tokens": routing["max_tokens"]}
+    })
+
 @app.route("/exemples")
 def exemples():
     if not is_logged_in(session):
@@ -1322,6 +1528,90 @@ def refresh_logs():
     finally:
         db.close()
 
+def _require_admin():
+    """Retourne une réponse d'erreur si l'utilisateur courant n'est pas administrateur, sinon None"""
+    if not is_logged_in(session):
+        return jsonify({"error": "Non authentifié"}), 401
+    db = SessionLocal()
+    user = db.query(User).filter_by(id=session["user_id"]).first()
+    db.close()
+    if not user or user.role != "admin":
+        return jsonify({"error": "Accès refusé : réservé aux administrateurs."}), 403
+    return None
+
+@app.route("/api/llm_stats", methods=["GET"])
+def llm_stats():
+    """Agrégats de télémétrie LLM (appels, tokens, coût, latences) par user/pattern/model/provider/operation/day"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    
+    group_by = request.args.get("group_by", "model")
+    if group_by not in GROUP_BY_COLUMNS:
+        return jsonify({"error": f"group_by invalide, valeurs possibles: {', '.join(GROUP_BY_COLUMNS)}"}), 400
+    try:
+        hours = int(request.args.get("hours", 24))
+    except ValueError:
+        return jsonify({"error": "hours doit être un entier"}), 400
+    
+    try:
+        stats = get_llm_stats(group_by, hours)
+        return jsonify({
+            "group_by": group_by,
+            "hours": hours,
+            "total_calls": sum(s["calls"] for s in stats),
+            "total_cost_usd": round(sum(s["cost_usd"] for s in stats), 6),
+            "stats": stats
+        })
+    except Exception as e:
+        log_error(session.get("user_id"), "llm_stats_error", f"Erreur lors du calcul des statistiques LLM: {str(e)}", request.remote_addr, request.headers.get('User-Agent'))
+        return jsonify({"error": f"Erreur lors du calcul des statistiques LLM: {str(e)}"}), 500
+
+@app.route("/api/llm_stats/latency", methods=["GET"])
+def llm_stats_latency():
+    """Percentiles de latence et de TTFT par fournisseur et modèle"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    
+    try:
+        hours = int(request.args.get("hours", 24))
+    except ValueError:
+        return jsonify({"error": "hours doit être un entier"}), 400
+    
+    try:
+        return jsonify({"hours": hours, "percentiles": get_latency_percentiles(hours)})
+    except Exception as e:
+        log_error(session.get("user_id"), "llm_stats_latency_error", f"Erreur lors du calcul des percentiles: {str(e)}", request.remote_addr, request.headers.get('User-Agent'))
+        return jsonify({"error": f"Erreur lors du calcul des percentiles: {str(e)}"}), 500
+
+@app.route("/api/routing_stats", methods=["GET"])
+def routing_stats():
+    """Latences par niveau de routage (mémoire du processus) et configuration des niveaux"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify({
+        "tiers": TIERS,
+        "latency": tier_stats.snapshot()
+    })
+
+@app.route("/api/triage_stats", methods=["GET"])
+def triage_stats():
+    """Latence et taux de réponse de chaque niveau du pipeline de triage (mémoire du processus)"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    tiers = triage_pipeline.metrics.snapshot()
+    total = next(iter(tiers.values()))["calls"] if tiers else 0
+    return jsonify({
+        "total": total,
+        "cache_entries": len(triage_pipeline.cache) if triage_pipeline.cache is not None else 0,
+        "tiers": tiers,
+        # Part des payloads résolus par chaque niveau (tous passent par le premier)
+        "resolved_share": {name: round(stats["hits"] / total, 3) if total else 0 for name, stats in tiers.items()}
+    })
+
 def create_admin_user():
     session = SessionLocal()
     if not session.query(User).filter_by(username="khz").first():
@@ -0,0 +1,137 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from parser import parse_payload, extract_critical_fields, flatten_dict, detect_vendor
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Champs critiques (libellés de extract_critical_fields) qui définissent la "forme" d'un événement.
+# Les champs variables (IP, ports, horodatage, session...) sont volontairement exclus.
+GROUP_FIELDS = [
+    "Type",
+    "Sous-type",
+    "Service",
+    "Opération",
+    "Workload",
+    "Statut",
+    "ID Politique",
+    "Niveau CR",
+]
+
+# Champs résumés dans le prompt de groupe pour que le modèle voie la variabilité du lot
+VARYING_FIELDS = ["IP Source", "IP Destination", "Utilisateur", "Appareil"]
+
+GROUP_PROMPT_NOTE = """
+Contexte du lot: ce payload est représentatif d'un groupe de {count} événements de même forme
+(éditeur: {vendor}, logid: {logid}, action: {action}).
+{varying}
+L'analyse fournie sera appliquée à chaque événement du groupe.
+"""
+
+# Prompt de groupe quand l'utilisateur fournit ses propres consignes (le payload du groupe reste toujours inclus)
+CUSTOM_GROUP_PROMPT = """
+{instructions}
+
+Payload à analyser:
+{payload}
+"""
+
+
+def parse_raw_payload(raw_payload: str) -> dict:
+    """Parse un payload brut: JSON si possible, sinon le parser clé=valeur QRadar."""
+    try:
+        payload_dict = json.loads(raw_payload)
+        if isinstance(payload_dict, dict):
+            return payload_dict
+    except Exception:
+        pass
+    return parse_payload(raw_payload)
+
+
+def _as_key_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def compute_group_key(flat_fields: dict, critical: dict) -> Tuple[str, ...]:
+    """
+    Calcule la clé de regroupement d'un payload aplati:
+    (vendor, logid, action, champs critiques de GROUP_FIELDS).
+    """
+    vendor = detect_vendor(flat_fields)
+    logid = _as_key_value(critical.get("ID Log"))
+    action = _as_key_value(critical.get("Action") or critical.get("Opération"))
+    return (vendor, logid, action) + tuple(_as_key_value(critical.get(f)) for f in GROUP_FIELDS)
+
+
+def group_payloads(raw_payloads: List[str]) -> "OrderedDict[Tuple[str, ...], Dict[str, Any]]":
+    """
+    Parse tous les payloads et les regroupe par forme.
+    Chaque groupe contient les index des membres, leurs dicts parsés et un représentant (le premier).
+    """
+    groups: "OrderedDict[Tuple[str, ...], Dict[str, Any]]" = OrderedDict()
+    for index, raw_payload in enumerate(raw_payloads):
+        payload_dict = parse_raw_payload(raw_payload)
+        flat_fields = flatten_dict(payload_dict)
+        critical = extract_critical_fields(flat_fields)
+        key = compute_group_key(flat_fields, critical)
+        group = groups.get(key)
+        if group is None:
+            group = {
+                "key": key,
+                "vendor": key[0],
+                "logid": key[1],
+                "action": key[2],
+                "members": [],
+            }
+            groups[key] = group
+        group["members"].append({
+            "index": index,
+            "raw": raw_payload,
+            "parsed": payload_dict,
+            "flat": flat_fields,
+            "critical": critical,
+        })
+    logger.info(f"📦 {len(raw_payloads)} payloads regroupés en {len(groups)} groupes")
+    return groups
+
+
+def build_group_prompt(group: Dict[str, Any], base_prompt: str, custom_prompt: Optional[str] = None) -> str:
+    """
+    Construit le prompt d'analyse d'un groupe à partir du payload représentatif.
+    Un prompt personnalisé remplace les consignes de base_prompt, jamais le bloc du groupe
+    (payload représentatif, champs variables, nombre de membres): il est inséré à la place de {payload}
+    s'il le contient, sinon placé en tête du bloc.
+    """
+    members = group["members"]
+    representative = members[0]["parsed"]
+    varying_lines = []
+    for field in VARYING_FIELDS:
+        values = list(dict.fromkeys(
+            _as_key_value(member["critical"].get(field))
+            for member in members
+            if member["critical"].get(field)
+        ))
+        if len(values) > 1:
+            shown = ", ".join(values[:10])
+            more = f" (+{len(values) - 10} autres)" if len(values) > 10 else ""
+            varying_lines.append(f"- {field}: {shown}{more}")
+    note = GROUP_PROMPT_NOTE.format(
+        count=len(members),
+        vendor=group["vendor"],
+        logid=group["logid"] or "N/A",
+        action=group["action"] or "N/A",
+        varying="Valeurs distinctes dans le groupe:\n" + "\n".join(varying_lines) if varying_lines else "",
+    )
+    block = f"{representative}\n{note}"
+    if custom_prompt:
+        if "{payload}" in custom_prompt:
+            return custom_prompt.replace("{payload}", block)
+        return CUSTOM_GROUP_PROMPT.format(instructions=custom_prompt.strip(), payload=block)
+    return base_prompt.format(payload=block)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'extraction des sections d'une réponse IA:
+six regex historiques (analyze_ia / analyze_mistral) vs extracteur en un seul parcours.
+Vérifie aussi que les deux donnent le même résultat.
+
+Usage: python bench_ia_extraction.py [--iterations 200] [--repeat-sections 50]
+"""
+
+import re
+import sys
+import time
+import argparse
+
+from ia_extraction import extract_analysis_fields
+
+
+def legacy_extract(ia_text, pattern_nom):
+    """Copie de l'ancien bloc d'extraction de app.py (référence)"""
+    pattern_match = re.search(r'Pattern du payload\s*[:：\-–]?\s*([^\n]{1,50})', ia_text)
+    short_desc_match = re.search(r'Résumé court\s*[:：\-–]?\s*([^\n]{1,120})', ia_text)
+    statut_match = re.search(r'Statut\s*[:：\-–]?\s*([^\n]{1,50})', ia_text)
+    description_match = re.search(r'1\. Description des faits\s*\n(.+?)\n2\.', ia_text, re.DOTALL)
+    analyse_technique_match = re.search(r'2\. Analyse technique\s*\n(.+?)\n3\.', ia_text, re.DOTALL)
+    resultat_match = re.search(r'3\. Résultat\s*\n(.+)', ia_text, re.DOTALL)
+    resultat = resultat_match.group(1).strip() if resultat_match else ""
+    statut = statut_match.group(1).strip() if statut_match else ""
+    if not statut and resultat:
+        if re.search(r'faux positif', resultat, re.IGNORECASE):
+            statut = "Faux positif"
+        elif re.search(r'positif[\s_-]*confirm[ée]', resultat, re.IGNORECASE):
+            statut = "Vrai positif"
+    if not statut:
+        statut = "À CHOISIR"
+    return {
+        "pattern": pattern_match.group(1).strip() if pattern_match else pattern_nom,
+        "short_description": short_desc_match.group(1).strip() if short_desc_match else "",
+        "description_faits": description_match.group(1).strip() if description_match else "",
+        "analyse_technique": analyse_technique_match.group(1).strip() if analyse_technique_match else "",
+        "result": resultat,
+        "statut": statut,
+    }
+
+
+def build_response(repeat_sections, with_statut=True):
+    """Génère une réponse longue au format attendu par l'extraction"""
+    filler = "L'utilisateur a effectué une opération depuis l'IP 10.0.0.1 via le client Outlook. "
+    lines = [
+        "Pattern du payload : Suppression manuelle d'un message",
+        "Résumé court : Suppression légitime par un délégué de la boîte",
+    ]
+    if with_statut:
+        lines.append("Statut : Faux positif")
+    lines.append("")
+    lines.append("1. Description des faits")
+    lines.extend(filler * 3 for _ in range(repeat_sections))
+    lines.append("2. Analyse technique")
+    lines.extend(filler * 3 for _ in range(repeat_sections))
+    lines.append("3. Résultat")
+    lines.extend(filler * 3 for _ in range(repeat_sections))
+    lines.append("Conclusion: faux positif, aucune action requise.")
+    return "\n".join(lines)
+
+
+def bench(func, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(text, "unknown_pattern")
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--repeat-sections", type=int, default=50)
+    args = parser.parse_args()
+
+    print("🧪 Benchmark extraction des sections IA")
+    ok = True
+    for repeat in (1, args.repeat_sections, args.repeat_sections * 10):
+        for with_statut in (True, False):
+            text = build_response(repeat, with_statut)
+            legacy = legacy_extract(text, "unknown_pattern")
+            current = extract_analysis_fields(text, "unknown_pattern")
+            current.pop("structured")
+            if legacy != current:
+                ok = False
+                print(f"❌ Résultats différents (taille {len(text)}, statut={with_statut})")
+            legacy_ms = bench(legacy_extract, text, args.iterations)
+            current_ms = bench(extract_analysis_fields, text, args.iterations)
+            print(f"📏 {len(text):>8} caractères | statut explicite: {with_statut!s:5} | "
+                  f"regex: {legacy_ms:7.3f} ms | un parcours: {current_ms:7.3f} ms | "
+                  f"x{legacy_ms / current_ms:.2f}")
+
+    print("✅ Résultats identiques" if ok else "❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
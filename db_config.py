@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, TIMESTAMP
+from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, TIMESTAMP, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
@@ -32,6 +32,7 @@ class User(Base):
     patterns = relationship('Pattern', back_populates='creator', foreign_keys='Pattern.user_id')
     analyses = relationship('Analysis', back_populates='user')
     logs = relationship('Log', back_populates='user')
+    llm_calls = relationship('LLMCall', back_populates='user')
 
 class Pattern(Base):
     __tablename__ = 'patterns'
@@ -86,5 +87,27 @@ class Log(Base):
     # Relations
     user = relationship('User', back_populates='logs')
 
+class LLMCall(Base):
+    __tablename__ = 'llm_calls'
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(50), nullable=False)  # openai, ollama...
+    model = Column(String(100), nullable=False)
+    operation = Column(String(100))  # analyze_ia, analyze_mistral, analyze_batch...
+    tier = Column(String(20))  # Niveau de routage (simple, standard, complex)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    queue_wait_ms = Column(Integer)
+    ttft_ms = Column(Integer)  # Temps jusqu'au premier token
+    latency_ms = Column(Integer)  # Latence totale vue par l'application
+    cache_hit = Column(Boolean, default=False)
+    cost_usd = Column(Float, default=0.0)
+    success = Column(Boolean, default=True)
+    error = Column(String(255))
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    pattern_nom = Column(String(100))
+    created_at = Column(TIMESTAMP, default=func.now(), index=True)
+    # Relations
+    user = relationship('User', back_populates='llm_calls')
+
 def init_db():
     Base.metadata.create_all(bind=engine) 
\ No newline at end of file
@@ -1,13 +1,36 @@
 import os
+import time
 import requests
 import json
 import logging
 from typing import Dict, Any, Optional
 
+from ia_extraction import STRUCTURED_OUTPUT_INSTRUCTION
+
 # Configuration du logging
 logger = logging.getLogger(__name__)
 
-def analyze_payload_with_gpt(payload_dict: Dict[str, Any], api_key: str, custom_prompt: Optional[str] = None) -> Dict[str, Any]:
+# Prompt par défaut pour l'analyse de sécurité
+DEFAULT_PROMPT = """
+Tu es un expert en cybersécurité spécialisé dans l'analyse de logs QRadar.
+
+IMPORTANT: Réponds UNIQUEMENT en français. Ne jamais utiliser l'espagnol ou l'anglais.
+
+Payload à analyser:
+{payload}
+
+Fournis une analyse structurée et détaillée en français incluant:
+1. Type de menace détectée
+2. Niveau de risque (Faible/Moyen/Élevé/Critique)
+3. Recommandations de réponse immédiate
+4. Indicateurs techniques (IOC)
+5. Actions de remédiation
+
+Analyse complète (en français uniquement):
+"""
+
+def analyze_payload_with_gpt(payload_dict: Dict[str, Any], api_key: str, custom_prompt: Optional[str] = None, structured_output: bool = False,
+                             model: str = "gpt-3.5-turbo", max_tokens: int = 1000) -> Dict[str, Any]:
     """
     Analyse un payload avec GPT via l'API OpenAI ou un service local
     
@@ -15,10 +38,14 @@ def analyze_payload_with_gpt(payload_dict: Dict[str, Any], api_key: str, custom_
         payload_dict: Dictionnaire contenant les données du payload
         api_key: Clé API pour le service GPT
         custom_prompt: Prompt personnalisé optionnel
+        structured_output: Demande une réponse JSON (response_format json_object)
+        model: Modèle OpenAI à utiliser (choisi par model_router selon la complexité)
+        max_tokens: Budget de génération
     
     Returns:
         Dict contenant l'analyse et les métadonnées
     """
+    start_time = time.perf_counter()
     try:
         print(f"🤖 [GPT_ANALYSIS] Début de l'analyse GPT")
         print(f"📊 [GPT_ANALYSIS] Type de payload: {type(payload_dict)}")
@@ -29,27 +56,10 @@ def analyze_payload_with_gpt(payload_dict: Dict[str, Any], api_key: str, custom_
         # Préparer le payload pour l'analyse
         payload_text = str(payload_dict)
         
-        # Prompt par défaut pour l'analyse de sécurité
-        default_prompt = """
-Tu es un expert en cybersécurité spécialisé dans l'analyse de logs QRadar.
-
-IMPORTANT: Réponds UNIQUEMENT en français. Ne jamais utiliser l'espagnol ou l'anglais.
-
-Payload à analyser:
-{payload}
-
-Fournis une analyse structurée et détaillée en français incluant:
-1. Type de menace détectée
-2. Niveau de risque (Faible/Moyen/Élevé/Critique)
-3. Recommandations de réponse immédiate
-4. Indicateurs techniques (IOC)
-5. Actions de remédiation
-
-Analyse complète (en français uniquement):
-"""
-        
         # Utiliser le prompt personnalisé ou le prompt par défaut
-        prompt = custom_prompt if custom_prompt else default_prompt.format(payload=payload_text)
+        prompt = custom_prompt if custom_prompt else DEFAULT_PROMPT.format(payload=payload_text)
+        if structured_output:
+            prompt += STRUCTURED_OUTPUT_INSTRUCTION
         
         # Configuration de la requête
         headers = {
@@ -58,7 +68,7 @@ Analyse complète (en français uniquement):
         }
         
         data = {
-            "model": "gpt-3.5-turbo",
+            "model": model,
             "messages": [
                 {
                     "role": "system",
@@ -69,9 +79,11 @@ Analyse complète (en français uniquement):
                     "content": prompt
                 }
             ],
-            "max_tokens": 1000,
+            "max_tokens": max_tokens,
             "temperature": 0.7
         }
+        if structured_output:
+            data["response_format"] = {"type": "json_object"}
         
         # Appel à l'API OpenAI
         response = requests.post(
@@ -81,22 +93,31 @@ Analyse complète (en français uniquement):
             timeout=60
         )
         
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        
         if response.status_code == 200:
             result = response.json()
             analysis = result["choices"][0]["message"]["content"]
+            usage = result.get("usage", {})
             
             print(f"✅ [GPT_ANALYSIS] Analyse GPT réussie")
             print(f"📝 [GPT_ANALYSIS] Longueur de l'analyse: {len(analysis)} caractères")
-            print(f"🎯 [GPT_ANALYSIS] Modèle utilisé: gpt-3.5-turbo")
-            print(f"🔢 [GPT_ANALYSIS] Tokens utilisés: {result.get('usage', {}).get('total_tokens', 0)}")
+            print(f"🎯 [GPT_ANALYSIS] Modèle utilisé: {model} (max_tokens: {max_tokens})")
+            print(f"🔢 [GPT_ANALYSIS] Tokens utilisés: {usage.get('total_tokens', 0)} (prompt: {usage.get('prompt_tokens', 0)}, complétion: {usage.get('completion_tokens', 0)})")
+            print(f"⏱️ [GPT_ANALYSIS] Latence: {latency_ms:.0f} ms")
             
             logger.info("✅ Analyse GPT réussie")
             
             return {
                 "success": True,
                 "analysis": analysis,
-                "model": "gpt-3.5-turbo",
-                "tokens_used": result.get("usage", {}).get("total_tokens", 0),
+                "model": model,
+                "tokens_used": usage.get("total_tokens", 0),
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "latency_ms": latency_ms,
+                # Appel non streamé: le premier token arrive avec la réponse complète
+                "ttft_ms": latency_ms,
                 "timestamp": result.get("created", "")
             }
         else:
@@ -106,7 +127,9 @@ Analyse complète (en français uniquement):
             return {
                 "success": False,
                 "error": f"Erreur API: {response.status_code}",
-                "analysis": "Erreur lors de l'analyse GPT"
+                "analysis": "Erreur lors de l'analyse GPT",
+                "model": model,
+                "latency_ms": latency_ms
             }
             
     except requests.exceptions.Timeout:
@@ -115,7 +138,9 @@ Analyse complète (en français uniquement):
         return {
             "success": False,
             "error": "Timeout",
-            "analysis": "Timeout lors de l'analyse GPT"
+            "analysis": "Timeout lors de l'analyse GPT",
+            "model": model,
+            "latency_ms": (time.perf_counter() - start_time) * 1000
         }
     except requests.exceptions.ConnectionError as e:
         print(f"❌ [GPT_ANALYSIS] Erreur de connexion GPT: {e}")
@@ -123,7 +148,9 @@ Analyse complète (en français uniquement):
         return {
             "success": False,
             "error": f"Erreur de connexion: {str(e)}",
-            "analysis": "Erreur de connexion lors de l'analyse GPT"
+            "analysis": "Erreur de connexion lors de l'analyse GPT",
+            "model": model,
+            "latency_ms": (time.perf_counter() - start_time) * 1000
         }
     except Exception as e:
         print(f"❌ [GPT_ANALYSIS] Erreur inattendue GPT: {e}")
@@ -131,7 +158,9 @@ Analyse complète (en français uniquement):
         return {
             "success": False,
             "error": f"Erreur inattendue: {str(e)}",
-            "analysis": "Erreur inattendue lors de l'analyse GPT"
+            "analysis": "Erreur inattendue lors de l'analyse GPT",
+            "model": model,
+            "latency_ms": (time.perf_counter() - start_time) * 1000
         }
 
 def generate_short_summary(text: str, api_key: str, max_length: int = 200) -> str:
@@ -0,0 +1,194 @@
+import re
+import json
+import logging
+from typing import Dict, Any, Optional
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Consigne ajoutée au prompt quand on demande une sortie structurée (mode JSON)
+STRUCTURED_OUTPUT_INSTRUCTION = """
+Réponds UNIQUEMENT avec un objet JSON valide (sans texte autour) contenant les clés suivantes:
+{"pattern": "...", "resume_court": "...", "statut": "Faux positif | Vrai positif | À CHOISIR",
+ "description_faits": "...", "analyse_technique": "...", "resultat": "..."}
+"""
+
+# Marqueurs cherchés lors du parcours ligne par ligne
+_FIELD_MARKERS = {
+    "pattern": ("Pattern du payload", 50),
+    "resume": ("Résumé court", 120),
+    "statut": ("Statut", 50),
+}
+_SECTION_HEADERS = {
+    "h1": "1. Description des faits",
+    "h2": "2. Analyse technique",
+    "h3": "3. Résultat",
+}
+# Préfixe de la ligne qui termine chaque section (la section 3 va jusqu'à la fin)
+_SECTION_ENDS = {"h1": "2.", "h2": "3."}
+_FIELD_VALUE_RES = {
+    key: re.compile(r"\s*[:：\-–]?\s*([^\n]{1,%d})" % max_length)
+    for key, (marker, max_length) in _FIELD_MARKERS.items()
+}
+
+_CONFIRMED_RE = re.compile(r"positif[\s_-]*confirm[ée]")
+
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+# Clés acceptées en mode JSON (clé du résultat -> variantes)
+_JSON_KEYS = {
+    "pattern": ["pattern", "pattern_du_payload", "pattern_nom"],
+    "short_description": ["resume_court", "short_description", "resume"],
+    "statut": ["statut", "status"],
+    "description_faits": ["description_faits", "description"],
+    "analyse_technique": ["analyse_technique"],
+    "result": ["resultat", "result"],
+}
+
+
+def _is_header(line, header):
+    """Un en-tête de section doit être suivi uniquement d'espaces jusqu'à la fin de la ligne."""
+    position = line.find(header)
+    return position != -1 and not line[position + len(header):].strip()
+
+
+def parse_structured_output(text: str) -> Optional[Dict[str, str]]:
+    """
+    Tente de lire une réponse en mode JSON (éventuellement entourée d'un bloc ```json).
+    Retourne None si le modèle n'a pas respecté le format.
+    """
+    candidate = text.strip()
+    fence = _JSON_FENCE_RE.match(candidate)
+    if fence:
+        candidate = fence.group(1)
+    if not candidate.startswith("{"):
+        return None
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    sections = {}
+    for key, variants in _JSON_KEYS.items():
+        for variant in variants:
+            value = data.get(variant)
+            if value:
+                sections[key] = value.strip() if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+                break
+    return sections or None
+
+
+def extract_sections(text: str) -> Dict[str, Optional[str]]:
+    """
+    Extrait les sections d'une réponse texte en un seul parcours ligne par ligne.
+    Même sémantique que les six regex historiques: première occurrence de chaque marqueur,
+    section 1 jusqu'à la première ligne "2.", section 2 jusqu'à la première ligne "3.",
+    section 3 jusqu'à la fin du texte.
+    """
+    lines = text.split("\n")
+    found = {}
+    headers = {}
+    ends = {}
+    content_starts = {}
+    open_sections = ()
+    # Marqueurs encore à trouver: une fois trouvés, ils ne sont plus cherchés
+    pending_fields = tuple(_FIELD_MARKERS.items())
+    pending_headers = tuple(_SECTION_HEADERS.items())
+    line_start = 0
+    for index, line in enumerate(lines):
+        if pending_fields:
+            for key, (marker, max_length) in pending_fields:
+                position = line.find(marker)
+                if position != -1:
+                    # La valeur est lue dans le texte complet: comme \s* dans l'ancienne regex,
+                    # le séparateur peut déborder sur les lignes suivantes
+                    match = _FIELD_VALUE_RES[key].match(text, line_start + position + len(marker))
+                    if match:
+                        found[key] = match.group(1).strip()
+                        pending_fields = tuple(item for item in pending_fields if item[0] != key)
+        for key, end_prefix in open_sections:
+            if key not in ends and index > headers[key]:
+                # Comme l'ancien \s*\n(.+?), le contenu commence à la première ligne non vide
+                # et la section se termine à la ligne "2."/"3." suivante
+                if key not in content_starts:
+                    if line.strip():
+                        content_starts[key] = index
+                elif line[:2] == end_prefix:
+                    ends[key] = index
+        if pending_headers:
+            for key, header in pending_headers:
+                if _is_header(line, header):
+                    headers[key] = index
+                    if key in _SECTION_ENDS:
+                        open_sections += ((key, _SECTION_ENDS[key]),)
+                    pending_headers = tuple(item for item in pending_headers if item[0] != key)
+        line_start += len(line) + 1
+
+    def section(key):
+        start = headers.get(key)
+        if start is None:
+            return ""
+        if key == "h3":
+            return "\n".join(lines[start + 1:]).strip()
+        end = ends.get(key)
+        return "\n".join(lines[start + 1:end]).strip() if end is not None else ""
+
+    return {
+        "pattern": found.get("pattern"),
+        "short_description": found.get("resume", ""),
+        "statut": found.get("statut", ""),
+        "description_faits": section("h1"),
+        "analyse_technique": section("h2"),
+        "result": section("h3"),
+    }
+
+
+def infer_statut(resultat: str) -> str:
+    """Déduit le statut depuis le résultat ("faux positif" prioritaire sur "positif confirmé")."""
+    # Mise en minuscules une seule fois plutôt que deux recherches IGNORECASE
+    lowered = resultat.lower()
+    if "faux positif" in lowered:
+        return "Faux positif"
+    if _CONFIRMED_RE.search(lowered):
+        return "Vrai positif"
+    return ""
+
+
+def apply_user_intent(statut: str, user_intent: str) -> str:
+    """Le choix explicite de l'analyste prime sur le statut extrait."""
+    if user_intent == "faux_positif":
+        return "Faux positif"
+    if user_intent == "positif_confirme":
+        return "Vrai positif"
+    if user_intent:
+        return user_intent
+    return statut
+
+
+def extract_analysis_fields(text: str, default_pattern: str, user_intent: str = "") -> Dict[str, Any]:
+    """
+    Extrait les champs structurés d'une réponse IA (GPT ou Mistral).
+    Utilise le mode JSON si la réponse le respecte, sinon l'extraction texte en un seul parcours.
+    """
+    sections = parse_structured_output(text)
+    structured = sections is not None
+    if not structured:
+        sections = extract_sections(text)
+
+    resultat = sections.get("result", "")
+    statut = sections.get("statut", "")
+    if not statut and resultat:
+        statut = infer_statut(resultat)
+    if not statut:
+        statut = "À CHOISIR"
+
+    return {
+        "pattern": sections["pattern"] if sections.get("pattern") is not None else default_pattern,
+        "short_description": sections.get("short_description", ""),
+        "description_faits": sections.get("description_faits", ""),
+        "analyse_technique": sections.get("analyse_technique", ""),
+        "result": resultat,
+        "statut": apply_user_intent(statut, user_intent),
+        "structured": structured,
+    }
@@ -0,0 +1,194 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import func, case
+from db_config import SessionLocal, LLMCall, User
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Tarifs indicatifs en USD pour 1000 tokens (prompt, complétion). Les modèles locaux sont gratuits.
+PRICING_PER_1K = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+}
+
+# Regroupements autorisés pour les agrégats (nom du paramètre -> colonne)
+GROUP_BY_COLUMNS = {
+    "user": LLMCall.user_id,
+    "pattern": LLMCall.pattern_nom,
+    "model": LLMCall.model,
+    "provider": LLMCall.provider,
+    "operation": LLMCall.operation,
+    "tier": LLMCall.tier,
+    "day": func.date(LLMCall.created_at),
+}
+
+
+def estimate_cost(provider: str, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estime le coût d'un appel à partir des tokens consommés"""
+    if provider != "openai":
+        return 0.0
+    prompt_price, completion_price = PRICING_PER_1K.get(model, PRICING_PER_1K["gpt-3.5-turbo"])
+    return round((prompt_tokens or 0) / 1000 * prompt_price + (completion_tokens or 0) / 1000 * completion_price, 6)
+
+
+def record_llm_call(provider: str, model: str, operation: str,
+                    prompt_tokens: int = 0, completion_tokens: int = 0,
+                    latency_ms: Optional[float] = None, ttft_ms: Optional[float] = None,
+                    queue_wait_ms: Optional[float] = None, cache_hit: bool = False,
+                    success: bool = True, error: Optional[str] = None,
+                    user_id: Optional[int] = None, pattern_nom: Optional[str] = None,
+                    tier: Optional[str] = None) -> None:
+    """
+    Enregistre un appel LLM dans la table llm_calls.
+    Comme log_action, une erreur d'enregistrement ne doit jamais casser l'analyse.
+    """
+    session = SessionLocal()
+    try:
+        session.add(LLMCall(
+            provider=provider,
+            model=model or "unknown",
+            operation=operation,
+            tier=tier,
+            prompt_tokens=prompt_tokens or 0,
+            completion_tokens=completion_tokens or 0,
+            latency_ms=int(latency_ms) if latency_ms is not None else None,
+            ttft_ms=int(ttft_ms) if ttft_ms is not None else None,
+            queue_wait_ms=int(queue_wait_ms) if queue_wait_ms is not None else None,
+            cache_hit=cache_hit,
+            cost_usd=0.0 if cache_hit else estimate_cost(provider, model, prompt_tokens, completion_tokens),
+            success=success,
+            error=error[:255] if error else None,
+            user_id=user_id,
+            pattern_nom=pattern_nom[:100] if pattern_nom else None,
+            # UTC explicite, comme store_analysis: les filtres de get_llm_stats comparent à datetime.utcnow()
+            created_at=datetime.utcnow(),
+        ))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"❌ Erreur enregistrement télémétrie LLM: {e}")
+    finally:
+        session.close()
+
+
+def get_llm_stats(group_by: str = "model", hours: int = 24) -> List[Dict[str, Any]]:
+    """
+    Agrège les appels LLM des `hours` dernières heures par user, pattern, model, provider, operation, tier ou day.
+    Retourne nombre d'appels, tokens, coût, latences moyennes/max et taux de cache.
+    """
+    column = GROUP_BY_COLUMNS[group_by]
+    since = datetime.utcnow() - timedelta(hours=hours)
+    session = SessionLocal()
+    try:
+        rows = session.query(
+            column.label("key"),
+            func.count(LLMCall.id).label("calls"),
+            func.sum(LLMCall.prompt_tokens).label("prompt_tokens"),
+            func.sum(LLMCall.completion_tokens).label("completion_tokens"),
+            func.sum(LLMCall.cost_usd).label("cost_usd"),
+            func.avg(LLMCall.latency_ms).label("avg_latency_ms"),
+            func.max(LLMCall.latency_ms).label("max_latency_ms"),
+            func.avg(LLMCall.ttft_ms).label("avg_ttft_ms"),
+            func.avg(LLMCall.queue_wait_ms).label("avg_queue_wait_ms"),
+            func.sum(case((LLMCall.cache_hit == True, 1), else_=0)).label("cache_hits"),
+            func.sum(case((LLMCall.success == False, 1), else_=0)).label("errors"),
+        ).filter(LLMCall.created_at >= since).group_by(column).order_by(func.count(LLMCall.id).desc()).all()
+
+        usernames = {}
+        if group_by == "user":
+            user_ids = [row.key for row in rows if row.key is not None]
+            usernames = {u.id: u.username for u in session.query(User).filter(User.id.in_(user_ids)).all()}
+
+        stats = []
+        for row in rows:
+            key = row.key
+            if group_by == "user":
+                key = usernames.get(row.key, "N/A")
+            elif group_by == "day" and key is not None:
+                key = str(key)
+            stats.append({
+                "key": key,
+                "calls": row.calls,
+                "prompt_tokens": int(row.prompt_tokens or 0),
+                "completion_tokens": int(row.completion_tokens or 0),
+                "cost_usd": round(float(row.cost_usd or 0), 6),
+                "avg_latency_ms": round(float(row.avg_latency_ms), 1) if row.avg_latency_ms is not None else None,
+                "max_latency_ms": row.max_latency_ms,
+                "avg_ttft_ms": round(float(row.avg_ttft_ms), 1) if row.avg_ttft_ms is not None else None,
+                "avg_queue_wait_ms": round(float(row.avg_queue_wait_ms), 1) if row.avg_queue_wait_ms is not None else None,
+                "cache_hit_ratio": round(int(row.cache_hits or 0) / row.calls, 3) if row.calls else 0,
+                "errors": int(row.errors or 0),
+            })
+        return stats
+    finally:
+        session.close()
+
+
+def _percentile(sorted_values: List[int], percent: float) -> Optional[int]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_latency_percentiles(hours: int = 24, limit: int = 50000) -> List[Dict[str, Any]]:
+    """
+    Percentiles de latence (p50/p95/p99) par fournisseur et modèle.
+    MySQL n'ayant pas de fonction de percentile, les latences sont triées côté Python (bornées par `limit`).
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    session = SessionLocal()
+    try:
+        rows = session.query(LLMCall.provider, LLMCall.model, LLMCall.latency_ms, LLMCall.ttft_ms) \
+            .filter(LLMCall.created_at >= since, LLMCall.latency_ms != None) \
+            .order_by(LLMCall.id.desc()).limit(limit).all()
+    finally:
+        session.close()
+
+    grouped: Dict[tuple, Dict[str, List[int]]] = {}
+    for provider, model, latency_ms, ttft_ms in rows:
+        bucket = grouped.setdefault((provider, model), {"latency": [], "ttft": []})
+        bucket["latency"].append(latency_ms)
+        if ttft_ms is not None:
+            bucket["ttft"].append(ttft_ms)
+
+    percentiles = []
+    for (provider, model), values in grouped.items():
+        latencies = sorted(values["latency"])
+        ttfts = sorted(values["ttft"])
+        percentiles.append({
+            "provider": provider,
+            "model": model,
+            "calls": len(latencies),
+            "latency_p50_ms": _percentile(latencies, 50),
+            "latency_p95_ms": _percentile(latencies, 95),
+            "latency_p99_ms": _percentile(latencies, 99),
+            "ttft_p50_ms": _percentile(ttfts, 50),
+            "ttft_p95_ms": _percentile(ttfts, 95),
+        })
+    return percentiles
+
+
+def record_gpt_call(ia_response: Dict[str, Any], operation: str,
+                    user_id: Optional[int] = None, pattern_nom: Optional[str] = None,
+                    tier: Optional[str] = None) -> None:
+    """Enregistre un appel à partir du dict renvoyé par analyze_payload_with_gpt"""
+    record_llm_call(
+        provider="openai",
+        model=ia_response.get("model", "gpt-3.5-turbo"),
+        operation=operation,
+        prompt_tokens=ia_response.get("prompt_tokens", 0),
+        completion_tokens=ia_response.get("completion_tokens", 0),
+        latency_ms=ia_response.get("latency_ms"),
+        ttft_ms=ia_response.get("ttft_ms"),
+        success=ia_response.get("success", False),
+        error=ia_response.get("error"),
+        user_id=user_id,
+        pattern_nom=pattern_nom,
+        tier=tier,
+    )
@@ -0,0 +1,154 @@
+import os
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+from parser import detect_vendor
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Configuration des niveaux: modèle et budget de génération par fournisseur
+TIERS = {
+    "simple": {
+        "gpt_model": os.getenv("GPT_MODEL_SIMPLE", "gpt-4o-mini"),
+        "max_tokens": int(os.getenv("GPT_MAX_TOKENS_SIMPLE", "400")),
+        "ollama_model": os.getenv("OLLAMA_MODEL_SIMPLE", "mistral:7b"),
+        "num_predict": int(os.getenv("OLLAMA_NUM_PREDICT_SIMPLE", "256")),
+    },
+    "standard": {
+        "gpt_model": os.getenv("GPT_MODEL_STANDARD", "gpt-3.5-turbo"),
+        "max_tokens": int(os.getenv("GPT_MAX_TOKENS_STANDARD", "1000")),
+        "ollama_model": os.getenv("OLLAMA_MODEL_STANDARD", "mistral:7b"),
+        "num_predict": int(os.getenv("OLLAMA_NUM_PREDICT_STANDARD", "1024")),
+    },
+    "complex": {
+        "gpt_model": os.getenv("GPT_MODEL_COMPLEX", "gpt-4o"),
+        "max_tokens": int(os.getenv("GPT_MAX_TOKENS_COMPLEX", "1500")),
+        "ollama_model": os.getenv("OLLAMA_MODEL_COMPLEX", "mistral:7b"),
+        "num_predict": int(os.getenv("OLLAMA_NUM_PREDICT_COMPLEX", "1536")),
+    },
+}
+
+# Seuils de score: score <= SIMPLE_MAX_SCORE -> simple, <= STANDARD_MAX_SCORE -> standard, sinon complex
+SIMPLE_MAX_SCORE = int(os.getenv("ROUTER_SIMPLE_MAX_SCORE", "0"))
+STANDARD_MAX_SCORE = int(os.getenv("ROUTER_STANDARD_MAX_SCORE", "3"))
+
+_CRLEVEL_SCORES = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+_TRIVIAL_ACTIONS = {"deny", "block", "blocked", "close", "timeout", "drop", "dropped"}
+
+
+def _critical_value(critical: Dict[str, Any], label: str) -> str:
+    value = critical.get(label)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    # Les valeurs FortiGate gardent leurs guillemets après parse_payload (action="deny")
+    return str(value).strip().strip('"').lower() if value else ""
+
+
+def score_complexity(flat_fields: Dict[str, Any], critical: Dict[str, Any], pattern_known: bool = False) -> Dict[str, Any]:
+    """
+    Calcule un score de complexité d'un payload à partir de ses champs parsés.
+    Plus le score est élevé, plus l'analyse mérite un gros modèle et un budget de génération large.
+    """
+    score = 0
+    reasons = []
+
+    vendor = detect_vendor(flat_fields)
+    if vendor == "microsoft365":
+        score += 1
+        reasons.append("audit M365 (+1)")
+    elif vendor == "generic":
+        score += 2
+        reasons.append("source non reconnue (+2)")
+
+    crlevel = _critical_value(critical, "Niveau CR")
+    if crlevel in _CRLEVEL_SCORES and _CRLEVEL_SCORES[crlevel]:
+        score += _CRLEVEL_SCORES[crlevel]
+        reasons.append(f"crlevel={crlevel} (+{_CRLEVEL_SCORES[crlevel]})")
+
+    crscore = _critical_value(critical, "Score CR")
+    if crscore.isdigit():
+        if int(crscore) >= 50:
+            score += 2
+            reasons.append(f"crscore={crscore} (+2)")
+        elif int(crscore) >= 30:
+            score += 1
+            reasons.append(f"crscore={crscore} (+1)")
+
+    field_count = len(flat_fields)
+    if field_count > 40:
+        score += 2
+        reasons.append(f"{field_count} champs (+2)")
+    elif field_count > 20:
+        score += 1
+        reasons.append(f"{field_count} champs (+1)")
+
+    action = _critical_value(critical, "Action")
+    if vendor == "fortinet" and _critical_value(critical, "Type") == "traffic" and action in _TRIVIAL_ACTIONS:
+        score -= 1
+        reasons.append(f"trafic {action} (-1)")
+
+    if pattern_known:
+        score -= 2
+        reasons.append("pattern connu (-2)")
+
+    return {"score": score, "vendor": vendor, "reasons": reasons}
+
+
+def route_payload(flat_fields: Dict[str, Any], critical: Dict[str, Any], pattern_known: bool = False,
+                  forced_tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Choisit le niveau (simple/standard/complex) et la configuration de génération associée.
+    `forced_tier` permet à l'appelant d'imposer un niveau.
+    """
+    complexity = score_complexity(flat_fields, critical, pattern_known)
+    if forced_tier in TIERS:
+        tier = forced_tier
+    elif complexity["score"] <= SIMPLE_MAX_SCORE:
+        tier = "simple"
+    elif complexity["score"] <= STANDARD_MAX_SCORE:
+        tier = "standard"
+    else:
+        tier = "complex"
+    decision = dict(TIERS[tier], tier=tier, **complexity)
+    logger.info(f"🧭 Routage: niveau {tier} (score {complexity['score']}: {', '.join(complexity['reasons']) or 'aucun critère'})")
+    return decision
+
+
+class TierLatencyStats:
+    """Statistiques de latence en mémoire par niveau (compteurs + fenêtre glissante pour les percentiles)"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, tier: str, latency_ms: float, success: bool = True) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(tier, {
+                "count": 0, "errors": 0, "total_ms": 0.0, "samples": deque(maxlen=self._window)
+            })
+            stats["count"] += 1
+            stats["total_ms"] += latency_ms
+            stats["samples"].append(latency_ms)
+            if not success:
+                stats["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for tier, stats in self._stats.items():
+                samples = sorted(stats["samples"])
+                result[tier] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else None,
+                    "p50_ms": round(samples[len(samples) // 2], 1) if samples else None,
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1) if samples else None,
+                }
+            return result
+
+
+tier_stats = TierLatencyStats()
@@ -125,3 +125,17 @@ def flatten_dict(d, parent_key='', sep='.'):
         else:
             items.append((new_key, v))
     return dict(items)
+
+
+def detect_vendor(parsed_payload: dict) -> str:
+    """
+    Devine l'éditeur/la source d'un payload à partir des clés présentes.
+    Retourne "fortinet", "microsoft365" ou "generic".
+    """
+    keys = {re.sub(r'[^a-z0-9]', '', str(k).lower()) for k in parsed_payload.keys()}
+    devid = str(parsed_payload.get("devid") or "")
+    if devid.upper().startswith("FG") or {"logid", "devname", "vd"} <= keys:
+        return "fortinet"
+    if {"workload", "operation"} & keys and {"creationtime", "userid", "organizationid"} & keys:
+        return "microsoft365"
+    return "generic"
@@ -86,4 +86,74 @@ def store_analysis(payload, rapport_ia, pattern_nom, resume_court, description_f
         session.rollback()
         raise
     finally:
-        session.close() 
\ No newline at end of file
+        session.close() 
+
+
+def store_analyses_bulk(entries, user_id=None):
+    """
+    Stocke un lot d'analyses en une seule transaction.
+    Chaque entrée est un dict avec les clés de store_analysis (payload, rapport_ia, pattern_nom,
+    resume_court, description_faits, analyse_technique, resultat, justification, tags, statut).
+    Les patterns sont résolus une seule fois par nom et les analyses insérées en bloc.
+    """
+    if not entries:
+        return 0
+    session = SessionLocal()
+    try:
+        log_action(user_id, "store_analyses_bulk_start", f"Début stockage en lot - {len(entries)} analyses")
+
+        # Résoudre tous les patterns du lot en une requête
+        names = {entry["pattern_nom"] for entry in entries}
+        patterns = {p.nom: p for p in session.query(Pattern).filter(Pattern.nom.in_(names)).all()}
+        for name in names:
+            if name not in patterns:
+                pattern = Pattern(nom=name)
+                session.add(pattern)
+                patterns[name] = pattern
+        session.flush()  # Pour obtenir les IDs des nouveaux patterns
+
+        now = datetime.now(timezone.utc)
+        analyses = []
+        for entry in entries:
+            pattern = patterns[entry["pattern_nom"]]
+            tags = entry.get("tags")
+            tags_str = ','.join(tags) if isinstance(tags, list) else (str(tags) if tags is not None else "")
+            statut = entry.get("statut") or "À CHOISIR"
+            if entry.get("resume_court"):
+                pattern.resume = entry["resume_court"]
+            if tags is not None:
+                if isinstance(tags, list):
+                    pattern.tags = ','.join(tags)
+                else:
+                    pattern.tags = str(tags)
+            if entry.get("statut"):
+                pattern.status = statut
+            if user_id:
+                pattern.user_id = user_id
+            analyses.append(Analysis(
+                payload=entry["payload"],
+                pattern_id=pattern.id,
+                pattern_nom=entry["pattern_nom"],
+                resume_court=entry.get("resume_court"),
+                description_faits=entry.get("description_faits"),
+                analyse_technique=entry.get("analyse_technique"),
+                resultat=entry.get("resultat"),
+                justification=entry.get("justification"),
+                rapport_complet=entry.get("rapport_ia"),
+                user_id=user_id,
+                tags=tags_str,
+                statut=statut,
+                created_at=now,
+                updated_at=now
+            ))
+        session.bulk_save_objects(analyses)
+        session.commit()
+
+        log_success(user_id, "store_analyses_bulk_complete", f"{len(analyses)} analyses stockées en lot ({len(names)} patterns)")
+        return len(analyses)
+    except Exception as e:
+        log_error(user_id, "store_analyses_bulk_error", f"Erreur lors du stockage en lot: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -62,6 +62,31 @@ CREATE TABLE IF NOT EXISTS logs (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- Télémétrie des appels LLM (latence, tokens, coût)
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    provider VARCHAR(50) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    operation VARCHAR(100),
+    tier VARCHAR(20),
+    prompt_tokens INT DEFAULT 0,
+    completion_tokens INT DEFAULT 0,
+    queue_wait_ms INT NULL,
+    ttft_ms INT NULL,
+    latency_ms INT NULL,
+    cache_hit BOOLEAN DEFAULT FALSE,
+    cost_usd DOUBLE DEFAULT 0,
+    success BOOLEAN DEFAULT TRUE,
+    error VARCHAR(255),
+    user_id INT NULL,
+    pattern_nom VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_llm_calls_created_at (created_at),
+    INDEX idx_llm_calls_user (user_id, created_at),
+    INDEX idx_llm_calls_pattern (pattern_nom, created_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
 -- Utilisateur admin (hash à remplacer par le tien si besoin)
 INSERT INTO users (username, password_hash, email, role)
 VALUES (
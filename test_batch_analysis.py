@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Script de vérification du prompt de groupe (batch_analysis.build_group_prompt):
+le payload représentatif et le contexte du lot doivent rester dans le prompt même avec un prompt personnalisé
+"""
+
+import sys
+import os
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_analysis import group_payloads, build_group_prompt
+
+# Même forme que gpt_analysis.DEFAULT_PROMPT (consignes + {payload})
+BASE_PROMPT = """
+Tu es un expert en cybersécurité spécialisé dans l'analyse de logs QRadar.
+
+Payload à analyser:
+{payload}
+"""
+
+PAYLOADS = [
+    'devname="FGT1" logid="0000000013" type="traffic" subtype="forward" srcip=10.0.0.1 dstip=192.168.1.10 action="deny"',
+    'devname="FGT1" logid="0000000013" type="traffic" subtype="forward" srcip=10.0.0.2 dstip=192.168.1.10 action="deny"',
+]
+CUSTOM_PROMPT = "Analyse ce trafic refusé et indique s'il faut ouvrir un ticket."
+
+
+def group_prompt(custom_prompt):
+    group = list(group_payloads(PAYLOADS).values())[0]
+    return build_group_prompt(group, BASE_PROMPT, custom_prompt)
+
+
+def check(label, prompt):
+    ok = "10.0.0.1" in prompt and "groupe de 2 événements" in prompt and "10.0.0.2" in prompt
+    print(f"{'✅' if ok else '❌'} {label}: payload représentatif et contexte du lot {'présents' if ok else 'absents'}")
+    return ok
+
+
+def test_default_prompt():
+    return check("Prompt par défaut", group_prompt(None))
+
+
+def test_custom_prompt():
+    """Le prompt personnalisé du dashboard (/analyze_batch) ne doit pas faire perdre le payload du groupe"""
+    prompt = group_prompt(CUSTOM_PROMPT)
+    return check("Prompt personnalisé", prompt) and CUSTOM_PROMPT in prompt
+
+
+def test_custom_prompt_with_placeholder():
+    prompt = group_prompt("Consignes SOC:\n{payload}\nRéponds en trois lignes.")
+    return check("Prompt personnalisé avec {payload}", prompt) and "{payload}" not in prompt
+
+
+def main():
+    print("🧪 Vérification du prompt de groupe")
+    results = [test_default_prompt(), test_custom_prompt(), test_custom_prompt_with_placeholder()]
+    if all(results):
+        print("🎉 Prompt de groupe conforme")
+        return 0
+    print("❌ Prompt de groupe non conforme")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Script de vérification du routage par complexité (model_router) sur les payloads d'exemple
+de patterns_data/patterns.json (valeurs FortiGate entre guillemets)
+"""
+
+import sys
+import os
+import json
+
+# Ajouter le répertoire courant au path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from parser import parse_payload, flatten_dict, extract_critical_fields
+from model_router import score_complexity, route_payload
+
+PATTERNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patterns_data", "patterns.json")
+
+
+def route_raw(raw_payload, pattern_known=False):
+    flat_fields = flatten_dict(parse_payload(raw_payload))
+    return route_payload(flat_fields, extract_critical_fields(flat_fields), pattern_known)
+
+
+def test_patterns_sample():
+    """Le payload d'exemple FortiGate: crlevel="high" et action="deny" doivent être reconnus malgré les guillemets"""
+    with open(PATTERNS_FILE) as f:
+        sample = json.load(f)[0]["input"]
+    flat_fields = flatten_dict(parse_payload(sample))
+    result = score_complexity(flat_fields, extract_critical_fields(flat_fields))
+    print(f"📋 Exemple patterns.json: score {result['score']} ({', '.join(result['reasons'])})")
+    ok = result["vendor"] == "fortinet" \
+        and "crlevel=high (+2)" in result["reasons"] \
+        and "trafic deny (-1)" in result["reasons"]
+    print("✅ crlevel et refus trivial reconnus" if ok else "❌ crlevel ou refus trivial non reconnu")
+    return ok
+
+
+def test_trivial_deny_goes_simple():
+    """Un refus de trafic FortiGate sans score de réputation, pattern connu, part au niveau simple"""
+    payload = ('date=2025-07-21 time=08:33:44 devname="FGT3KDT418800255" logid="0000000013" type="traffic" '
+               'subtype="forward" srcip=10.10.61.15 dstip=192.168.30.206 dstport=443 action="deny" crlevel="low"')
+    tier = route_raw(payload, pattern_known=True)["tier"]
+    ok = tier == "simple"
+    print(f"{'✅' if ok else '❌'} Refus trivial routé vers le niveau {tier}")
+    return ok
+
+
+def main():
+    print("🧪 Vérification du routage par complexité")
+    results = [test_patterns_sample(), test_trivial_deny_goes_simple()]
+    if all(results):
+        print("🎉 Routage conforme")
+        return 0
+    print("❌ Routage non conforme")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
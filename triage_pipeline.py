@@ -0,0 +1,331 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from db_config import SessionLocal, Pattern
+from ia_extraction import extract_analysis_fields
+from model_router import TIERS
+from llm_telemetry import record_llm_call, record_gpt_call
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Configuration du pipeline de triage
+RULES_REFRESH_SECONDS = int(os.getenv("TRIAGE_RULES_REFRESH_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("TRIAGE_CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL_SECONDS = int(os.getenv("TRIAGE_CACHE_TTL_SECONDS", "3600"))
+SMALL_MODEL_ENABLED = os.getenv("TRIAGE_SMALL_MODEL_ENABLED", "true").lower() == "true"
+SMALL_MODEL_TIMEOUT = int(os.getenv("TRIAGE_SMALL_MODEL_TIMEOUT", "60"))
+
+# Statuts suffisamment tranchés pour répondre sans escalader
+DECISIVE_STATUSES = {"Faux positif", "Vrai positif", "critique", "ignoré"}
+
+
+def payload_fingerprint(raw_payload: str, custom_prompt: Optional[str] = None) -> str:
+    """Empreinte stable d'un payload brut (clé du cache d'analyses); un prompt personnalisé donne une autre clé"""
+    digest = hashlib.sha256(raw_payload.strip().encode("utf-8"))
+    if custom_prompt:
+        digest.update(b"\0" + custom_prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Cache LRU en mémoire des analyses déjà produites, avec expiration"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: int = CACHE_TTL_SECONDS):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TriageContext:
+    """Données d'un payload à trier, partagées entre les niveaux"""
+
+    def __init__(self, raw_payload: str, payload_dict: dict, pattern_nom: str, routing: Dict[str, Any],
+                 user_id: Optional[int] = None, api_key: Optional[str] = None, custom_prompt: Optional[str] = None):
+        self.raw_payload = raw_payload
+        self.payload_dict = payload_dict
+        self.pattern_nom = pattern_nom
+        self.routing = routing
+        self.user_id = user_id
+        self.api_key = api_key
+        self.custom_prompt = custom_prompt
+        self.fingerprint = payload_fingerprint(raw_payload, custom_prompt)
+
+
+class TriageTier(ABC):
+    """Un niveau du pipeline: retourne une réponse (dict) ou None pour escalader"""
+
+    name = "tier"
+    # Les réponses des niveaux coûteux sont mises en cache pour les payloads identiques
+    cacheable = False
+
+    @abstractmethod
+    def answer(self, ctx: TriageContext) -> Optional[Dict[str, Any]]:
+        ...
+
+
+class RulesTier(TriageTier):
+    """
+    Règles déterministes: patterns dont la regex correspond au payload et dont le statut est tranché,
+    et exemples de payloads déjà classés faux positifs.
+    """
+
+    name = "rules"
+
+    def __init__(self, refresh_seconds: int = RULES_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._rules: List[tuple] = []
+        self._known_false_positives: Dict[str, Any] = {}
+
+    def _refresh(self) -> None:
+        """Recharge et compile les règles depuis la table patterns (au plus toutes les refresh_seconds)"""
+        if time.time() - self._loaded_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if time.time() - self._loaded_at < self.refresh_seconds:
+                return
+            session = SessionLocal()
+            try:
+                patterns = session.query(Pattern).filter(Pattern.status.in_(DECISIVE_STATUSES)).all()
+                rules = []
+                known_false_positives = {}
+                for pattern in patterns:
+                    summary = {
+                        "pattern": pattern.nom,
+                        "short_description": pattern.resume or "",
+                        "description_faits": "",
+                        "analyse_technique": pattern.description or "",
+                        "result": pattern.feedback or "",
+                        "statut": pattern.status,
+                    }
+                    if pattern.regex:
+                        try:
+                            rules.append((re.compile(pattern.regex), summary))
+                        except re.error as e:
+                            logger.warning(f"⚠️ Regex invalide pour le pattern {pattern.nom}: {e}")
+                    if pattern.status == "Faux positif" and pattern.exemple_payload:
+                        known_false_positives[payload_fingerprint(pattern.exemple_payload)] = summary
+                self._rules = rules
+                self._known_false_positives = known_false_positives
+                self._loaded_at = time.time()
+                logger.info(f"📏 {len(rules)} règles et {len(known_false_positives)} faux positifs connus chargés")
+            finally:
+                session.close()
+
+    def answer(self, ctx: TriageContext) -> Optional[Dict[str, Any]]:
+        self._refresh()
+        known = self._known_false_positives.get(payload_fingerprint(ctx.raw_payload))
+        if known:
+            return dict(known, ia_text=f"Faux positif connu (pattern {known['pattern']})")
+        for regex, summary in self._rules:
+            if regex.search(ctx.raw_payload):
+                return dict(summary, ia_text=f"Règle déterministe: pattern {summary['pattern']} ({summary['statut']})")
+        return None
+
+
+class CacheTier(TriageTier):
+    """Analyses déjà produites pour un payload identique"""
+
+    name = "cache"
+
+    def __init__(self, cache: AnalysisCache):
+        self.cache = cache
+
+    def answer(self, ctx: TriageContext) -> Optional[Dict[str, Any]]:
+        return self.cache.get(ctx.fingerprint)
+
+
+class SmallModelTier(TriageTier):
+    """
+    Petit modèle local via le retriever (configuration du niveau "simple" du routeur).
+    Ne répond que si le statut extrait est tranché, sinon escalade vers le gros modèle.
+    """
+
+    name = "small_model"
+    cacheable = True
+
+    def __init__(self, retriever_url: str, timeout: int = SMALL_MODEL_TIMEOUT):
+        self.retriever_url = retriever_url
+        self.timeout = timeout
+
+    def answer(self, ctx: TriageContext) -> Optional[Dict[str, Any]]:
+        model = TIERS["simple"]["ollama_model"]
+        try:
+            response = requests.post(f"{self.retriever_url}/analyze", json={
+                "payload": ctx.raw_payload,
+                "structured_output": True,
+                "model": model,
+                "num_predict": TIERS["simple"]["num_predict"],
+                "pattern": ctx.pattern_nom if ctx.pattern_nom != "unknown_pattern" else None,
+                "user_id": str(ctx.user_id) if ctx.user_id else None,
+            }, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"⚠️ Petit modèle indisponible, escalade: {e}")
+            return None
+        if response.status_code != 200:
+            logger.warning(f"⚠️ Petit modèle en erreur ({response.status_code}), escalade")
+            return None
+        result = response.json()
+        metrics = result.get("metrics") or {}
+        record_llm_call(
+            provider="ollama",
+            model=metrics.get("model", model),
+            operation="triage",
+            prompt_tokens=metrics.get("prompt_tokens", 0),
+            completion_tokens=metrics.get("completion_tokens", 0),
+            latency_ms=metrics.get("latency_ms"),
+            ttft_ms=metrics.get("ttft_ms"),
+            # Analyse resservie par le cache du retriever: pas un appel au modèle (coût nul)
+            cache_hit=metrics.get("cache_hit", False),
+            user_id=ctx.user_id,
+            pattern_nom=ctx.pattern_nom,
+            tier="simple",
+        )
+        ia_text = result.get("analysis", "")
+        fields = extract_analysis_fields(ia_text, ctx.pattern_nom)
+        if fields["statut"] not in DECISIVE_STATUSES:
+            logger.info(f"↗️ Statut non tranché par le petit modèle ({fields['statut']}), escalade")
+            return None
+        return dict(fields, ia_text=ia_text, model=metrics.get("model", model))
+
+
+class LargeModelTier(TriageTier):
+    """Gros modèle (GPT, modèle et budget choisis par le routeur): répond toujours ou lève une erreur"""
+
+    name = "large_model"
+    cacheable = True
+
+    def answer(self, ctx: TriageContext) -> Optional[Dict[str, Any]]:
+        if not ctx.api_key:
+            raise RuntimeError("Aucune clé API disponible (ni personnelle, ni par défaut)")
+        from gpt_analysis import analyze_payload_with_gpt
+        ia_response = analyze_payload_with_gpt(ctx.payload_dict, ctx.api_key, custom_prompt=ctx.custom_prompt,
+                                               model=ctx.routing["gpt_model"], max_tokens=ctx.routing["max_tokens"])
+        record_gpt_call(ia_response, "triage", ctx.user_id, ctx.pattern_nom, ctx.routing["tier"])
+        if not ia_response.get("success", False):
+            raise RuntimeError(ia_response.get("error", "Erreur inconnue lors de l'analyse IA"))
+        ia_text = ia_response.get("analysis", "")
+        fields = extract_analysis_fields(ia_text, ctx.pattern_nom)
+        return dict(fields, ia_text=ia_text, model=ia_response.get("model"))
+
+
+class TierMetrics:
+    """Compteurs par niveau: appels, réponses, latence (moyenne et percentiles sur une fenêtre glissante)"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self._metrics: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def register(self, name: str) -> None:
+        with self._lock:
+            self._metrics.setdefault(name, {
+                "calls": 0, "hits": 0, "errors": 0, "total_ms": 0.0, "samples": deque(maxlen=self._window)
+            })
+
+    def record(self, name: str, latency_ms: float, hit: bool, error: bool = False) -> None:
+        with self._lock:
+            metrics = self._metrics[name]
+            metrics["calls"] += 1
+            metrics["total_ms"] += latency_ms
+            metrics["samples"].append(latency_ms)
+            if hit:
+                metrics["hits"] += 1
+            if error:
+                metrics["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = OrderedDict()
+            for name, metrics in self._metrics.items():
+                samples = sorted(metrics["samples"])
+                calls = metrics["calls"]
+                result[name] = {
+                    "calls": calls,
+                    "hits": metrics["hits"],
+                    "errors": metrics["errors"],
+                    "hit_rate": round(metrics["hits"] / calls, 3) if calls else 0,
+                    "avg_ms": round(metrics["total_ms"] / calls, 2) if calls else None,
+                    "p50_ms": round(samples[len(samples) // 2], 2) if samples else None,
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None,
+                }
+            return result
+
+
+class TriagePipeline:
+    """Exécute les niveaux dans l'ordre; le premier qui répond court-circuite les suivants"""
+
+    def __init__(self, tiers: List[TriageTier], cache: Optional[AnalysisCache] = None):
+        self.tiers = tiers
+        self.cache = cache
+        self.metrics = TierMetrics()
+        for tier in tiers:
+            self.metrics.register(tier.name)
+
+    def run(self, ctx: TriageContext) -> Dict[str, Any]:
+        trace = []
+        errors = []
+        for tier in self.tiers:
+            start = time.perf_counter()
+            try:
+                result = tier.answer(ctx)
+            except Exception as e:
+                latency_ms = (time.perf_counter() - start) * 1000
+                self.metrics.record(tier.name, latency_ms, hit=False, error=True)
+                trace.append({"tier": tier.name, "ms": round(latency_ms, 2), "error": str(e)})
+                errors.append(str(e))
+                logger.error(f"❌ Niveau {tier.name} en erreur: {e}")
+                continue
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.metrics.record(tier.name, latency_ms, hit=result is not None)
+            trace.append({"tier": tier.name, "ms": round(latency_ms, 2), "hit": result is not None})
+            if result is not None:
+                if tier.cacheable and self.cache is not None:
+                    self.cache.put(ctx.fingerprint, result)
+                logger.info(f"🎯 Triage résolu par le niveau {tier.name} en {latency_ms:.1f} ms")
+                return dict(result, tier=tier.name, trace=trace)
+        raise RuntimeError(errors[-1] if errors else "Aucun niveau n'a pu analyser le payload")
+
+
+def build_default_pipeline(retriever_url: str) -> TriagePipeline:
+    """Pipeline règles -> cache -> petit modèle (si activé) -> gros modèle"""
+    cache = AnalysisCache()
+    tiers: List[TriageTier] = [RulesTier(), CacheTier(cache)]
+    if SMALL_MODEL_ENABLED:
+        tiers.append(SmallModelTier(retriever_url))
+    tiers.append(LargeModelTier())
+    return TriagePipeline(tiers, cache)